@@ -0,0 +1,82 @@
+import os
+import gc
+import logging
+import resource
+from collections import OrderedDict
+from bindiff_cache import file_sha256
+
+# Limits of the per-process angr project cache
+max_projects = int(os.environ.get('ANGR_POOL_MAX_PROJECTS', 32))
+max_memory_mb = int(os.environ.get('ANGR_POOL_MAX_MB', 4096))
+
+# Estimated memory of a project per MB of binary, used when the load showed no RSS growth
+# (e.g. the peak-RSS fallback on macOS, which only grows past earlier peaks)
+size_factor = float(os.environ.get('ANGR_POOL_SIZE_FACTOR', 20))
+
+# Loaded projects in least recently used order, keyed by (real path, sha256)
+_projects = OrderedDict()
+# Estimated memory of every cached project in MB, measured when it was loaded
+_project_sizes = {}
+# Sizes measured at earlier loads; a reload into freed memory shows little RSS growth
+_measured_sizes = {}
+_stats = {'hits': 0, 'loads': 0, 'evictions': 0}
+
+
+# Function to get the current resident memory of this process in MB
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # No /proc (macOS): fall back to the peak RSS, reported in bytes there
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+# Function to drop least recently used projects until the pool is within its limits
+# The memory limit applies to the estimated sizes of the cached projects, not to the live RSS:
+# freed memory is rarely returned to the OS, so the RSS would keep the pool at one project
+def _evict():
+    while _projects and (len(_projects) > max_projects or
+                         (len(_projects) > 1 and sum(_project_sizes.values()) > max_memory_mb)):
+        key, _ = _projects.popitem(last=False)
+        _project_sizes.pop(key, None)
+        _stats['evictions'] += 1
+        logging.debug(f"Evicted angr project for {key[0]}")
+        gc.collect()
+
+
+# Function to get the angr project of a binary, loading it at most once per process
+def get_project(binary_path):
+    key = (os.path.realpath(binary_path), file_sha256(binary_path))
+    project = _projects.get(key)
+    if project is not None:
+        _projects.move_to_end(key)
+        _stats['hits'] += 1
+        return project
+
+    import angr
+    rss_before = current_rss_mb()
+    project = angr.Project(binary_path, auto_load_libs=False)
+    growth = current_rss_mb() - rss_before
+    _projects[key] = project
+    if growth > 0:
+        _measured_sizes[key] = max(growth, _measured_sizes.get(key, 0.0))
+    _project_sizes[key] = _measured_sizes.get(key) or os.path.getsize(binary_path) / (1024 * 1024) * size_factor
+    _stats['loads'] += 1
+    _evict()
+    return project
+
+
+# Function to empty the pool (e.g. between independent runs)
+def clear_project_pool():
+    _projects.clear()
+    _project_sizes.clear()
+    gc.collect()
+
+
+# Function to report how well the pool is doing
+def project_pool_stats():
+    return dict(_stats, cached=len(_projects), cached_mb=round(sum(_project_sizes.values()), 1),
+                rss_mb=round(current_rss_mb(), 1))
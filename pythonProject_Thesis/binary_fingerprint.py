@@ -0,0 +1,63 @@
+import os
+from bindiff_cache import file_sha256
+
+# Skip BinDiff for pairs whose inputs are byte-identical (opt-in with BINDIFF_PREFILTER=1)
+# Skipped pairs get no .BinDiff file, so the function-level analyses (threshold, kde, always-one)
+# do not see them
+prefilter_enabled = os.environ.get('BINDIFF_PREFILTER', '0') == '1'
+
+
+# Function to get the ELF executable a .BinExport was exported from (same name without the extension)
+def executable_for(binexport_path):
+    if binexport_path.endswith('.BinExport'):
+        executable = binexport_path[:-len('.BinExport')]
+        if os.path.isfile(executable):
+            return executable
+    return None
+
+
+# Function to compare the fingerprints of a job's two inputs
+# Returns 'identical' if the executables (or, without them, the BinExport files) have the same
+# bytes, else None. Functions with identical code are left to BinDiff: code that differs only in
+# relocated call targets is not identical, and telling those apart needs a disassembler
+def compare_job(job):
+    primary_executable = executable_for(job['primary'])
+    secondary_executable = executable_for(job['secondary'])
+    if primary_executable is None or secondary_executable is None:
+        # Without the executables only identical BinExport files can be recognized
+        primary_executable, secondary_executable = job['primary'], job['secondary']
+    return 'identical' if file_sha256(primary_executable) == file_sha256(secondary_executable) else None
+
+
+# Function to build the result of a pair decided by its fingerprints (similarity 1.0, reported in percent)
+def prefiltered_result(verdict):
+    return {'output_file': None, 'log_file': None, 'stdout': f'Skipped BinDiff: {verdict} fingerprints\n',
+            'stderr': '', 'returncode': 0, 'similarity': 100.0, 'elapsed': 0.0, 'cpu_seconds': None,
+            'peak_rss_mb': None, 'status': 'prefiltered'}
+
+
+# Function to split jobs into the ones BinDiff still has to run and the ones decided by fingerprints
+# Returns (remaining jobs, [(job, result)] of the decided ones, stats)
+def prefilter_jobs(jobs):
+    stats = {'pairs': 0, 'identical': 0, 'bindiff': 0}
+    remaining = []
+    decided = []
+    for job in jobs:
+        stats['pairs'] += 1
+        verdict = compare_job(job)
+        if verdict is None:
+            remaining.append(job)
+            stats['bindiff'] += 1
+        else:
+            decided.append((job, prefiltered_result(verdict)))
+            stats[verdict] += 1
+    return remaining, decided, stats
+
+
+# Function to print how much BinDiff work the fingerprints saved
+def prefilter_report(stats):
+    if not stats['pairs']:
+        return
+    skipped = stats['identical']
+    print(f"Fingerprint pre-filter: {skipped} of {stats['pairs']} pairs are byte-identical and skip BinDiff "
+          f"({100.0 * skipped / stats['pairs']:.1f}%); {stats['bindiff']} pairs go to BinDiff")
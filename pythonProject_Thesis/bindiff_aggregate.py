@@ -0,0 +1,123 @@
+import sqlite3
+
+# Attached databases per connection we ask SQLite for; it grants at most its compile-time
+# SQLITE_MAX_ATTACHED (10 unless SQLite was built with a higher value, at most 125)
+requested_attach_limit = 125
+
+
+# Function to combine the count, mean and M2 (sum of squared deviations) of two sets of scores
+# Chan et al. pairwise combination, like SimilarityMatrix.merge; returns (n, mean, m2)
+def merge_moments(n_a, mean_a, m2_a, n_b, mean_b, m2_b):
+    n = n_a + n_b
+    if not n:
+        return 0, 0.0, 0.0
+    delta = mean_b - mean_a
+    return n, mean_a + delta * n_b / n, m2_a + m2_b + delta * delta * n_a * n_b / n
+
+
+# Function to open the in-memory connection the .BinDiff files are attached to (read-only)
+def open_aggregate_connection():
+    conn = sqlite3.connect('file::memory:', uri=True)
+    conn.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, requested_attach_limit)
+    return conn
+
+
+# Function to get how many databases can be attached next to main at the same time
+def attach_limit(conn):
+    return max(conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED), 1)
+
+
+# Function to attach .BinDiff files in batches; yields [(alias, path)] while the batch is attached
+# Unreadable files and files without a function table are reported and left out of the batch
+def attached_batches(conn, files):
+    limit = attach_limit(conn)
+    files = list(files)
+    for start in range(0, len(files), limit):
+        batch = []
+        try:
+            for i, path in enumerate(files[start:start + limit]):
+                alias = f"bd{i}"
+                try:
+                    conn.execute("ATTACH DATABASE ? AS " + alias, (f'file:{path}?mode=ro',))
+                except sqlite3.Error as e:
+                    print(f"SQLite error in {path}: {e}")
+                    continue
+                try:
+                    found = conn.execute(f"SELECT 1 FROM {alias}.sqlite_master "
+                                         f"WHERE type = 'table' AND name = 'function'").fetchone()
+                except sqlite3.Error as e:
+                    found = None
+                    print(f"SQLite error in {path}: {e}")
+                if found is None:
+                    conn.execute("DETACH DATABASE " + alias)
+                    continue
+                batch.append((alias, path))
+            if batch:
+                yield batch
+        finally:
+            for alias, _ in batch:
+                conn.execute("DETACH DATABASE " + alias)
+
+
+# Function to build one UNION ALL over the function tables of an attached batch
+# Every branch gets the batch index of its file as column "file"
+def _union_query(batch, columns, where=None):
+    condition = f" WHERE {where}" if where else ""
+    return " UNION ALL ".join(f"SELECT {i} AS file, {columns} FROM {alias}.function{condition}"
+                              for i, (alias, _) in enumerate(batch))
+
+
+# Function to compute histogram buckets and moments of the similarity scores of many .BinDiff files
+# Bucketing, counting and the sums are done by SQLite; only one row per bucket reaches Python
+# Returns {'buckets': {bucket: count}, 'n', 'mean', 'm2', 'min', 'max'}; scores outside
+# value_range land in the first/last bucket like ScoreHistogram.add
+def similarity_histogram(files, bins, value_range=(0.0, 1.0), conn=None):
+    low, high = value_range
+    scale = bins / (high - low)
+    aggregates = {'buckets': {}, 'n': 0, 'mean': 0.0, 'm2': 0.0, 'min': None, 'max': None}
+    own_conn = conn is None
+    conn = conn or open_aggregate_connection()
+    try:
+        for batch in attached_batches(conn, files):
+            scores = _union_query(batch, 'similarity', 'similarity IS NOT NULL')
+            # Count, mean and range in a plain scan; the GROUP BY then sums the squared deviations
+            # from the batch mean (two-pass, so the variance does not cancel like sum(x^2) - n*mean^2)
+            n, mean, minimum, maximum = conn.execute(
+                f"SELECT COUNT(*), AVG(similarity), MIN(similarity), MAX(similarity) FROM ({scores})").fetchone()
+            if not n:
+                continue
+            aggregates['min'] = minimum if aggregates['min'] is None else min(aggregates['min'], minimum)
+            aggregates['max'] = maximum if aggregates['max'] is None else max(aggregates['max'], maximum)
+            buckets = aggregates['buckets']
+            m2 = 0.0
+            query = (f"SELECT CAST((similarity - ?) * ? AS INTEGER) AS bucket, COUNT(*), "
+                     f"SUM((similarity - ?) * (similarity - ?)) FROM ({scores}) GROUP BY bucket")
+            for bucket, count, squares in conn.execute(query, (low, scale, mean, mean)):
+                bucket = min(max(bucket, 0), bins - 1)
+                buckets[bucket] = buckets.get(bucket, 0) + count
+                m2 += squares
+            aggregates['n'], aggregates['mean'], aggregates['m2'] = merge_moments(
+                aggregates['n'], aggregates['mean'], aggregates['m2'], n, mean, m2)
+    finally:
+        if own_conn:
+            conn.close()
+    return aggregates
+
+
+# Function to find the function pairs BinDiff matched with similarity 1, for many .BinDiff files
+# The similarity = 1 filter runs inside SQLite; returns {path: [(name1, name2)]} for every readable file
+def identical_function_pairs(files, conn=None):
+    pairs = {}
+    own_conn = conn is None
+    conn = conn or open_aggregate_connection()
+    try:
+        for batch in attached_batches(conn, files):
+            for _, path in batch:
+                pairs[path] = []
+            for file, name1, name2 in conn.execute(_union_query(batch, 'name1, name2', 'similarity = 1.0')):
+                pairs[batch[file][1]].append((name1, name2))
+    finally:
+        if own_conn:
+            conn.close()
+    return pairs
+
@@ -0,0 +1,237 @@
+import os
+import time
+import queue
+import random
+import signal
+import asyncio
+import threading
+from bindiff_cache import cache_key, lookup, place_file, store
+from bindiff_results import bindiff_output_name, read_overall_similarity
+from bindiff_scheduler import default_max_workers
+from bindiff_metrics import read_cpu_seconds, read_peak_rss_mb
+
+# Per-job limits and retry policy (0 disables a limit)
+default_timeout = float(os.environ.get('BINDIFF_TIMEOUT', 3600))
+default_retries = int(os.environ.get('BINDIFF_RETRIES', 2))
+default_backoff = float(os.environ.get('BINDIFF_BACKOFF', 5))
+default_memory_limit_mb = int(os.environ.get('BINDIFF_MEMORY_LIMIT_MB', 0))
+
+# How often the peak RSS and CPU time of a running bindiff process are sampled (s)
+usage_poll_interval = float(os.environ.get('BINDIFF_USAGE_POLL', 0.5))
+
+
+# Function to build the preexec hook that caps the address space of a BinDiff process
+def _memory_limiter(memory_limit_mb):
+    if not memory_limit_mb:
+        return None
+
+    def limit():
+        import resource
+        limit_bytes = memory_limit_mb * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, limit_bytes))
+        except (ValueError, OSError):
+            pass
+    return limit
+
+
+# Function to read the end of a log file for the failure summary
+def _log_tail(log_file, max_bytes=2000):
+    try:
+        with open(log_file, 'rb') as lf:
+            lf.seek(0, os.SEEK_END)
+            lf.seek(max(0, lf.tell() - max_bytes))
+            return lf.read().decode(errors='replace')
+    except OSError:
+        return ''
+
+
+# Function to sample peak RSS and CPU time of a process until it exits
+# asyncio reaps the child itself, so its rusage is not available after the fact
+async def _watch_usage(pid, usage):
+    while True:
+        peak_rss_mb = read_peak_rss_mb(pid)
+        cpu_seconds = read_cpu_seconds(pid)
+        if peak_rss_mb is not None:
+            usage['peak_rss_mb'] = max(peak_rss_mb, usage.get('peak_rss_mb') or 0.0)
+        if cpu_seconds is not None:
+            usage['cpu_seconds'] = cpu_seconds
+        await asyncio.sleep(usage_poll_interval)
+
+
+# Function to place a cached result (and its log, if wanted) at the job's output paths
+def _place_cached(directory, output_file, log_file):
+    place_file(os.path.join(directory, 'result.BinDiff'), output_file)
+    if log_file is not None:
+        place_file(os.path.join(directory, 'result.log'), log_file)
+
+
+# Function to run one BinDiff job with a timeout, retries and output streamed to its log file
+# on_start(job) is called when the job gets a worker slot, i.e. when BinDiff actually starts
+async def run_job_async(job, semaphore, timeout=None, retries=None, backoff=None, memory_limit_mb=None,
+                        retry_timeouts=False, on_start=None):
+    timeout = default_timeout if timeout is None else timeout
+    retries = default_retries if retries is None else retries
+    backoff = default_backoff if backoff is None else backoff
+    memory_limit_mb = default_memory_limit_mb if memory_limit_mb is None else memory_limit_mb
+
+    primary = job['primary']
+    secondary = job['secondary']
+    output_dir = job['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, bindiff_output_name(primary, secondary))
+    log_file = output_file[:-len('.BinDiff')] + '.log'
+    result = {
+        'output_file': output_file,
+        'log_file': log_file if job.get('capture_log', True) else None,
+        'stdout': '',
+        'stderr': '',
+        'returncode': None,
+        'similarity': None,
+        'status': 'failed',
+        'attempts': 0,
+        'elapsed': 0.0,
+        'cpu_seconds': None,
+        'peak_rss_mb': None,
+    }
+
+    # Hashing the inputs and copying cache entries is blocking file I/O, kept off the event loop
+    try:
+        key = await asyncio.to_thread(cache_key, primary, secondary)
+    except OSError as e:
+        result.update(status='error', stderr=str(e))
+        return result
+    directory = lookup(key)
+    if directory is not None:
+        await asyncio.to_thread(_place_cached, directory, output_file, result['log_file'])
+        result.update(status='cached', returncode=0, similarity=read_overall_similarity(output_file))
+        return result
+
+    cmd = ['bindiff', '--primary', primary, '--secondary', secondary, '--output_dir', output_dir]
+    # A result left by an earlier diff must never be read as the result of this one
+    if os.path.isfile(output_file):
+        os.remove(output_file)
+    started = None
+    for attempt in range(retries + 1):
+        if attempt:
+            # Exponential backoff with jitter so retried jobs do not restart in lockstep;
+            # the worker slot is free while waiting, so other jobs run in the meantime
+            await asyncio.sleep(backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+        async with semaphore:
+            if started is None:
+                if on_start is not None:
+                    on_start(job)
+                started = time.monotonic()
+            result['attempts'] = attempt + 1
+            print(f"Running: {' '.join(cmd)} (attempt {attempt + 1})")
+            # stdout and stderr go straight into the log file instead of memory
+            with open(log_file if result['log_file'] else os.devnull, 'wb') as lf:
+                try:
+                    process = await asyncio.create_subprocess_exec(
+                        *cmd, stdout=lf, stderr=asyncio.subprocess.STDOUT,
+                        preexec_fn=_memory_limiter(memory_limit_mb), start_new_session=True)
+                except OSError as e:
+                    result.update(status='error', stderr=str(e))
+                    break
+                usage = {}
+                watcher = asyncio.ensure_future(_watch_usage(process.pid, usage))
+                try:
+                    returncode = await asyncio.wait_for(process.wait(), timeout or None)
+                except asyncio.TimeoutError:
+                    # Kill the whole process group, including anything bindiff spawned
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    await process.wait()
+                    result.update(status='timeout', returncode=None,
+                                  stderr=f"Timed out after {timeout:.0f}s")
+                    if retry_timeouts:
+                        continue
+                    break
+                finally:
+                    watcher.cancel()
+                    result.update(usage)
+            result['returncode'] = returncode
+            if returncode == 0 and os.path.isfile(output_file):
+                result['status'] = 'ok'
+                break
+            result.update(status='failed', stderr=_log_tail(log_file) if result['log_file'] else '')
+    result['elapsed'] = time.monotonic() - started
+
+    if result['status'] == 'ok':
+        result['similarity'] = read_overall_similarity(output_file)
+        stdout = ''
+        if result['log_file'] is not None:
+            with open(log_file, 'r', errors='replace') as lf:
+                stdout = lf.read()
+        await asyncio.to_thread(store, key, output_file, stdout, primary, secondary)
+    return result
+
+
+# Function to run all jobs on an event loop, putting (job, result) on a queue as they finish
+async def _run_all(jobs, max_workers, results, **limits):
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def run_one(job):
+        try:
+            result = await run_job_async(job, semaphore, **limits)
+        except Exception as e:
+            result = {'output_file': None, 'log_file': None, 'stdout': '', 'stderr': str(e), 'returncode': None,
+                      'similarity': None, 'status': 'error', 'attempts': 0, 'elapsed': 0.0}
+        results.put((job, result))
+
+    await asyncio.gather(*(run_one(job) for job in jobs))
+
+
+# Function to run BinDiff jobs on an asyncio runner, yielding (job, result) as they finish
+# limits: timeout (s), retries, backoff (s), memory_limit_mb, retry_timeouts; on_start(job) is called
+# (on the runner thread) when a job actually starts
+def run_bindiff_jobs_async(jobs, max_workers=None, **limits):
+    jobs = list(jobs)
+    if max_workers is None:
+        max_workers = default_max_workers
+    results = queue.Queue()
+    errors = []
+
+    def run_loop():
+        try:
+            asyncio.run(_run_all(jobs, max_workers, results, **limits))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            results.put(None)
+
+    thread = threading.Thread(target=run_loop, daemon=True)
+    thread.start()
+    while True:
+        item = results.get()
+        if item is None:
+            break
+        yield item
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+# Function to check whether a job result is a failure (batch results carry no status)
+def is_failure(result):
+    status = result.get('status')
+    if status is not None:
+        return status not in ('ok', 'cached', 'prefiltered')
+    return result.get('returncode') != 0
+
+
+# Function to print the failed pairs of a sweep instead of dropping them silently
+def summarize_failures(job_results):
+    failed = [(job, result) for job, result in job_results if is_failure(result)]
+    if not failed:
+        print(f"All {len(job_results)} BinDiff jobs succeeded.")
+        return failed
+    print(f"{len(failed)} of {len(job_results)} BinDiff jobs failed:")
+    for job, result in failed:
+        reason = (result.get('stderr') or '').strip().splitlines()
+        print(f"  [{result.get('status')}] {job['primary_label']} vs {job['secondary_label']}: "
+              f"{os.path.basename(job['primary'])} after {result.get('attempts', 0)} attempt(s)"
+              f"{' - ' + reason[-1] if reason else ''}")
+    return failed
@@ -0,0 +1,224 @@
+import os
+import shutil
+import sqlite3
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from bindiff_cache import cache_key, lookup, store, place_file
+from bindiff_scheduler import default_max_workers
+from bindiff_results import bindiff_output_name, export_stem, open_bindiff_readonly, read_overall_similarity
+from bindiff_metrics import run_measured
+
+# Separator between configuration label and binary name in staged file names
+label_separator = '@'
+
+
+# Function to give a staged BinExport a name that is unique per configuration
+# BinDiff's directory mode diffs every pair with the name that sorts first as the primary, so
+# the name starts with the configuration's rank in the batch (see primary_order)
+def staged_name(rank, label, file):
+    return f"{rank:03d}-{label}{label_separator}{file}"
+
+
+# Function to rank the configurations of a batch so that every job's primary sorts before its secondary
+# Returns {label: rank}. Jobs are planned from combinations of one configuration list, so such an
+# order exists; if jobs contradict each other (a cycle), the first configuration left is taken
+def primary_order(jobs):
+    labels = list(dict.fromkeys(job[f'{side}_label'] for job in jobs for side in ('primary', 'secondary')))
+    edges = {(job['primary_label'], job['secondary_label']) for job in jobs}
+    order = []
+    while labels:
+        ready = [label for label in labels if not any((other, label) in edges for other in labels)]
+        label = ready[0] if ready else labels[0]
+        order.append(label)
+        labels.remove(label)
+    return {label: rank for rank, label in enumerate(order)}
+
+
+# Function to read the primary/secondary file names recorded inside a .BinDiff file
+def read_diffed_files(bindiff_file):
+    try:
+        conn = open_bindiff_readonly(bindiff_file)
+        try:
+            rows = conn.execute("SELECT id, filename FROM file ORDER BY id").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    if len(rows) != 2:
+        return None
+    return rows[0][1], rows[1][1]
+
+
+# Function to map a produced .BinDiff file back to the (primary, secondary) staged stems
+def match_output(bindiff_file, stems):
+    name = os.path.basename(bindiff_file)
+    if name.endswith('.BinDiff'):
+        name = name[:-len('.BinDiff')]
+    # Output files are named <primary>_vs_<secondary>; labels may contain '_vs_'
+    # themselves, so try every known stem as the primary side
+    for stem in stems:
+        prefix = f"{stem}_vs_"
+        if name.startswith(prefix) and name[len(prefix):] in stems:
+            return stem, name[len(prefix):]
+    # Fall back to the file names BinDiff recorded in the result database
+    recorded = read_diffed_files(bindiff_file)
+    if recorded is not None:
+        primary, secondary = (export_stem(os.path.basename(f)) for f in recorded)
+        if primary in stems and secondary in stems:
+            return primary, secondary
+    return None
+
+
+# Function to run one BinDiff batch over all configurations of a single binary
+# All jobs must share the same binary; returns a list of (job, result)
+def run_bindiff_batch(jobs, batch_root, on_start=None):
+    binary = os.path.basename(jobs[0]['primary'])
+    batch_dir = os.path.join(batch_root, export_stem(binary))
+    out_dir = os.path.join(batch_dir, 'out')
+    shutil.rmtree(batch_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+
+    # Stage every configuration of this binary once, under a per-configuration name
+    ranks = primary_order(jobs)
+    stems = {}
+    for job in jobs:
+        for side in ('primary', 'secondary'):
+            label = job[f'{side}_label']
+            name = staged_name(ranks[label], label, binary)
+            staged_path = os.path.join(batch_dir, name)
+            if not os.path.lexists(staged_path):
+                os.symlink(os.path.abspath(job[side]), staged_path)
+            stems[export_stem(name)] = label
+
+    cmd = ['bindiff', '--primary', batch_dir, '--output_dir', out_dir]
+    if on_start is not None:
+        for job in jobs:
+            on_start(job)
+    print(f"Running batch: {' '.join(cmd)}")
+    stdout, stderr, returncode, usage = run_measured(cmd)
+    result = subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+    batch_log = os.path.join(batch_dir, 'batch.log')
+    with open(batch_log, 'w') as lf:
+        lf.write(result.stdout)
+    if result.returncode != 0:
+        print(f"Error running BinDiff batch for {binary}: {result.stderr}")
+
+    # Map every produced .BinDiff back to (config_i, config_j)
+    produced = {}
+    for file in os.listdir(out_dir):
+        if file.endswith('.BinDiff'):
+            match = match_output(os.path.join(out_dir, file), stems)
+            if match is not None:
+                produced[(stems[match[0]], stems[match[1]])] = os.path.join(out_dir, file)
+
+    results = []
+    for job in jobs:
+        labels = (job['primary_label'], job['secondary_label'])
+        # BinDiff is not symmetric: a result of the reversed pair is never used (or cached) for this job
+        source = produced.get(labels)
+        job_result = _place_batch_result(job, source, result)
+        if source is None and labels[::-1] in produced:
+            job_result['stderr'] = f"Batch diffed {labels[1]} vs {labels[0]} instead of {labels[0]} vs {labels[1]}"
+        # One process diffed the whole batch: time is shared out over its pairs, the peak RSS is the batch's
+        job_result.update(elapsed=usage['elapsed'] / len(jobs), cpu_seconds=usage['cpu_seconds'] / len(jobs),
+                          peak_rss_mb=usage['peak_rss_mb'])
+        results.append((job, job_result))
+    return results
+
+
+# Function to write the log of one pair of a batch
+# The batch log covers every pair of the binary, so the pair's log is built from its .BinDiff,
+# with the similarity line in the format BinDiff prints (read back by the log parsers)
+def pair_log(primary, secondary, similarity):
+    lines = [f"Diffed {os.path.basename(primary)} vs {os.path.basename(secondary)} in a BinDiff batch"]
+    if similarity is not None:
+        lines.append(f"Similarity: {similarity:.4f}%")
+    return '\n'.join(lines) + '\n'
+
+
+# Function to move a batch output to the per-pair location the pair mode would have used
+def _place_batch_result(job, source, batch_result):
+    primary = job['primary']
+    secondary = job['secondary']
+    os.makedirs(job['output_dir'], exist_ok=True)
+    output_file = os.path.join(job['output_dir'], bindiff_output_name(primary, secondary))
+    if source is None:
+        return {
+            'output_file': None,
+            'log_file': None,
+            'stdout': batch_result.stdout,
+            'stderr': batch_result.stderr or f"No batch output for {primary} vs {secondary}",
+            'returncode': batch_result.returncode or 1,
+            'similarity': None,
+        }
+    place_file(source, output_file)
+    similarity = read_overall_similarity(output_file)
+    stdout = pair_log(primary, secondary, similarity)
+    try:
+        store(cache_key(primary, secondary), output_file, stdout, primary, secondary)
+    except OSError:
+        pass
+    return {
+        'output_file': output_file,
+        'log_file': None,
+        'stdout': stdout,
+        'stderr': '',
+        'returncode': 0,
+        'similarity': similarity,
+    }
+
+
+# Function to serve a job from the BinDiff cache, returns None on a miss
+def _cached_result(job):
+    try:
+        directory = lookup(cache_key(job['primary'], job['secondary']))
+    except OSError:
+        return None
+    if directory is None:
+        return None
+    os.makedirs(job['output_dir'], exist_ok=True)
+    output_file = os.path.join(job['output_dir'], bindiff_output_name(job['primary'], job['secondary']))
+    place_file(os.path.join(directory, 'result.BinDiff'), output_file)
+    try:
+        with open(os.path.join(directory, 'result.log'), 'r', errors='replace') as lf:
+            stdout = lf.read()
+    except OSError:
+        stdout = ''
+    return {
+        'output_file': output_file,
+        'log_file': None,
+        'stdout': stdout,
+        'stderr': '',
+        'returncode': 0,
+        'similarity': read_overall_similarity(output_file),
+    }
+
+
+# Function to run jobs in batch mode: one bindiff process per binary instead of one per pair
+# Yields (job, result) like run_bindiff_jobs_async, with the similarity read from the .BinDiff file
+# on_start(job) is called (on a worker thread) when the batch holding the job starts
+def run_bindiff_batches(jobs, batch_root, max_workers=None, on_start=None):
+    if max_workers is None:
+        max_workers = default_max_workers
+
+    groups = {}
+    for job in jobs:
+        cached = _cached_result(job)
+        if cached is not None:
+            yield job, cached
+            continue
+        groups.setdefault(os.path.basename(job['primary']), []).append(job)
+
+    print(f"Running {len(groups)} BinDiff batches on {max_workers} workers")
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(run_bindiff_batch, group, batch_root, on_start): group for group in groups.values()}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                group = futures[future]
+                print(f"BinDiff batch failed for {os.path.basename(group[0]['primary'])}: {e}")
+                results = [(job, {'output_file': None, 'log_file': None, 'stdout': '', 'stderr': str(e),
+                                  'returncode': None, 'similarity': None}) for job in group]
+            for job, result in results:
+                yield job, result
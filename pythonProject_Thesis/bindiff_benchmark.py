@@ -0,0 +1,298 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import importlib
+import resource
+import subprocess
+import multiprocessing
+from itertools import combinations
+
+# File in the work directory that benchmark runs are appended to, one JSON object per line
+results_file_name = 'benchmark_results.jsonl'
+
+# Slowdown (relative to the previous comparable run) reported as a regression
+regression_threshold = 0.20
+
+# Table layout of the .BinDiff SQLite databases written by BinDiff
+bindiff_schema = [
+    '''CREATE TABLE metadata (version TEXT, file1 INTEGER, file2 INTEGER, description TEXT,
+                              created DATE, modified DATE, similarity DOUBLE PRECISION,
+                              confidence DOUBLE PRECISION)''',
+    '''CREATE TABLE file (id INTEGER PRIMARY KEY, filename TEXT, exefilename TEXT, hash CHARACTER(40),
+                          functions INT, libfunctions INT, calls INT, basicblocks INT, libbasicblocks INT,
+                          edges INT, libedges INT, instructions INT, libinstructions INT)''',
+    '''CREATE TABLE function (id INTEGER PRIMARY KEY, address1 BIGINT, name1 TEXT, address2 BIGINT, name2 TEXT,
+                              similarity DOUBLE PRECISION, confidence DOUBLE PRECISION, flags INTEGER,
+                              algorithm SMALLINT, evaluate BOOLEAN, commentsported BOOLEAN,
+                              basicblocks INTEGER, edges INTEGER, instructions INTEGER,
+                              UNIQUE (address1, address2))''',
+]
+
+
+# Function to write one synthetic .BinDiff database with the given number of matched functions
+def generate_bindiff_file(path, primary, secondary, functions, rng):
+    conn = sqlite3.connect(path)
+    for statement in bindiff_schema:
+        conn.execute(statement)
+    # Roughly a third of the functions are identical, the rest spread over (0, 1)
+    scores = [1.0 if rng.random() < 0.35 else rng.betavariate(5, 2) for _ in range(functions)]
+    overall = sum(scores) / functions if functions else 0.0
+    conn.execute("INSERT INTO metadata VALUES ('BinDiff 8 (synthetic)', 1, 2, '', date('now'), date('now'), ?, ?)",
+                 (overall, rng.uniform(0.8, 1.0)))
+    for file_id, name in ((1, primary), (2, secondary)):
+        conn.execute("INSERT INTO file (id, filename, exefilename, hash, functions) VALUES (?, ?, ?, ?, ?)",
+                     (file_id, name, name, f"{rng.getrandbits(160):040x}", functions))
+    conn.executemany("INSERT INTO function VALUES (?, ?, ?, ?, ?, ?, ?, 0, 1, 0, 0, ?, ?, ?)",
+                     ((i, 0x401000 + 16 * i, f"func_{i}", 0x401000 + 16 * i, f"func_{i}", score,
+                       rng.uniform(0.5, 1.0), rng.randint(1, 40), rng.randint(0, 60), rng.randint(5, 400))
+                      for i, score in enumerate(scores)))
+    conn.commit()
+    conn.close()
+
+
+# Function to generate a corpus of .BinDiff files for every configuration pair of every binary
+# Files are named <config>_<binary>_vs_<config>_<binary>.BinDiff like the save-log sweep writes them
+def generate_corpus(directory, configurations, binaries, functions, seed=0):
+    rng = random.Random(seed)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    configs = [f"cfg{i}" for i in range(configurations)]
+    files = []
+    for b in range(binaries):
+        binary = f"bin{b}.BinExport"
+        for primary, secondary in combinations(configs, 2):
+            path = os.path.join(directory, f"{primary}_{binary}_vs_{secondary}_{binary}.BinDiff")
+            generate_bindiff_file(path, f"{primary}_{binary}", f"{secondary}_{binary}", functions, rng)
+            files.append(path)
+    return files
+
+
+# Benchmark stages; each returns the number of function rows it processed
+def stage_extract_similarity_scores(corpus):
+    from similarity_ingest import extract_similarity_scores_from_sqlite
+    return sum(len(extract_similarity_scores_from_sqlite(path)) for path in _corpus_files(corpus))
+
+
+def stage_ingest(corpus):
+    from similarity_ingest import ingest_bindiff_results
+    db_path = os.path.join(os.path.dirname(corpus), 'benchmark_similarity_scores.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    stats = ingest_bindiff_results(conn, corpus)
+    conn.close()
+    return stats['rows']
+
+
+def stage_reingest(corpus):
+    # Runs after stage_ingest: measures the no-op cost of an unchanged results directory
+    from similarity_ingest import ingest_bindiff_results
+    conn = sqlite3.connect(os.path.join(os.path.dirname(corpus), 'benchmark_similarity_scores.db'))
+    stats = ingest_bindiff_results(conn, corpus)
+    conn.close()
+    return stats['rows']
+
+
+def stage_score_histograms(corpus):
+    from run_bindiff_paiswise_sd2_DONE import aggregate_scores_by_compiler, group_files_by_compiler
+    grouped_scores = aggregate_scores_by_compiler(group_files_by_compiler(corpus))
+    return sum(histogram.n for histogram in grouped_scores.values())
+
+
+def stage_per_file_histogram(corpus):
+    # One connection per file with every score fetched into NumPy, the pre-pushdown path
+    from score_histogram import ScoreHistogram, add_bindiff_file
+    histogram = ScoreHistogram()
+    for path in _corpus_files(corpus):
+        add_bindiff_file(histogram, path)
+    return histogram.n
+
+
+def stage_pushdown_histogram(corpus):
+    from score_histogram import ScoreHistogram, add_bindiff_files
+    return add_bindiff_files(ScoreHistogram(), _corpus_files(corpus)).n
+
+
+def stage_per_file_identical(corpus):
+    # One connection per file with every function row fetched and filtered in Python, the pre-pushdown path
+    from bindiff_results import open_bindiff_readonly
+    identical = 0
+    for path in _corpus_files(corpus):
+        conn = open_bindiff_readonly(path)
+        try:
+            identical += sum(1 for _, score in conn.execute("SELECT name1, similarity FROM function") if score == 1)
+        finally:
+            conn.close()
+    return identical
+
+
+def stage_pushdown_identical(corpus):
+    from bindiff_aggregate import identical_function_pairs
+    return sum(len(pairs) for pairs in identical_function_pairs(_corpus_files(corpus)).values())
+
+
+def stage_matrix_aggregation(corpus):
+    from bindiff_results import read_overall_similarity
+    from similarity_matrix import SimilarityMatrix
+    matrix = SimilarityMatrix()
+    for path in _corpus_files(corpus):
+        name = os.path.basename(path)[:-len('.BinDiff')]
+        primary, secondary = name.split('_vs_', 1)
+        matrix.add(primary.split('_', 1)[0], secondary.split('_', 1)[0], read_overall_similarity(path))
+    matrix.combined_table()
+    return int(matrix.count.sum())
+
+
+def stage_plot_kde(corpus):
+    import matplotlib.pyplot as plt
+    from run_bindiff_paiswise_sd2_DONE import aggregate_scores_by_compiler, group_files_by_compiler, plot_kde
+    grouped_scores = aggregate_scores_by_compiler(group_files_by_compiler(corpus))
+    plt.show = lambda: plt.savefig(os.path.join(os.path.dirname(corpus), 'benchmark_kde.png'))
+    plot_kde(grouped_scores)
+    plt.close('all')
+    return sum(histogram.n for histogram in grouped_scores.values())
+
+
+# Modules imported before a stage's timer starts, so import time is not measured
+stage_imports = {
+    'extract_similarity_scores_from_sqlite': ['similarity_ingest'],
+    'ingest': ['similarity_ingest'],
+    'reingest': ['similarity_ingest'],
+    'score_histograms': ['run_bindiff_paiswise_sd2_DONE'],
+    'per_file_histogram': ['score_histogram'],
+    'pushdown_histogram': ['score_histogram'],
+    'per_file_identical': ['bindiff_results'],
+    'pushdown_identical': ['bindiff_aggregate'],
+    'matrix_aggregation': ['bindiff_results', 'similarity_matrix'],
+    'plot_kde': ['run_bindiff_paiswise_sd2_DONE', 'matplotlib.pyplot'],
+}
+
+stages = {
+    'extract_similarity_scores_from_sqlite': stage_extract_similarity_scores,
+    'ingest': stage_ingest,
+    'reingest': stage_reingest,
+    'score_histograms': stage_score_histograms,
+    'per_file_histogram': stage_per_file_histogram,
+    'pushdown_histogram': stage_pushdown_histogram,
+    'per_file_identical': stage_per_file_identical,
+    'pushdown_identical': stage_pushdown_identical,
+    'matrix_aggregation': stage_matrix_aggregation,
+    'plot_kde': stage_plot_kde,
+}
+
+
+def _corpus_files(corpus):
+    return [os.path.join(corpus, f) for f in sorted(os.listdir(corpus)) if f.endswith('.BinDiff')]
+
+
+# Function to run one stage in a fresh process and report its time, rows and peak RSS
+def _run_stage(name, corpus, connection):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    for module in stage_imports.get(name, []):
+        importlib.import_module(module)
+    started = time.perf_counter()
+    rows = stages[name](corpus)
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    peak_mb = peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    connection.send({'seconds': elapsed, 'rows': rows, 'peak_rss_mb': peak_mb})
+    connection.close()
+
+
+def measure_stage(name, corpus):
+    # A spawned interpreter starts clean, so the peak RSS belongs to this stage only
+    context = multiprocessing.get_context('spawn')
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_run_stage, args=(name, corpus, child))
+    process.start()
+    child.close()
+    try:
+        metrics = parent.recv()
+    except EOFError:
+        metrics = {'seconds': None, 'rows': 0, 'peak_rss_mb': None, 'error': f'exit code {process.exitcode}'}
+    process.join()
+    if metrics.get('seconds'):
+        metrics['rows_per_second'] = metrics['rows'] / metrics['seconds']
+    return metrics
+
+
+# Function to identify the code version a benchmark ran against
+def code_version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or 'unknown'
+    except OSError:
+        return 'unknown'
+
+
+# Function to find the latest stored run with the same corpus parameters
+def previous_run(results_file, params):
+    if not os.path.isfile(results_file):
+        return None
+    previous = None
+    with open(results_file, 'r') as rf:
+        for line in rf:
+            try:
+                run = json.loads(line)
+            except ValueError:
+                continue
+            if run.get('params') == params:
+                previous = run
+    return previous
+
+
+def print_report(run, previous):
+    print(f"Benchmark {run['version']} ({run['params']})")
+    print(f"{'stage':40} {'seconds':>9} {'rows/s':>12} {'peak RSS MB':>12} {'vs previous':>12}")
+    for name, metrics in run['stages'].items():
+        seconds = metrics.get('seconds')
+        change = ''
+        if previous and seconds and previous['stages'].get(name, {}).get('seconds'):
+            ratio = seconds / previous['stages'][name]['seconds'] - 1
+            change = f"{ratio:+.0%}" + (' REGRESSION' if ratio > regression_threshold else '')
+        print(f"{name:40} {seconds or float('nan'):9.3f} {metrics.get('rows_per_second', 0):12.0f} "
+              f"{metrics.get('peak_rss_mb') or float('nan'):12.1f} {change:>12}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the BinDiff analysis stages on a synthetic corpus.')
+    parser.add_argument('--functions', type=int, default=2000, help='matched functions per .BinDiff file')
+    parser.add_argument('--configurations', type=int, default=6, help='compiler configurations')
+    parser.add_argument('--binaries', type=int, default=20, help='binaries per configuration')
+    parser.add_argument('--workdir', default=os.path.join(os.getcwd(), 'benchmark_corpus'))
+    parser.add_argument('--results',
+                        help=f'JSON lines file runs are appended to (default: <workdir>/{results_file_name})')
+    parser.add_argument('--stages', nargs='*', default=list(stages), choices=list(stages))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.results is None:
+        args.results = os.path.join(args.workdir, results_file_name)
+
+    params = {'functions': args.functions, 'configurations': args.configurations,
+              'binaries': args.binaries, 'seed': args.seed}
+    corpus = os.path.join(args.workdir, 'bindiff_results')
+    started = time.perf_counter()
+    files = generate_corpus(corpus, args.configurations, args.binaries, args.functions, args.seed)
+    print(f"Generated {len(files)} .BinDiff files in {time.perf_counter() - started:.1f}s")
+
+    run = {'version': code_version(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'params': params,
+           'stages': {}}
+    for name in args.stages:
+        run['stages'][name] = measure_stage(name, corpus)
+
+    previous = previous_run(args.results, params)
+    print_report(run, previous)
+    with open(args.results, 'a') as rf:
+        rf.write(json.dumps(run) + '\n')
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
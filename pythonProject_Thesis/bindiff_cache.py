@@ -0,0 +1,138 @@
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+import tempfile
+
+# Shared on-disk cache for BinDiff results, used by every script that runs bindiff
+cache_dir = os.environ.get('BINDIFF_CACHE_DIR',
+                           os.path.join(os.path.expanduser("~"), '.cache', 'bindiversity', 'bindiff'))
+
+# Hashes of BinExport files seen in this process, keyed by (path, size, mtime)
+_file_hashes = {}
+_bindiff_version = None
+
+
+# Function to hash the content of a file
+def file_sha256(path):
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        _file_hashes[memo_key] = digest.hexdigest()
+    return _file_hashes[memo_key]
+
+
+# Function to get the installed BinDiff version (part of the cache key)
+def bindiff_version():
+    global _bindiff_version
+    if _bindiff_version is None:
+        try:
+            result = subprocess.run(['bindiff', '--version'], capture_output=True, text=True)
+            _bindiff_version = (result.stdout or result.stderr).strip() or 'unknown'
+        except OSError:
+            _bindiff_version = 'unknown'
+    return _bindiff_version
+
+
+# Function to build the cache key of a (primary, secondary) pair
+def cache_key(primary, secondary):
+    key = f"{bindiff_version()}\0{file_sha256(primary)}\0{file_sha256(secondary)}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+# Function to find the cache entry directory of a key
+def entry_dir(key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+# Function to look up a cached result, returns None on a miss
+def lookup(key):
+    directory = entry_dir(key)
+    result_file = os.path.join(directory, 'result.BinDiff')
+    if os.path.isfile(result_file):
+        return directory
+    return None
+
+
+# ioctl that clones a file's extents (copy-on-write reflink) on Linux filesystems that support it
+FICLONE = 0x40049409
+
+
+# Function to clone a file without copying its data (btrfs, XFS, ...); raises OSError where unsupported
+def _reflink(source, destination):
+    import fcntl
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, destination)
+
+
+# Function to place a cached file at its destination as a private copy (a reflink where possible)
+# Never a hard link: a .BinDiff is a SQLite database, and anything that opens it for writing, or a
+# BinDiff run writing in place, would otherwise change the shared cache entry
+def place_file(source, destination):
+    if os.path.abspath(source) == os.path.abspath(destination):
+        return
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        _reflink(source, destination)
+    except (OSError, ImportError):
+        shutil.copy2(source, destination)
+
+
+# Function to store a finished BinDiff result in the cache
+def store(key, output_file, stdout, primary, secondary):
+    directory = entry_dir(key)
+    if os.path.isdir(directory):
+        return directory
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    # Build the entry next to its final place and rename it in, so that
+    # concurrent workers never see a half written entry
+    tmp_dir = tempfile.mkdtemp(prefix=f'.{key}.', dir=os.path.dirname(directory))
+    try:
+        shutil.copy2(output_file, os.path.join(tmp_dir, 'result.BinDiff'))
+        with open(os.path.join(tmp_dir, 'result.log'), 'w') as lf:
+            lf.write(stdout)
+        with open(os.path.join(tmp_dir, 'entry.json'), 'w') as jf:
+            json.dump({'primary': primary, 'secondary': secondary, 'bindiff_version': bindiff_version()}, jf)
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # Another worker stored the same pair first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return directory
+
+
+# Function to run BinDiff through the cache
+# run_command is called on a miss and must return (stdout, stderr, returncode);
+# a hit places the stored .BinDiff at output_file and its log at log_file
+def cached_bindiff(primary, secondary, output_file, log_file, run_command):
+    try:
+        key = cache_key(primary, secondary)
+    except OSError:
+        key = None
+
+    if key is not None:
+        directory = lookup(key)
+        if directory is not None:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            place_file(os.path.join(directory, 'result.BinDiff'), output_file)
+            with open(os.path.join(directory, 'result.log'), 'r') as lf:
+                stdout = lf.read()
+            if log_file is not None:
+                with open(log_file, 'w') as lf:
+                    lf.write(stdout)
+            print(f"Cache hit for {primary} vs {secondary}")
+            return stdout, '', 0
+
+    stdout, stderr, returncode = run_command()
+    if log_file is not None:
+        with open(log_file, 'w') as lf:
+            lf.write(stdout)
+    if key is not None and returncode == 0 and os.path.isfile(output_file):
+        store(key, output_file, stdout, primary, secondary)
+    return stdout, stderr, returncode
@@ -1,77 +1,73 @@
 import os
+import sys
 import sqlite3
 import csv
+from bindiversity_config import resolve_path
+from function_score_store import (always_identical, always_identical_by_name, identical_matches,
+                                  ingest_function_scores, never_identical, score_vector)
 
 # Define the base path to the directories under 'pythonProject_Thesis'
-base_path = '/Users/hamidrezaaslani/Desktop/BinDiversity-ONLINE/pythonProject_Thesis'
+base_path = os.path.dirname(os.path.abspath(__file__))
 output_csv = 'functions_with_similarity_1.csv'
 
+# Function score store (relative to the searched directory)
+function_db = 'function_scores.db'
 
-# Function to query the SQLite database in .BinDiff files
-def query_bindiff_file(bindiff_file):
-    functions_with_scores = {}
-    try:
-        conn = sqlite3.connect(bindiff_file)
-        cursor = conn.cursor()
-        query = """
-        SELECT name1, similarity 
-        FROM function
-        """
-        cursor.execute(query)
-        results = cursor.fetchall()
-        conn.close()
-        functions_with_scores = {row[0]: row[1] for row in results}
-    except sqlite3.Error as e:
-        print(f"Error querying {bindiff_file}: {e}")
-    return functions_with_scores
 
+# Main function: list the functions that BinDiff matched with similarity 1 in every comparison
+# The .BinDiff files are ingested into an indexed function score store (function_scores.db),
+# so later runs only read new or changed files and the queries are answered from the index
+# config keys: base_path (searched recursively for .BinDiff files), function_db, output_csv,
+#              complete, per_binary, never, function, binary
+def main(config=None):
+    config = config or {}
+    search_path = os.path.expanduser(config.get('base_path', base_path))
+    csv_path = os.path.expanduser(config.get('output_csv', output_csv))
+    store_path = resolve_path(config.get('function_db', function_db), search_path)
+    print(f"Searching for .BinDiff files in {search_path}...")
 
-# Main script execution
-if __name__ == "__main__":
-    print(f"Searching for .BinDiff files in {base_path}...")
-
-    all_results = []
-    function_scores = {}
+    conn = sqlite3.connect(store_path)
+    try:
+        ingest_function_scores(conn, search_path)
 
-    # Iterate over the directories and .BinDiff files
-    for root, dirs, files in os.walk(base_path):
-        print(f"Current directory: {root}")
-        print(f"Files: {files}")
-        for file in files:
-            if file.endswith(".BinDiff"):
-                bindiff_file = os.path.join(root, file)
-                print(f"Querying {bindiff_file}")
-                functions_with_scores = query_bindiff_file(bindiff_file)
-                if functions_with_scores:
-                    print(f"Functions in {bindiff_file}:")
-                    for function_name, similarity in functions_with_scores.items():
-                        print(f" - {function_name}: {similarity}")
-                        if function_name not in function_scores:
-                            function_scores[function_name] = []
-                        function_scores[function_name].append(similarity)
-                        if similarity == 1:
-                            all_results.append([bindiff_file, function_name])
-                else:
-                    print(f"No functions found in {bindiff_file}")
+        # Score vector of a single function across all config pairs
+        if config.get('function'):
+            print(f"Similarity scores of {config['function']}:")
+            for binary, config1, config2, similarity in score_vector(conn, config['function'], config.get('binary')):
+                print(f" - {binary} {config1} vs {config2}: {similarity}")
+            return 0
 
-    # Print all functions with their scores across all comparisons
-    print("Functions with their similarity scores across all comparisons:")
-    for function_name, scores in function_scores.items():
-        print(f" - {function_name}: {scores}")
+        if config.get('never'):
+            print("Functions never matched with similarity 1:")
+            for binary, function_name, pairs, max_similarity in never_identical(conn):
+                print(f" - {binary}: {function_name} (max {max_similarity} over {pairs} comparisons)")
+            return 0
 
-    # Find common functions with similarity 1 in all files
-    common_functions_with_similarity_one = [f for f, scores in function_scores.items() if
-                                            all(score == 1 for score in scores)]
+        # Find common functions with similarity 1 in all files, grouped by name over every file;
+        # per_binary groups (binary, function) instead, complete also requires a match in every file
+        print("Common functions in all files with similarity 1:")
+        if config.get('per_binary'):
+            for binary, function_name, pairs in always_identical(conn, complete=config.get('complete', False)):
+                print(f" - {binary}: {function_name} ({pairs} comparisons)")
+        else:
+            for function_name, files in always_identical_by_name(conn, complete=config.get('complete', False)):
+                print(f" - {function_name} ({files} files)")
 
-    print("Common functions in all files with similarity 1:")
-    for function in common_functions_with_similarity_one:
-        print(f" - {function}")
+        all_results = [[os.path.join(search_path, filename), function_name]
+                       for filename, function_name in identical_matches(conn)]
+    finally:
+        conn.close()
 
     # Save results to CSV
-    with open(output_csv, 'w', newline='') as csvfile:
+    with open(csv_path, 'w', newline='') as csvfile:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerow(['File', 'Function Name'])
         csvwriter.writerows(all_results)
 
-    print(f"Results saved to {output_csv}")
-    print("Process completed.")
\ No newline at end of file
+    print(f"Results saved to {csv_path}")
+    print("Process completed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,15 @@
 import os
-import angr
-import sqlite3
+import sys
+import time
 import logging
-import matplotlib.pyplot as plt
-
-# Ensure distutils is imported correctly
-try:
-    import distutils
-except ModuleNotFoundError:
-    try:
-        import setuptools._distutils as distutils
-    except ModuleNotFoundError:
-        raise ImportError("Failed to import distutils module, which is required by capstone.")
+from concurrent.futures import ProcessPoolExecutor
+from angr_project_pool import get_project, project_pool_stats
+from bindiff_aggregate import identical_function_pairs
+from instruction_diff import diff_functions
+from bindiff_metrics import open_metrics, record_metric, stage
+from bindiversity_config import resolve_directories, resolve_path
+from figure_rendering import figure_path, max_bars, should_show, show_or_render, split_top_k
+from function_score_store import parse_result_name
 
 # Define directories where the binaries are stored
 directories = [
@@ -23,38 +21,28 @@ directories = [
     'coreutils-gcc_9/bin'
 ]
 
-# Update directories to include the full paths on the Desktop
-directories = [os.path.join(os.path.expanduser("~"), "Desktop", directory) for directory in directories]
+# The directories are looked up on the Desktop
+base_path = os.path.join(os.path.expanduser("~"), "Desktop")
+
+# Directory where the BinDiff results are stored (next to this script)
+bindiff_results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bindiff_results')
 
-# Directory where the BinDiff results are stored
-bindiff_results_dir = os.path.join(os.path.expanduser("~"), 'Desktop', 'BinDiversity-ONLINE', 'pythonProject_Thesis',
-                                   'bindiff_results')
+# Worker processes and function pairs per task for the similarity-1 verification
+analysis_workers = int(os.environ.get('ANALYSIS_WORKERS', 1))
+analysis_chunk_size = int(os.environ.get('ANALYSIS_CHUNK_SIZE', 0)) or None
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-# Function to extract functions with similarity 1 from BinDiff results
-def extract_functions_with_similarity_one(bindiff_db):
-    conn = sqlite3.connect(bindiff_db)
-    cursor = conn.cursor()
-
-    query = """
-    SELECT name1, name2 
-    FROM function 
-    WHERE similarity = 1.0
-    """
-    cursor.execute(query)
-    results = cursor.fetchall()
-    conn.close()
-
-    return results
-
-
 # Function to disassemble and compare functions in two binaries
-def compare_functions_by_disassembly(binary_path1, func_name1, binary_path2, func_name2):
-    project1 = angr.Project(binary_path1, auto_load_libs=False)
-    project2 = angr.Project(binary_path2, auto_load_libs=False)
+# If a timings dict is given, angr load and disassembly seconds are added to it per binary
+def compare_functions_by_disassembly(binary_path1, func_name1, binary_path2, func_name2, timings=None):
+    started = time.monotonic()
+    # Binaries are loaded once per process and reused from the project pool
+    project1 = get_project(binary_path1)
+    project2 = get_project(binary_path2)
+    loaded = time.monotonic()
 
     func1 = project1.loader.main_object.get_symbol(func_name1)
     func2 = project2.loader.main_object.get_symbol(func_name2)
@@ -63,48 +51,125 @@ def compare_functions_by_disassembly(binary_path1, func_name1, binary_path2, fun
         logging.warning(f"Function {func_name1} or {func_name2} not found in the binaries.")
         return 0, 0
 
-    block1 = project1.factory.block(func1.rebased_addr).capstone
-    block2 = project2.factory.block(func2.rebased_addr).capstone
-
-    instructions1 = [f"{i.mnemonic} {i.op_str}" for i in block1.insns]
-    instructions2 = [f"{i.mnemonic} {i.op_str}" for i in block2.insns]
+    # Whole functions (all CFG blocks) with addresses/immediates normalized, aligned with a Myers diff
+    identical_instructions, differing_instructions = diff_functions(project1, func1, project2, func2)
 
-    identical_instructions = sum(inst1 == inst2 for inst1, inst2 in zip(instructions1, instructions2))
-    differing_instructions = len(instructions1) + len(instructions2) - 2 * identical_instructions
+    if timings is not None:
+        timing = timings.setdefault(os.path.basename(binary_path1), [0.0, 0.0, 0])
+        timing[0] += loaded - started
+        timing[1] += time.monotonic() - loaded
+        timing[2] += 1
 
     return identical_instructions, differing_instructions
 
 
+# Function to build the comparison tasks, sharded by binary in a deterministic order
+# binary_dirs are the full paths of the configuration directories, in comparison order
+def plan_similarity_one_tasks(bindiff_results_dir, binary_dirs=None):
+    if binary_dirs is None:
+        binary_dirs = resolve_directories(directories, base_path)
+    bindiff_dbs = []
+    for root, dirs, files in os.walk(bindiff_results_dir):
+        dirs.sort()
+        bindiff_dbs.extend(os.path.join(root, file) for file in sorted(files) if file.endswith('.BinDiff'))
+
+    # The similarity = 1 filter runs inside SQLite over batches of attached result files
+    shards = {}
+    for bindiff_db, functions in identical_function_pairs(bindiff_dbs).items():
+        logging.info(f"Analyzing BinDiff results: {bindiff_db}")
+        # Pair directories (<binary>_vs_<binary>.BinDiff) and flat names (<config1>_<binary>_vs_<config2>_<binary>)
+        binary = parse_result_name(os.path.relpath(bindiff_db, bindiff_results_dir))[0]
+
+        for func1, func2 in functions:
+            for dir1, dir2 in zip(binary_dirs[:-1], binary_dirs[1:]):
+                binary1 = os.path.join(dir1, binary)
+                binary2 = os.path.join(dir2, binary)
+                label = f"{func1} ({os.path.basename(dir1)}) vs {func2} ({os.path.basename(dir2)})"
+                shards.setdefault(binary, []).append((binary1, func1, binary2, func2, label))
+    return [shards[binary] for binary in sorted(shards)]
+
+
+# Function to compare a chunk of function pairs (runs inside a worker process)
+# Returns the results and the {binary: [load s, disassembly s, pairs]} timings of the chunk
+def compare_function_chunk(tasks):
+    results = []
+    timings = {}
+    for binary1, func1, binary2, func2, label in tasks:
+        try:
+            identical, differing = compare_functions_by_disassembly(binary1, func1, binary2, func2, timings)
+        except Exception as e:
+            logging.warning(f"Comparing {label} failed: {e}")
+            identical, differing = 0, 0
+        results.append((identical, differing, label))
+    return results, timings
+
+
+# Function to add the timings of one chunk to the running totals
+def merge_timings(totals, timings):
+    for binary, (load_seconds, disassembly_seconds, pairs) in timings.items():
+        total = totals.setdefault(binary, [0.0, 0.0, 0])
+        total[0] += load_seconds
+        total[1] += disassembly_seconds
+        total[2] += pairs
+
+
+# Function to stream (identical, differing, pair label) results in task order
+# Every chunk holds tasks of a single binary, so a worker keeps that binary loaded;
+# angr load/disassembly time per binary is added to timings if given
+def iter_similarity_one_results(bindiff_results_dir, workers=1, chunk_size=None, timings=None, binary_dirs=None):
+    if timings is None:
+        timings = {}
+    chunks = []
+    for shard in plan_similarity_one_tasks(bindiff_results_dir, binary_dirs):
+        size = chunk_size or len(shard)
+        chunks.extend(shard[i:i + size] for i in range(0, len(shard), size))
+
+    if workers <= 1:
+        for chunk in chunks:
+            results, chunk_timings = compare_function_chunk(chunk)
+            merge_timings(timings, chunk_timings)
+            yield from results
+        logging.info(f"angr project pool: {project_pool_stats()}")
+        return
+
+    logging.info(f"Comparing {sum(len(chunk) for chunk in chunks)} function pairs in "
+                 f"{len(chunks)} chunks on {workers} processes")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() hands results back in submission order
+        for results, chunk_timings in executor.map(compare_function_chunk, chunks):
+            merge_timings(timings, chunk_timings)
+            yield from results
+
+
 # Main function to process the binaries and BinDiff results
-def analyze_similarity_one_functions(bindiff_results_dir):
+# With a metrics connection, angr load and disassembly time per binary is recorded as well
+def analyze_similarity_one_functions(bindiff_results_dir, workers=1, chunk_size=None, metrics=None,
+                                     binary_dirs=None):
     identical_counts = []
     differing_counts = []
     function_pairs = []
+    timings = {}
 
-    for root, dirs, files in os.walk(bindiff_results_dir):
-        for file in files:
-            if file.endswith('.BinDiff'):
-                bindiff_db = os.path.join(root, file)
-                logging.info(f"Analyzing BinDiff results: {bindiff_db}")
-
-                functions = extract_functions_with_similarity_one(bindiff_db)
-
-                for func1, func2 in functions:
-                    for dir1, dir2 in zip(directories[:-1], directories[1:]):
-                        binary1 = os.path.join(dir1, func1)
-                        binary2 = os.path.join(dir2, func2)
+    with stage(metrics, 'similarity_one_verification'):
+        for identical, differing, label in iter_similarity_one_results(bindiff_results_dir, workers, chunk_size,
+                                                                       timings, binary_dirs):
+            identical_counts.append(identical)
+            differing_counts.append(differing)
+            function_pairs.append(label)
 
-                        identical, differing = compare_functions_by_disassembly(binary1, func1, binary2, func2)
-
-                        identical_counts.append(identical)
-                        differing_counts.append(differing)
-                        function_pairs.append(f"{func1} ({os.path.basename(dir1)}) vs {func2} ({os.path.basename(dir2)})")
+    for binary, (load_seconds, disassembly_seconds, pairs) in sorted(timings.items(),
+                                                                     key=lambda item: -(item[1][0] + item[1][1])):
+        logging.info(f"{binary}: {pairs} pairs, angr load {load_seconds:.2f}s, disassembly {disassembly_seconds:.2f}s")
+        record_metric(metrics, 'angr_load', f'{pairs} pairs', binary=binary, wall_seconds=load_seconds)
+        record_metric(metrics, 'angr_disassembly', f'{pairs} pairs', binary=binary, wall_seconds=disassembly_seconds)
 
     return identical_counts, differing_counts, function_pairs
 
 
-# Function to plot the results
-def plot_results(identical_counts, differing_counts, function_pairs):
+# Function to draw the instruction comparison bars (saved if output_file is given)
+def render_instruction_comparison(identical_counts, differing_counts, function_pairs, output_file=None):
+    import matplotlib.pyplot as plt
+
     bar_width = 0.35
     index = range(len(function_pairs))
 
@@ -119,9 +184,50 @@ def plot_results(identical_counts, differing_counts, function_pairs):
     plt.legend()
 
     plt.tight_layout()
-    plt.show()
+    if output_file:
+        plt.savefig(output_file)
+
+
+# Function to describe the comparison figure as a (render function, arguments) job
+# Only the bar_limit pairs with the most differing instructions get their own bars,
+# the remaining pairs are shown as one "others" pair holding their mean counts
+def instruction_comparison_figure(identical_counts, differing_counts, function_pairs, output_file=None,
+                                  bar_limit=None):
+    top, rest = split_top_k(differing_counts, bar_limit)
+    identical = [identical_counts[i] for i in top]
+    differing = [differing_counts[i] for i in top]
+    pairs = [function_pairs[i] for i in top]
+    if rest:
+        identical.append(sum(identical_counts[i] for i in rest) / len(rest))
+        differing.append(sum(differing_counts[i] for i in rest) / len(rest))
+        pairs.append(f'others ({len(rest)}, mean)')
+    return render_instruction_comparison, {'identical_counts': identical, 'differing_counts': differing,
+                                           'function_pairs': pairs, 'output_file': output_file}
+
+
+# Function to plot the results
+def plot_results(identical_counts, differing_counts, function_pairs, show=True, output_file=None, bar_limit=None):
+    show_or_render([instruction_comparison_figure(identical_counts, differing_counts, function_pairs, output_file,
+                                                  bar_limit)], show)
+
+
+# Main function: check at instruction level the functions BinDiff rated with similarity 1
+# config keys: base_path, directories, results_dir, workers, chunk_size, max_bars, show, figure_dir
+def main(config=None):
+    config = config or {}
+    base = os.path.expanduser(config.get('base_path', base_path))
+    identical_counts, differing_counts, function_pairs = analyze_similarity_one_functions(
+        resolve_path(config.get('results_dir', bindiff_results_dir), base),
+        workers=config.get('workers', analysis_workers),
+        chunk_size=config.get('chunk_size', analysis_chunk_size),
+        metrics=open_metrics(),
+        binary_dirs=resolve_directories(config.get('directories', directories), base))
+    show = should_show(config)
+    plot_results(identical_counts, differing_counts, function_pairs, show=show,
+                 output_file=None if show else figure_path(config, 'instruction_comparison.png'),
+                 bar_limit=config.get('max_bars', max_bars))
+    return 0
 
 
 if __name__ == "__main__":
-    identical_counts, differing_counts, function_pairs = analyze_similarity_one_functions(bindiff_results_dir)
-    plot_results(identical_counts, differing_counts, function_pairs)
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+import subprocess
+import contextlib
+
+# Metrics of every run are appended to one SQLite table (BINDIFF_METRICS=0 turns recording off)
+metrics_enabled = os.environ.get('BINDIFF_METRICS', '1') != '0'
+default_metrics_db = os.environ.get('BINDIFF_METRICS_DB',
+                                    os.path.join(os.path.expanduser("~"), "Desktop", 'bindiff_metrics.db'))
+
+# Optional per-stage profiling: BINDIFF_PROFILE=cprofile, tracemalloc or cprofile,tracemalloc
+profile_modes = {mode.strip() for mode in os.environ.get('BINDIFF_PROFILE', '').split(',') if mode.strip()}
+profile_dir = os.environ.get('BINDIFF_PROFILE_DIR', 'profiles')
+
+# Every row written by this process carries the same run id
+run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+# Workers record from several threads through one connection
+_lock = threading.Lock()
+
+
+# Function to open (and create) the metrics database, returns None when recording is off
+def open_metrics(db_path=None):
+    if not metrics_enabled:
+        return None
+    conn = sqlite3.connect(db_path or default_metrics_db, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS metrics
+                    (run_id TEXT, recorded_at REAL, stage TEXT, name TEXT, binary TEXT,
+                     wall_seconds REAL, cpu_seconds REAL, peak_rss_mb REAL, traced_peak_mb REAL,
+                     input_bytes INTEGER, output_bytes INTEGER, status TEXT, returncode INTEGER)''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_stage ON metrics (stage, wall_seconds)")
+    conn.commit()
+    return conn
+
+
+# Function to write one metrics row (a None connection makes this a no-op)
+def record_metric(conn, stage, name, binary=None, wall_seconds=None, cpu_seconds=None, peak_rss_mb=None,
+                  traced_peak_mb=None, input_bytes=None, output_bytes=None, status=None, returncode=None):
+    if conn is None:
+        return
+    with _lock:
+        conn.execute("INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (run_id, time.time(), stage, name, binary, wall_seconds, cpu_seconds, peak_rss_mb,
+                      traced_peak_mb, input_bytes, output_bytes, status, returncode))
+        conn.commit()
+
+
+# Function to get the size of a file, or None if it does not exist
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+# Function to record the timing, memory and sizes of one finished BinDiff job
+def record_job(conn, stage, job, result):
+    if conn is None:
+        return
+    sizes = [file_size(job['primary']), file_size(job['secondary'])]
+    status = result.get('status') or ('ok' if result.get('returncode') == 0 else 'failed')
+    record_metric(conn, stage, f"{job['primary_label']} vs {job['secondary_label']}",
+                  binary=os.path.basename(job['primary']),
+                  wall_seconds=result.get('elapsed'),
+                  cpu_seconds=result.get('cpu_seconds'),
+                  peak_rss_mb=result.get('peak_rss_mb'),
+                  input_bytes=sum(size for size in sizes if size is not None),
+                  output_bytes=file_size(result.get('output_file')),
+                  status=status,
+                  returncode=result.get('returncode'))
+
+
+# Function to read the peak resident set size (VmHWM) of a running process in MB
+def read_peak_rss_mb(pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as sf:
+            for line in sf:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+# Function to read the CPU time (user + system) a running process has used so far
+def read_cpu_seconds(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as sf:
+            # The command name may contain spaces, so split after its closing parenthesis
+            fields = sf.read().rsplit(')', 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+# Function to run a command (an argv list, never through a shell) and measure it
+# The peak RSS is sampled from the pid Popen started, which under a shell would be /bin/sh, not the command
+# Returns (stdout, stderr, returncode, usage); usage holds elapsed, cpu_seconds and peak_rss_mb.
+# CPU time comes from the kernel's accounting (os.wait4). ru_maxrss is not used because it
+# still includes the pages of the forked parent from before the exec, so the peak RSS is
+# sampled from VmHWM while the child runs
+def run_measured(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, poll_interval=0.1):
+    started = time.monotonic()
+    process = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, text=True)
+    output = {}
+    peak = []
+    finished = threading.Event()
+
+    # Drain the pipes in threads so the child never blocks on a full pipe while we wait for it
+    def drain(name, stream):
+        output[name] = stream.read()
+        stream.close()
+
+    def sample():
+        while not finished.is_set():
+            peak_rss_mb = read_peak_rss_mb(process.pid)
+            if peak_rss_mb is not None:
+                peak.append(peak_rss_mb)
+            finished.wait(poll_interval)
+
+    threads = [threading.Thread(target=drain, args=(name, stream))
+               for name, stream in (('stdout', process.stdout), ('stderr', process.stderr)) if stream is not None]
+    threads.append(threading.Thread(target=sample))
+    for thread in threads:
+        thread.start()
+    # Wait for the exit without reaping, so the pid cannot be reused while it is still sampled
+    if hasattr(os, 'waitid'):
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+    finished.set()
+    _, status, rusage = os.wait4(process.pid, 0)
+    # Tell Popen the child is already reaped so it does not wait for it again
+    process.returncode = os.waitstatus_to_exitcode(status)
+    for thread in threads:
+        thread.join()
+    usage = {
+        'elapsed': time.monotonic() - started,
+        'cpu_seconds': rusage.ru_utime + rusage.ru_stime,
+        'peak_rss_mb': max(peak) if peak else None,
+    }
+    if not peak and sys.platform == 'darwin':
+        # No /proc on macOS; ru_maxrss (in bytes there) is the best estimate available
+        usage['peak_rss_mb'] = rusage.ru_maxrss / (1024.0 * 1024.0)
+    return output.get('stdout', ''), output.get('stderr', ''), process.returncode, usage
+
+
+# Context manager to time one stage of a script, with optional cProfile/tracemalloc hooks
+# The yielded dict may be given input_bytes, output_bytes or status before the block ends
+@contextlib.contextmanager
+def stage(conn, name, binary=None):
+    info = {}
+    profiler = None
+    if 'cprofile' in profile_modes:
+        import cProfile
+        profiler = cProfile.Profile()
+    tracing = 'tracemalloc' in profile_modes
+    if tracing:
+        import tracemalloc
+        tracemalloc.start()
+    started = time.monotonic()
+    cpu_started = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    status = 'ok'
+    try:
+        yield info
+    except BaseException:
+        status = 'failed'
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall_seconds = time.monotonic() - started
+        cpu_seconds = time.process_time() - cpu_started
+        traced_peak_mb = None
+        if tracing:
+            traced_peak_mb = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+            tracemalloc.stop()
+        if profiler is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+            profile_file = os.path.join(profile_dir, f'{run_id}-{name}.prof')
+            profiler.dump_stats(profile_file)
+            print(f"Profile of stage {name} written to {profile_file}")
+        print(f"Stage {name}: {wall_seconds:.2f}s wall, {cpu_seconds:.2f}s CPU")
+        record_metric(conn, 'stage', name, binary=binary, wall_seconds=wall_seconds, cpu_seconds=cpu_seconds,
+                      peak_rss_mb=read_peak_rss_mb(), traced_peak_mb=traced_peak_mb,
+                      input_bytes=info.get('input_bytes'), output_bytes=info.get('output_bytes'),
+                      status=info.get('status', status))
+
+
+# Function to print the slowest pairs and the binaries that dominate the sweep time
+# Defaults to the current run; pass run='' to report over every recorded run
+def slowest_report(conn, limit=10, stage_name='bindiff', run=None):
+    if conn is None:
+        return [], []
+    run = run_id if run is None else run
+    where = "stage = ? AND wall_seconds IS NOT NULL" + (" AND run_id = ?" if run else "")
+    params = [stage_name] + ([run] if run else [])
+    pairs = conn.execute(f"SELECT binary, name, wall_seconds, peak_rss_mb, status FROM metrics WHERE {where} "
+                         f"ORDER BY wall_seconds DESC LIMIT ?", params + [limit]).fetchall()
+    binaries = conn.execute(f"SELECT binary, COUNT(*), SUM(wall_seconds), MAX(wall_seconds), MAX(peak_rss_mb) "
+                            f"FROM metrics WHERE {where} GROUP BY binary ORDER BY SUM(wall_seconds) DESC LIMIT ?",
+                            params + [limit]).fetchall()
+    total = conn.execute(f"SELECT SUM(wall_seconds) FROM metrics WHERE {where}", params).fetchone()[0] or 0.0
+
+    print(f"Slowest {stage_name} pairs:")
+    for binary, name, wall_seconds, peak_rss_mb, status in pairs:
+        rss = f"{peak_rss_mb:.0f} MB" if peak_rss_mb is not None else "-"
+        print(f"  {wall_seconds:9.2f}s  {rss:>8}  {status or '-':7}  {binary}: {name}")
+    print(f"Binaries by total {stage_name} time:")
+    for binary, jobs, wall_seconds, slowest, peak_rss_mb in binaries:
+        share = 100.0 * wall_seconds / total if total else 0.0
+        rss = f"{peak_rss_mb:.0f} MB" if peak_rss_mb is not None else "-"
+        print(f"  {wall_seconds:9.2f}s  {share:5.1f}%  {jobs:4d} jobs  slowest {slowest:.2f}s  {rss:>8}  {binary}")
+    return pairs, binaries
+
+
+if __name__ == "__main__":
+    # Usage: python bindiff_metrics.py [metrics.db] [stage] [limit]
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else default_metrics_db)
+    slowest_report(conn, limit=int(sys.argv[3]) if len(sys.argv) > 3 else 10,
+                   stage_name=sys.argv[2] if len(sys.argv) > 2 else 'bindiff', run='')
+    conn.close()
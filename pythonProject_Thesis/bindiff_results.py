@@ -0,0 +1,44 @@
+import os
+import sqlite3
+
+
+# Function to strip the .BinExport extension the same way BinDiff does for its output names
+def export_stem(file):
+    return file[:-len('.BinExport')] if file.endswith('.BinExport') else file
+
+
+# Function to get the file name BinDiff writes for a pair: <primary stem>_vs_<secondary stem>.BinDiff
+def bindiff_output_name(primary, secondary):
+    return f"{export_stem(os.path.basename(primary))}_vs_{export_stem(os.path.basename(secondary))}.BinDiff"
+
+
+# Function to open a .BinDiff database read-only
+def open_bindiff_readonly(bindiff_file):
+    return sqlite3.connect(f'file:{bindiff_file}?mode=ro', uri=True)
+
+
+# Function to read a BinDiff result straight from its .BinDiff database
+# Returns {'similarity': percent, 'confidence': 0..1} or None if unreadable
+def read_bindiff_result(bindiff_file):
+    try:
+        conn = open_bindiff_readonly(bindiff_file)
+        try:
+            row = conn.execute("SELECT similarity, confidence FROM metadata").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Error reading BinDiff result {bindiff_file}: {e}")
+        return None
+    if row is None or row[0] is None:
+        return None
+    return {
+        # The metadata table stores 0..1, the stdout log reports percent
+        'similarity': float(row[0]) * 100.0,
+        'confidence': float(row[1]) if row[1] is not None else None,
+    }
+
+
+# Function to read the overall similarity (in percent) stored in a .BinDiff file
+def read_overall_similarity(bindiff_file):
+    result = read_bindiff_result(bindiff_file)
+    return result['similarity'] if result is not None else None
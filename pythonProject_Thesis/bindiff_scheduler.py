@@ -0,0 +1,76 @@
+import os
+import time
+import subprocess
+from bindiff_cache import cached_bindiff
+from bindiff_results import bindiff_output_name, read_overall_similarity
+from bindiff_metrics import run_measured
+
+# Default number of BinDiff processes running at the same time
+default_max_workers = int(os.environ.get('BINDIFF_WORKERS', os.cpu_count() or 1))
+
+
+# Function to describe one BinDiff job with its own output directory
+# With capture_log=False the BinDiff stdout is discarded and no .log file is written
+def make_job(primary, secondary, output_dir, primary_label, secondary_label, capture_log=True):
+    # Every configuration pair gets its own directory, otherwise the 15 diffs of
+    # the same binary would all write <binary>_vs_<binary>.BinDiff to one place
+    pair_dir = os.path.join(output_dir, f'{primary_label}_vs_{secondary_label}')
+    return {
+        'primary': primary,
+        'secondary': secondary,
+        'primary_label': primary_label,
+        'secondary_label': secondary_label,
+        'output_dir': pair_dir,
+        'capture_log': capture_log,
+    }
+
+
+# Function to run BinDiff for one job and capture output
+# job['output_file'] renames the result (bindiff itself always writes bindiff_output_name(primary, secondary)),
+# job['log_file'] moves the log (default: next to the result)
+def run_bindiff(job):
+    primary = job['primary']
+    secondary = job['secondary']
+    output_dir = job['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    bindiff_output = os.path.join(output_dir, bindiff_output_name(primary, secondary))
+    output_file = job.get('output_file') or bindiff_output
+    log_file = None
+    if job.get('capture_log', True):
+        log_file = job.get('log_file') or output_file[:-len('.BinDiff')] + '.log'
+    # A result left by an earlier diff must never be read as the result of this one
+    for path in {bindiff_output, output_file}:
+        if os.path.isfile(path):
+            os.remove(path)
+    cmd = ['bindiff', '--primary', primary, '--secondary', secondary, '--output_dir', output_dir]
+    # Wall time, CPU time and peak RSS of the bindiff process (stays empty on a cache hit)
+    usage = {}
+
+    def run_command():
+        print(f"Running: {' '.join(cmd)}")
+        stdout = subprocess.DEVNULL if log_file is None else subprocess.PIPE
+        out, err, code, measured = run_measured(cmd, stdout=stdout)
+        usage.update(measured)
+        if code == 0 and output_file != bindiff_output and os.path.isfile(bindiff_output):
+            os.replace(bindiff_output, output_file)
+        return out or '', err, code
+
+    started = time.monotonic()
+    stdout, stderr, returncode = cached_bindiff(primary, secondary, output_file, log_file, run_command)
+    if returncode != 0:
+        print(f"Error running BinDiff: {stderr}")
+    # The overall similarity comes from the .BinDiff database itself, not from stdout
+    similarity = None
+    if returncode == 0 and os.path.isfile(output_file):
+        similarity = read_overall_similarity(output_file)
+    return {
+        'output_file': output_file,
+        'log_file': log_file,
+        'stdout': stdout,
+        'stderr': stderr,
+        'returncode': returncode,
+        'similarity': similarity,
+        'elapsed': usage.get('elapsed', time.monotonic() - started),
+        'cpu_seconds': usage.get('cpu_seconds'),
+        'peak_rss_mb': usage.get('peak_rss_mb'),
+    }
@@ -0,0 +1,201 @@
+import os
+import sys
+import argparse
+import importlib
+from bindiversity_config import command_config, load_config, resolve_path
+
+# Script module behind each subcommand; a module (and the libraries it needs) is only
+# imported when its subcommand runs, so ingest and queries never load pandas, sklearn or angr
+commands = {
+    'build': 'clang_coreutils_build',
+    'sweep': 'run_bindiff_save_log_files_DONE',
+    'matrix': 'run_bindiff_average_standard_deviation_MATRIX_DONE',
+    'mds': 'run_Bindiff_MDS',
+    'kde': 'run_bindiff_paiswise_sd2_DONE',
+    'threshold': 'run_bindiff_treshold',
+    'verify': 'bindiff_funtions_always_one_Automate',
+    'always-one': 'bindiff_funtions_always_one',
+    'merge': 'sweep_sharding',
+}
+
+
+# Function to ingest new or changed .BinDiff results into the similarity scores database
+def run_ingest(settings):
+    import sqlite3
+    from similarity_ingest import ingest_bindiff_results
+
+    base = os.path.expanduser(settings.get('base_path', os.getcwd()))
+    db_path = resolve_path(settings.get('db_path', 'similarity_scores.db'), base)
+    results_dir = resolve_path(settings.get('results_dir', 'bindiff_results'), base)
+    conn = sqlite3.connect(db_path)
+    try:
+        stats = ingest_bindiff_results(conn, results_dir)
+    finally:
+        conn.close()
+    print(f"Ingested {results_dir} into {db_path}: {stats}")
+    return 0
+
+
+# Function to redraw every figure from the stored outputs, rendered to files in parallel processes
+# Sources: similarity_matrix_state.npz (heatmap, MDS), the results directory (KDEs) and the
+# similarity scores database (std distribution and barplot; read as is, without ingesting)
+def run_render(settings):
+    from figure_rendering import figure_path, max_bars, render_figures
+
+    base = os.path.expanduser(settings.get('base_path', os.getcwd()))
+    figures = []
+
+    state_file = resolve_path(settings.get('matrix_state', 'similarity_matrix_state.npz'), base)
+    if os.path.isfile(state_file):
+        from similarity_matrix import SimilarityMatrix
+        matrix_script = importlib.import_module(commands['matrix'])
+        mds_script = importlib.import_module(commands['mds'])
+        matrix = SimilarityMatrix.load(state_file)
+        figures.append(matrix_script.heatmap_figure(matrix, matrix.labels,
+                                                    figure_path(settings, 'similarity_heatmap_mean_stddev.png')))
+        figures.append(mds_script.mds_figure(matrix.distance_matrix(matrix.labels), matrix.labels,
+                                             figure_path(settings, 'mds.png')))
+
+    results_dir = resolve_path(settings.get('results_dir', 'bindiff_results'), base)
+    if os.path.isdir(results_dir):
+        kde_script = importlib.import_module(commands['kde'])
+        grouped_scores = kde_script.aggregate_scores_by_compiler(kde_script.group_files_by_compiler(results_dir))
+        if grouped_scores:
+            figures.append(kde_script.kde_figure(grouped_scores, figure_path(settings, 'kde_by_configuration.png')))
+        distribution_script = importlib.import_module('run_bindiff_paiswise_sd_Done')
+        histogram = distribution_script.aggregate_all_scores(results_dir)
+        if histogram.n:
+            figures.append(distribution_script.distribution_figure(
+                histogram, figure_path(settings, 'BinDiff_Similarity_Distribution.png')))
+
+    db_path = resolve_path(settings.get('db_path', 'similarity_scores.db'), base)
+    if os.path.isfile(db_path):
+        import sqlite3
+        from score_arrays import open_score_arrays
+        threshold_script = importlib.import_module(commands['threshold'])
+        conn = sqlite3.connect(db_path)
+        try:
+            arrays_dir = resolve_path(settings.get('arrays_dir', threshold_script.arrays_dir), base)
+            arrays = open_score_arrays(conn, arrays_dir)
+        finally:
+            conn.close()
+        df_std_filtered = threshold_script.compact_std_devs(
+            arrays, settings.get('min_data_points', threshold_script.min_data_points))
+        figures.extend(threshold_script.std_dev_figures(
+            df_std_filtered, settings.get('threshold', threshold_script.threshold),
+            figure_path(settings, 'std_dev_distribution.png'), figure_path(settings, 'std_dev_by_function.png'),
+            settings.get('max_bars', max_bars)))
+
+    if not figures:
+        print("Nothing to render: no matrix state, results directory or similarity database found.")
+        return 1
+    render_figures(figures, settings.get('render_workers'))
+    return 0
+
+
+# Function to run the main() of the script behind a subcommand
+def run_script(command, settings):
+    if command == 'kde' and settings.get('combined'):
+        # One distribution over all configurations instead of one KDE per configuration
+        module = importlib.import_module('run_bindiff_paiswise_sd_Done')
+    else:
+        module = importlib.import_module(commands[command])
+    return module.main(settings)
+
+
+# Function to build the argument parser; options left out fall back to the config file, then to the script defaults
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='bindiversity',
+        description='Run the BinDiversity BinDiff sweeps and analyses from one place.')
+    parser.add_argument('--config', help='JSON config file; top-level keys apply to every command, '
+                                         'a section named after a command overrides them for that command')
+    parser.add_argument('--base-path', dest='base_path', help='directory the relative paths are resolved against')
+    parser.add_argument('--no-show', '--headless', dest='show', action='store_false', default=None,
+                        help='write every figure to a file (rendered in worker processes) instead of showing it')
+    parser.add_argument('--figure-dir', dest='figure_dir', help='directory for figures written in headless mode')
+    parser.add_argument('--max-bars', dest='max_bars', type=int,
+                        help='bars shown in large bar charts before the rest is folded into "others"')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='compile every compiler/flag configuration into <config>/bin')
+    build.add_argument('--source-dir', dest='source_dir', help='source tree (configure script or Makefile)')
+    build.add_argument('--jobs', type=int, help='job slots shared by all make processes')
+    build.add_argument('--export-command', dest='export_command',
+                       help='command run per built binary, with {binary} and {output} (the .BinExport file)')
+
+    sweep = subparsers.add_parser('sweep', help='stage the BinExports and diff every pair, saving a log per pair')
+    matrix = subparsers.add_parser('matrix', help='diff every configuration pair and plot the mean ± std matrix')
+    mds = subparsers.add_parser('mds', help='plot an MDS embedding of the configuration distances')
+    verify = subparsers.add_parser('verify', help='check functions with similarity 1 at instruction level (angr)')
+    for sub in (sweep, matrix, mds, verify):
+        sub.add_argument('--directories', nargs='+', help='configuration directories holding the .BinExport files')
+        sub.add_argument('--results-dir', dest='results_dir', help='directory for the .BinDiff results')
+    for sub in (matrix, verify):
+        sub.add_argument('--workers', type=int, help='number of parallel processes')
+    sweep.add_argument('--staging-dir', dest='staging_dir', help='directory for the renamed BinExport files')
+    matrix.add_argument('--mode', choices=('pair', 'batch'), help='one bindiff per pair or one batch per binary')
+    for sub in (sweep, matrix):
+        sub.add_argument('--no-incremental', dest='incremental', action='store_false', default=None,
+                         help='re-diff every pair instead of resuming from the stored results')
+        sub.add_argument('--shard', help='only diff shard i of N (i/N, 0 <= i < N); combine the shards with merge')
+    matrix.add_argument('--prefilter', action='store_true', default=None,
+                        help='skip BinDiff for byte-identical pairs (they get no .BinDiff for the function analyses)')
+    verify.add_argument('--chunk-size', dest='chunk_size', type=int, help='function pairs per worker task')
+    mds.add_argument('--embedding', choices=('folders', 'binaries', 'functions'),
+                     help='embed the configurations, every (binary, configuration) or every function (landmark MDS)')
+    mds.add_argument('--function-db', dest='function_db', help='function score store for the functions embedding')
+
+    ingest = subparsers.add_parser('ingest', help='ingest new or changed .BinDiff results into SQLite')
+    threshold = subparsers.add_parser('threshold', help='plot the functions whose similarity varies most')
+    kde = subparsers.add_parser('kde', help='plot the distribution of function similarity scores')
+    always_one = subparsers.add_parser('always-one', help='list functions with similarity 1 in every comparison')
+    for sub in (ingest, threshold, kde):
+        sub.add_argument('--results-dir', dest='results_dir', help='directory with the .BinDiff results')
+    for sub in (ingest, threshold):
+        sub.add_argument('--db', dest='db_path', help='similarity scores database')
+    threshold.add_argument('--min-count', dest='min_data_points', type=int,
+                           help='minimum number of scores per function')
+    threshold.add_argument('--threshold', type=float, help='standard deviation above which a function is plotted')
+    kde.add_argument('--combined', action='store_true', default=None,
+                     help='one distribution over all configurations instead of one KDE per configuration')
+    kde.add_argument('--output', help='image file for the combined distribution')
+    always_one.add_argument('--output-csv', dest='output_csv', help='CSV file for the functions found')
+    always_one.add_argument('--function-db', '--db', dest='function_db', help='function score store')
+    always_one.add_argument('--complete', action='store_true', default=None,
+                            help='only functions matched in every result file (of their binary with --per-binary)')
+    always_one.add_argument('--per-binary', dest='per_binary', action='store_true', default=None,
+                            help='group functions per binary instead of by name over all result files')
+    always_one.add_argument('--never', action='store_true', default=None,
+                            help='list the functions never matched with similarity 1 instead')
+    always_one.add_argument('--function', help='print the score vector of one function instead')
+    always_one.add_argument('--binary', help='restrict --function to one binary')
+
+    merge = subparsers.add_parser('merge', help='combine the results and matrix states of sharded sweeps')
+    merge.add_argument('--results-dir', dest='results_dir', help='directory the .BinDiff results are merged into')
+    merge.add_argument('--inputs', nargs='+',
+                       help='base paths of the hosts that ran shards (default: the base path, shared by all)')
+
+    render = subparsers.add_parser('render', help='redraw all figures from stored outputs into the figure directory')
+    render.add_argument('--results-dir', dest='results_dir', help='directory with the .BinDiff results')
+    render.add_argument('--db', dest='db_path', help='similarity scores database')
+    render.add_argument('--matrix-state', dest='matrix_state', help='saved similarity matrix (.npz)')
+    render.add_argument('--workers', dest='render_workers', type=int, help='number of render processes')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    settings = command_config(load_config(args.config), args.command)
+    # Command-line options override the config file
+    settings.update({key: value for key, value in vars(args).items()
+                     if value is not None and key not in ('config', 'command')})
+    if args.command == 'ingest':
+        return run_ingest(settings)
+    if args.command == 'render':
+        return run_render(settings)
+    return run_script(args.command, settings)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+import os
+import json
+
+
+# Function to read a JSON config file; without a file every script keeps its own defaults
+def load_config(path=None):
+    if not path:
+        return {}
+    with open(os.path.expanduser(path), 'r') as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f"Config file {path} must contain a JSON object")
+    return config
+
+
+# Function to get the settings of one command: the top-level keys, overridden by the command's own section
+# e.g. {"workers": 8, "verify": {"workers": 2}} gives verify 2 workers and every other command 8
+def command_config(config, command):
+    settings = {key: value for key, value in config.items() if not isinstance(value, dict)}
+    settings.update(config.get(command) or {})
+    return settings
+
+
+# Function to resolve a configured path against a base directory (absolute and ~ paths are kept as they are)
+def resolve_path(path, base_path):
+    return os.path.join(os.path.expanduser(base_path), os.path.expanduser(path))
+
+
+# Function to resolve the configured configuration directories against the base path
+def resolve_directories(directories, base_path):
+    return [resolve_path(directory, base_path) for directory in directories]
@@ -0,0 +1,130 @@
+import os
+import json
+import shutil
+from bindiff_cache import file_sha256
+
+# Name of the manifest that maps staged (prefixed) names back to their sources
+manifest_name = 'staging_manifest.json'
+
+
+# Function to load the staging manifest of an output directory
+def load_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, manifest_name)
+    if not os.path.isfile(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r') as mf:
+            return json.load(mf)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable staging manifest {manifest_path}: {e}")
+        return {}
+
+
+# Function to write the staging manifest atomically
+def save_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, manifest_name)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w') as mf:
+        json.dump(manifest, mf, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+# Function to stage one file without copying: hard link, then symlink, then copy as last resort
+def link_or_copy(source, destination):
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(source), destination)
+        return 'symlink'
+    except OSError:
+        pass
+    shutil.copy2(source, destination)
+    return 'copy'
+
+
+# Function to check whether a manifest entry still matches its source and staged file
+def is_up_to_date(entry, source, destination):
+    if entry is None or entry.get('source') != source or not os.path.lexists(destination):
+        return False
+    try:
+        st = os.stat(source)
+        os.stat(destination)
+        # A deduplicated file shares the staged inode of another source, which can change under it
+        linked = os.stat(entry['linked_source']) if entry.get('linked_source') else None
+    except OSError:
+        return False
+    if linked is not None and (entry.get('linked_size') != linked.st_size or
+                               entry.get('linked_mtime_ns') != linked.st_mtime_ns):
+        return False
+    return entry.get('size') == st.st_size and entry.get('mtime_ns') == st.st_mtime_ns
+
+
+# Function to stage the .BinExport files of all directories under prefixed names
+# Returns {prefixed_name: staged_path} and keeps a manifest next to the staged files
+def stage_binexport_files(directories, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    old_manifest = load_manifest(output_dir)
+    manifest = {}
+    staged_files = {}
+    # First staged name for every content hash, used to dedupe identical exports
+    canonical = {}
+    counts = {'hardlink': 0, 'symlink': 0, 'copy': 0, 'unchanged': 0, 'duplicate': 0}
+
+    for directory in directories:
+        dir_name = os.path.basename(os.path.dirname(directory))
+        for file in sorted(os.listdir(directory)):
+            if not file.endswith('.BinExport'):
+                continue
+            source = os.path.join(directory, file)
+            new_file_name = f"{dir_name}_{file}"
+            new_file_path = os.path.join(output_dir, new_file_name)
+            entry = old_manifest.get(new_file_name)
+
+            if is_up_to_date(entry, source, new_file_path):
+                digest = entry['sha256']
+                counts['unchanged'] += 1
+            else:
+                st = os.stat(source)
+                digest = file_sha256(source)
+                # Byte-identical exports share the inode of the first staged copy
+                target = os.path.join(output_dir, canonical[digest]) if digest in canonical else source
+                method = link_or_copy(target, new_file_path)
+                counts[method] += 1
+                entry = {
+                    'source': source,
+                    'size': st.st_size,
+                    'mtime_ns': st.st_mtime_ns,
+                    'sha256': digest,
+                    'method': method,
+                }
+                if target != source:
+                    # Staged as the canonical copy: it must be re-staged when that source changes
+                    linked_source = manifest[canonical[digest]]['source']
+                    linked = os.stat(linked_source)
+                    entry.update(linked_source=linked_source, linked_size=linked.st_size,
+                                 linked_mtime_ns=linked.st_mtime_ns)
+
+            if digest in canonical:
+                entry['duplicate_of'] = canonical[digest]
+                counts['duplicate'] += 1
+            else:
+                entry.pop('duplicate_of', None)
+                canonical[digest] = new_file_name
+            manifest[new_file_name] = entry
+            staged_files[new_file_name] = new_file_path
+
+    # Drop staged files whose source no longer exists
+    for stale_name in set(old_manifest) - set(manifest):
+        stale_path = os.path.join(output_dir, stale_name)
+        if os.path.lexists(stale_path):
+            os.remove(stale_path)
+
+    save_manifest(output_dir, manifest)
+    print(f"Staged {len(staged_files)} BinExport files: " +
+          ", ".join(f"{count} {kind}" for kind, count in counts.items()))
+    return staged_files
@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import select
+import time
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from bindiff_metrics import open_metrics, record_metric
+from bindiversity_config import resolve_path
+
+# Set the base path to the Desktop; every configuration is built into <base_path>/<name>/bin
+base_path = os.path.join(os.path.expanduser("~"), "Desktop")
+
+# Source tree to build (an autoconf tree with ./configure, or a plain Makefile project)
+source_dir = 'coreutils'
+
+# Compiler configurations: name of the output directory, compiler, compiler version and CFLAGS
+# The compiler command is <compiler>-<version> (gcc-9), or just <compiler> without a version
+configurations = [
+    {'name': 'coreutils-7', 'compiler': 'gcc', 'version': '7', 'cflags': ''},
+    {'name': 'coreutils-7-CFLAGS-O1', 'compiler': 'gcc', 'version': '7', 'cflags': '-O1'},
+    {'name': 'coreutils-7cflags03', 'compiler': 'gcc', 'version': '7', 'cflags': '-O3'},
+    {'name': 'coreutils-9-cflagsO1', 'compiler': 'gcc', 'version': '9', 'cflags': '-O1'},
+    {'name': 'coreutils-9-cflagsO3', 'compiler': 'gcc', 'version': '9', 'cflags': '-O3'},
+    {'name': 'coreutils-gcc_9', 'compiler': 'gcc', 'version': '9', 'cflags': ''},
+]
+
+# Total job budget shared by every make process of every configuration (GNU make jobserver)
+build_jobs = int(os.environ.get('BUILD_JOBS', os.cpu_count() or 1))
+
+# Optional command run for every built binary, e.g. a headless BinExport export;
+# {binary} is the executable and {output} the .BinExport file expected next to it
+export_command = os.environ.get('BUILD_EXPORT_COMMAND')
+
+# Written into every build directory; a configuration is only reconfigured when it changes
+stamp_file = '.build-stamp.json'
+
+
+# Job slots shared with make through the jobserver protocol (a pipe holding one byte per free slot)
+# Every configuration holds one slot while it runs; its make takes further slots from the pipe
+class JobServer:
+    def __init__(self, jobs):
+        self.jobs = max(int(jobs), 1)
+        self.read_fd, self.write_fd = os.pipe()
+        os.write(self.write_fd, b'+' * self.jobs)
+
+    def acquire(self):
+        # make switches the shared pipe to non-blocking, so wait until a token can be read
+        while True:
+            select.select([self.read_fd], [], [])
+            try:
+                return os.read(self.read_fd, 1)
+            except BlockingIOError:
+                continue
+
+    def release(self, token):
+        os.write(self.write_fd, token)
+
+    # Function to get the environment that makes make join the jobserver
+    def environment(self):
+        env = dict(os.environ)
+        env['MAKEFLAGS'] = f"-j{self.jobs} --jobserver-auth={self.read_fd},{self.write_fd}"
+        return env
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+# Function to get the compiler command of a configuration
+def compiler_command(configuration):
+    version = configuration.get('version')
+    return f"{configuration['compiler']}-{version}" if version else configuration['compiler']
+
+
+# Function to describe everything that invalidates the objects of a configuration
+def configuration_stamp(configuration):
+    cc = compiler_command(configuration)
+    try:
+        cc_version = subprocess.run([cc, '--version'], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        cc_version = None
+    return {'cc': cc, 'cc_version': cc_version, 'cflags': configuration.get('cflags', ''),
+            'configure_args': configuration.get('configure_args', [])}
+
+
+# Function to read the stamp a build directory was configured with
+def read_stamp(build_dir):
+    try:
+        with open(os.path.join(build_dir, stamp_file)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# Function to copy a plain Makefile project into its build directory, only files that changed
+# Copies keep the source mtimes, so make still sees the existing objects as up to date
+def sync_source_tree(source, build_dir):
+    for root, dirs, files in os.walk(source):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        target_root = os.path.join(build_dir, os.path.relpath(root, source))
+        os.makedirs(target_root, exist_ok=True)
+        for file in files:
+            src = os.path.join(root, file)
+            dst = os.path.join(target_root, file)
+            st = os.stat(src)
+            try:
+                current = os.stat(dst)
+                if current.st_size == st.st_size and current.st_mtime_ns == st.st_mtime_ns:
+                    continue
+            except FileNotFoundError:
+                pass
+            shutil.copy2(src, dst)
+
+
+# Function to check whether a file is an ELF executable
+def is_elf_executable(path):
+    if not os.path.isfile(path) or not os.access(path, os.X_OK):
+        return False
+    with open(path, 'rb') as file:
+        return file.read(4) == b'\x7fELF'
+
+
+# Function to copy the executables built by a plain Makefile project into bin_dir
+def collect_executables(build_dir, bin_dir):
+    os.makedirs(bin_dir, exist_ok=True)
+    collected = []
+    for root, dirs, files in os.walk(build_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            if file.endswith(('.o', '.so', '.a')) or not is_elf_executable(path):
+                continue
+            shutil.copy2(path, os.path.join(bin_dir, file))
+            collected.append(file)
+    return collected
+
+
+# Function to run one build step, appending its output to the build log
+def run_step(cmd, cwd, log, env=None, pass_fds=()):
+    log.write(f"$ {' '.join(cmd)}\n")
+    log.flush()
+    return subprocess.run(cmd, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, env=env, pass_fds=pass_fds).returncode
+
+
+# Function to build one configuration into <build_root>/<name>/bin
+# Objects live in <build_root>/<name>/build and are reused while the configuration stamp is unchanged
+def build_configuration(configuration, source, build_root, jobserver):
+    name = configuration['name']
+    output_dir = os.path.join(build_root, name)
+    build_dir = os.path.join(output_dir, 'build')
+    bin_dir = os.path.join(output_dir, 'bin')
+    stamp = configuration_stamp(configuration)
+    autoconf = os.path.isfile(os.path.join(source, 'configure'))
+
+    # Empty CFLAGS are left out, so autoconf keeps its default -g -O2 instead of building at -O0
+    cflags = [f"CFLAGS={stamp['cflags']}"] if stamp['cflags'] else []
+
+    reconfigure = read_stamp(build_dir) != stamp
+    if reconfigure and os.path.isdir(build_dir):
+        print(f"{name}: configuration changed, rebuilding from scratch")
+        shutil.rmtree(build_dir)
+    if reconfigure and os.path.isdir(bin_dir):
+        # Executables (and their exports) built with the old configuration must not survive
+        shutil.rmtree(bin_dir)
+    os.makedirs(build_dir, exist_ok=True)
+
+    make_env = jobserver.environment()
+    make_fds = (jobserver.read_fd, jobserver.write_fd)
+    token = jobserver.acquire()
+    started = time.monotonic()
+    try:
+        with open(os.path.join(output_dir, 'build.log'), 'a') as log:
+            if autoconf:
+                # Out-of-tree build; make install puts the programs in <output_dir>/bin
+                if reconfigure:
+                    returncode = run_step([os.path.join(source, 'configure'), f"--prefix={output_dir}",
+                                           f"CC={stamp['cc']}"] + cflags
+                                          + list(stamp['configure_args']), build_dir, log)
+                    if returncode != 0:
+                        return name, 'configure failed', returncode, time.monotonic() - started
+                returncode = run_step(['make'], build_dir, log, make_env, make_fds)
+                if returncode == 0:
+                    returncode = run_step(['make', 'install'], build_dir, log, make_env, make_fds)
+            else:
+                sync_source_tree(source, build_dir)
+                returncode = run_step(['make', f"CC={stamp['cc']}"] + cflags, build_dir, log, make_env, make_fds)
+                if returncode == 0:
+                    collect_executables(build_dir, bin_dir)
+    finally:
+        jobserver.release(token)
+
+    if returncode != 0:
+        return name, 'make failed', returncode, time.monotonic() - started
+    if reconfigure:
+        with open(os.path.join(build_dir, stamp_file), 'w') as file:
+            json.dump(stamp, file)
+    return name, 'ok', 0, time.monotonic() - started
+
+
+# Function to run the export command for one binary, holding one job slot
+# Binaries whose .BinExport is newer than the binary are skipped
+def export_binary(binary, command, jobserver):
+    output = f"{binary}.BinExport"
+    if os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(binary):
+        return binary, 'unchanged', 0
+    token = jobserver.acquire()
+    try:
+        returncode = subprocess.run(command.format(binary=binary, output=output), shell=True).returncode
+    finally:
+        jobserver.release(token)
+    return binary, 'ok' if returncode == 0 else 'export failed', returncode
+
+
+# Function to build every configuration concurrently under one shared job budget
+# Returns {name: (status, returncode, seconds)}
+def build_matrix(configurations, source, build_root, jobs=None, metrics=None):
+    jobserver = JobServer(jobs or build_jobs)
+    results = {}
+    try:
+        # One thread per configuration; the jobserver slots decide how many actually run
+        with ThreadPoolExecutor(max_workers=max(len(configurations), 1)) as executor:
+            futures = [executor.submit(build_configuration, configuration, source, build_root, jobserver)
+                       for configuration in configurations]
+            for future in futures:
+                name, status, returncode, seconds = future.result()
+                results[name] = (status, returncode, seconds)
+                print(f"{name}: {status} in {seconds:.1f}s")
+                record_metric(metrics, 'build', name, wall_seconds=seconds, status=status, returncode=returncode)
+    finally:
+        jobserver.close()
+    return results
+
+
+# Function to export every binary of the built configurations with the export command
+def export_matrix(names, build_root, command, jobs=None):
+    binaries = []
+    for name in names:
+        bin_dir = os.path.join(build_root, name, 'bin')
+        if os.path.isdir(bin_dir):
+            binaries.extend(os.path.join(bin_dir, file) for file in sorted(os.listdir(bin_dir))
+                            if not file.endswith('.BinExport'))
+    jobserver = JobServer(jobs or build_jobs)
+    try:
+        with ThreadPoolExecutor(max_workers=jobserver.jobs) as executor:
+            results = list(executor.map(lambda binary: export_binary(binary, command, jobserver), binaries))
+    finally:
+        jobserver.close()
+    for binary, status, returncode in results:
+        if status not in ('ok', 'unchanged'):
+            print(f"Export of {binary} failed with exit code {returncode}")
+    return results
+
+
+# Main function: build (and optionally export) every configuration of the build matrix
+# config keys: base_path, source_dir, configurations, jobs, export_command
+def main(config=None):
+    config = config or {}
+    base = os.path.expanduser(config.get('base_path', base_path))
+    source = resolve_path(config.get('source_dir', source_dir), base)
+    matrix = config.get('configurations', configurations)
+    jobs = config.get('jobs') or build_jobs
+    command = config.get('export_command', export_command)
+
+    if not os.path.isfile(os.path.join(source, 'configure')) and not os.path.isfile(os.path.join(source, 'Makefile')):
+        print(f"No configure script or Makefile found in {source}")
+        return 1
+
+    os.makedirs(base, exist_ok=True)
+    metrics = open_metrics(os.path.join(base, 'bindiff_metrics.db'))
+    print(f"Building {len(matrix)} configurations of {source} with {jobs} jobs")
+    results = build_matrix(matrix, source, base, jobs, metrics)
+    failed = [name for name, (status, _, _) in results.items() if status != 'ok']
+    for name in failed:
+        print(f"{name} failed, see {os.path.join(base, name, 'build.log')}")
+
+    if command:
+        built = [name for name, (status, _, _) in results.items() if status == 'ok']
+        export_matrix(built, base, command, jobs)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Headless mode (BINDIFF_HEADLESS=1): figures are written to files by worker processes
+# with the Agg backend instead of being shown, so unattended sweeps never block on plt.show()
+headless = os.environ.get('BINDIFF_HEADLESS', '0') != '0'
+figure_dir = os.environ.get('BINDIFF_FIGURE_DIR', 'figures')
+render_workers = int(os.environ.get('BINDIFF_RENDER_WORKERS', 0)) or None
+
+# Bar charts show at most this many bars; the rest is folded into one "others" bar
+max_bars = int(os.environ.get('BINDIFF_MAX_BARS', 50))
+
+
+# Function to decide whether a script shows its figures (config 'show' wins over BINDIFF_HEADLESS)
+def should_show(config):
+    return config.get('show', not headless)
+
+
+# Function to get the file a figure is written to in headless mode
+def figure_path(config, name):
+    directory = os.path.expanduser(config.get('figure_dir', figure_dir))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+# Function to switch the current process to the non-interactive Agg backend
+def use_headless_backend():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+# Function to draw one figure in a render worker and release it afterwards
+def _render_one(function, kwargs):
+    import matplotlib.pyplot as plt
+    try:
+        function(**kwargs)
+    finally:
+        plt.close('all')
+    return kwargs.get('output_file')
+
+
+# Function to write figures to files; figures is a list of (render function, keyword arguments)
+# Every render function draws one figure and saves it to its output_file. Several figures are
+# rendered in parallel processes; render functions must be module-level so they can be pickled
+def render_figures(figures, workers=None):
+    figures = list(figures)
+    workers = min(len(figures), workers or render_workers or os.cpu_count() or 1)
+    if workers <= 1:
+        use_headless_backend()
+        output_files = [_render_one(function, kwargs) for function, kwargs in figures]
+    else:
+        # spawn gives every worker a fresh interpreter, so no GUI backend state is inherited
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=use_headless_backend) as executor:
+            futures = [executor.submit(_render_one, function, kwargs) for function, kwargs in figures]
+            output_files = [future.result() for future in futures]
+    for output_file in output_files:
+        print(f"Figure written to {output_file}")
+    return output_files
+
+
+# Function to show figures interactively, or render them to files when running headless
+def show_or_render(figures, show, workers=None):
+    if not show:
+        return render_figures(figures, workers)
+    import matplotlib.pyplot as plt
+    for function, kwargs in figures:
+        function(**kwargs)
+    plt.show()
+    return [kwargs.get('output_file') for _, kwargs in figures]
+
+
+# Function to split indices into the k largest values (in descending order) and the rest
+def split_top_k(values, k=None):
+    k = max_bars if k is None else k
+    order = sorted(range(len(values)), key=lambda i: values[i], reverse=True)
+    return order[:k], order[k:]
+
+
+# Function to cap a bar chart to its k largest values plus one "others" bar
+# The others bar holds the mean of the remaining values, so it stays on the same scale
+def top_k_with_others(labels, values, k=None):
+    top, rest = split_top_k(values, k)
+    top_labels = [labels[i] for i in top]
+    top_values = [values[i] for i in top]
+    if rest:
+        top_labels.append(f'others ({len(rest)}, mean)')
+        top_values.append(sum(values[i] for i in rest) / len(rest))
+    return top_labels, top_values
@@ -0,0 +1,193 @@
+import os
+import sqlite3
+from bindiff_cache import file_sha256
+from similarity_ingest import find_result_files
+
+
+# Function to create the function score store: one row per (binary, function, config pair)
+# diff_files is the ingestion ledger, function_summary holds per-function aggregates so the
+# "always identical" and "never identical" questions are answered from an index
+def ensure_store_schema(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS diff_files
+                 (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, binary TEXT,
+                  primary_config TEXT, secondary_config TEXT,
+                  size INTEGER, mtime_ns INTEGER, sha256 TEXT, rows INTEGER)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS function_scores
+                 (file_id INTEGER, binary TEXT, function_name TEXT, primary_config TEXT, secondary_config TEXT,
+                  address1 INTEGER, address2 INTEGER, similarity REAL, confidence REAL)''')
+    # Covering index for the score vector of one function
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_function_scores_function
+                 ON function_scores (function_name, binary, primary_config, secondary_config, similarity)''')
+    # Covering index for rebuilding the summary of a binary
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_function_scores_binary
+                 ON function_scores (binary, function_name, file_id, similarity)''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_function_scores_file ON function_scores (file_id)')
+    c.execute('''CREATE TABLE IF NOT EXISTS function_summary
+                 (binary TEXT, function_name TEXT, pairs INTEGER, identical_pairs INTEGER,
+                  min_similarity REAL, max_similarity REAL, PRIMARY KEY (binary, function_name))''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_function_summary_min
+                 ON function_summary (min_similarity, binary, function_name, pairs)''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_function_summary_max
+                 ON function_summary (max_similarity, binary, function_name, pairs)''')
+    conn.commit()
+
+
+# Function to strip the .BinExport extension from a file name
+def _export_stem(name):
+    return name[:-len('.BinExport')] if name.endswith('.BinExport') else name
+
+
+# Function to get (binary, primary config, secondary config) from a result path
+# Handles <config1>_vs_<config2>/<binary>_vs_<binary>.BinDiff (pair directories) and
+# <config1>_<binary>_vs_<config2>_<binary>.BinDiff (flat, as written by the save-log sweep)
+def parse_result_name(relpath):
+    name = os.path.basename(relpath)
+    if name.endswith('.BinDiff'):
+        name = name[:-len('.BinDiff')]
+    primary, _, secondary = name.partition('_vs_')
+    primary, secondary = _export_stem(primary), _export_stem(secondary)
+    pair_dir = os.path.basename(os.path.dirname(relpath))
+    if primary == secondary and '_vs_' in pair_dir:
+        config1, _, config2 = pair_dir.partition('_vs_')
+        return primary, config1, config2
+    # The binary is the shortest common suffix that follows an underscore on both sides;
+    # configuration names may contain underscores (coreutils-gcc_9), the tool names do not
+    for i in range(len(primary) - 1, -1, -1):
+        if primary[i] == '_' and secondary.endswith(primary[i:]) and len(secondary) > len(primary) - i:
+            binary = primary[i + 1:]
+            return binary, primary[:i], secondary[:len(secondary) - len(binary) - 1]
+    return primary, None, None
+
+
+# Function to read the function rows of a .BinDiff file
+def read_function_rows(result_file):
+    try:
+        db_conn = sqlite3.connect(f'file:{result_file}?mode=ro', uri=True)
+        try:
+            return db_conn.execute("SELECT name1, address1, address2, similarity, confidence FROM function").fetchall()
+        finally:
+            db_conn.close()
+    except sqlite3.Error as e:
+        print(f"SQLite error in {result_file}: {e}")
+        return []
+
+
+# Function to recompute the per-function aggregates of the given binaries
+def refresh_summary(conn, binaries):
+    for binary in binaries:
+        conn.execute("DELETE FROM function_summary WHERE binary = ?", (binary,))
+        conn.execute('''INSERT INTO function_summary
+                        SELECT binary, function_name, COUNT(DISTINCT file_id), SUM(similarity >= 1),
+                               MIN(similarity), MAX(similarity)
+                        FROM function_scores WHERE binary = ? GROUP BY binary, function_name''', (binary,))
+
+
+# Function to ingest new or changed .BinDiff files below results_dir into the store
+# Like the similarity_scores ingest, unchanged files are skipped via the ledger and
+# everything is written in one transaction
+def ingest_function_scores(conn, results_dir):
+    ensure_store_schema(conn)
+    ledger = {row[0]: row[1:] for row in
+              conn.execute("SELECT filename, id, binary, size, mtime_ns, sha256 FROM diff_files").fetchall()}
+    result_files = find_result_files(results_dir)
+    stats = {'ingested': 0, 'unchanged': 0, 'removed': 0, 'rows': 0}
+    touched = set()
+
+    with conn:
+        for filename, path in result_files.items():
+            st = os.stat(path)
+            previous = ledger.get(filename)
+            if previous is not None and previous[2] == st.st_size and previous[3] == st.st_mtime_ns:
+                stats['unchanged'] += 1
+                continue
+            digest = file_sha256(path)
+            if previous is not None and previous[4] == digest:
+                # Touched but not changed, only refresh the ledger
+                conn.execute("UPDATE diff_files SET size = ?, mtime_ns = ? WHERE id = ?",
+                             (st.st_size, st.st_mtime_ns, previous[0]))
+                stats['unchanged'] += 1
+                continue
+
+            binary, config1, config2 = parse_result_name(filename)
+            rows = read_function_rows(path)
+            if previous is not None:
+                file_id = previous[0]
+                conn.execute("DELETE FROM function_scores WHERE file_id = ?", (file_id,))
+                conn.execute("UPDATE diff_files SET binary = ?, primary_config = ?, secondary_config = ?, size = ?, "
+                             "mtime_ns = ?, sha256 = ?, rows = ? WHERE id = ?",
+                             (binary, config1, config2, st.st_size, st.st_mtime_ns, digest, len(rows), file_id))
+                touched.add(previous[1])
+            else:
+                file_id = conn.execute("INSERT INTO diff_files (filename, binary, primary_config, secondary_config, "
+                                       "size, mtime_ns, sha256, rows) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                       (filename, binary, config1, config2, st.st_size, st.st_mtime_ns, digest,
+                                        len(rows))).lastrowid
+            conn.executemany("INSERT INTO function_scores VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             ((file_id, binary, name, config1, config2, address1, address2, similarity, confidence)
+                              for name, address1, address2, similarity, confidence in rows))
+            touched.add(binary)
+            stats['ingested'] += 1
+            stats['rows'] += len(rows)
+
+        # Forget results that were deleted from the results directory
+        for filename in set(ledger) - set(result_files):
+            file_id, binary = ledger[filename][:2]
+            conn.execute("DELETE FROM function_scores WHERE file_id = ?", (file_id,))
+            conn.execute("DELETE FROM diff_files WHERE id = ?", (file_id,))
+            touched.add(binary)
+            stats['removed'] += 1
+
+        refresh_summary(conn, touched)
+
+    print(f"Function score store: ingested {stats['ingested']} files ({stats['rows']} rows), "
+          f"skipped {stats['unchanged']} unchanged, removed {stats['removed']}")
+    return stats
+
+
+# Function to find the function names with similarity 1 in every result file they were matched in
+# Like the original script, a name is grouped across all result files (of every binary); with
+# complete=True it also has to be matched in every result file. Returns (function_name, files)
+def always_identical_by_name(conn, complete=False):
+    query = '''SELECT function_name, COUNT(DISTINCT file_id) FROM function_scores
+               GROUP BY function_name HAVING MIN(similarity) >= 1'''
+    if complete:
+        query += ' AND COUNT(DISTINCT file_id) >= (SELECT COUNT(*) FROM diff_files)'
+    return conn.execute(query + ' ORDER BY function_name').fetchall()
+
+
+# Function to find the functions with similarity 1 in every config pair their binary was diffed in
+# Returns (binary, function_name, pairs); with complete=False a function only has to be
+# identical wherever BinDiff matched it
+def always_identical(conn, complete=True):
+    query = '''SELECT s.binary, s.function_name, s.pairs FROM function_summary s
+               JOIN (SELECT binary, COUNT(*) AS diffs FROM diff_files GROUP BY binary) d ON d.binary = s.binary
+               WHERE s.min_similarity >= 1'''
+    if complete:
+        query += ' AND s.pairs >= d.diffs'
+    return conn.execute(query + ' ORDER BY s.binary, s.function_name').fetchall()
+
+
+# Function to find the functions that were never matched with similarity 1 in any config pair
+# Returns (binary, function_name, pairs, max_similarity)
+def never_identical(conn):
+    return conn.execute('''SELECT binary, function_name, pairs, max_similarity FROM function_summary
+                           WHERE max_similarity < 1 ORDER BY binary, function_name''').fetchall()
+
+
+# Function to get the score vector of one function: (binary, primary config, secondary config, similarity)
+def score_vector(conn, function_name, binary=None):
+    query = '''SELECT binary, primary_config, secondary_config, similarity FROM function_scores
+               WHERE function_name = ?'''
+    params = [function_name]
+    if binary is not None:
+        query += ' AND binary = ?'
+        params.append(binary)
+    return conn.execute(query + ' ORDER BY binary, primary_config, secondary_config', params).fetchall()
+
+
+# Function to list every (result file, function) pair that BinDiff matched with similarity 1
+def identical_matches(conn):
+    return conn.execute('''SELECT d.filename, f.function_name FROM function_scores f
+                           JOIN diff_files d ON d.id = f.file_id
+                           WHERE f.similarity >= 1 ORDER BY d.filename, f.function_name''').fetchall()
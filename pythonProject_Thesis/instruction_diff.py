@@ -0,0 +1,105 @@
+import re
+import logging
+from array import array
+
+# Immediates and addresses change with layout, not with code generation
+_hex_pattern = re.compile(r'-?0x[0-9a-fA-F]+')
+_dec_pattern = re.compile(r'(?<![\w.*])-?\d+\b')
+
+# Interned normalized instructions -> integer ids, shared by all comparisons
+_token_ids = {}
+
+# Normalized instructions per (binary, function address)
+_function_cache = {}
+
+
+# Function to normalize one instruction so that relocated code compares equal
+def normalize_instruction(mnemonic, op_str):
+    op_str = _hex_pattern.sub('IMM', op_str)
+    op_str = _dec_pattern.sub('IMM', op_str)
+    return f"{mnemonic} {op_str}".strip()
+
+
+# Function to turn normalized instructions into an integer array
+def hash_instructions(instructions):
+    ids = array('q')
+    for instruction in instructions:
+        token = _token_ids.get(instruction)
+        if token is None:
+            token = _token_ids[instruction] = len(_token_ids)
+        ids.append(token)
+    return ids
+
+
+# Function to compute the length of the longest common subsequence with Myers' O((N+M)D) diff
+def myers_lcs_length(a, b):
+    # Common prefix and suffix are the usual case for near-identical functions
+    start = 0
+    end_a, end_b = len(a), len(b)
+    while start < end_a and start < end_b and a[start] == b[start]:
+        start += 1
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    common = start + (len(a) - end_a)
+    a = a[start:end_a]
+    b = b[start:end_b]
+    n, m = len(a), len(b)
+    if n == 0 or m == 0:
+        return common
+
+    max_d = n + m
+    offset = max_d
+    v = array('q', [0]) * (2 * max_d + 2)
+    for d in range(max_d + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                # D edits: every edit is one insertion or deletion
+                return common + (n + m - d) // 2
+    return common
+
+
+# Function to collect the normalized instructions of a whole function through its CFG
+def function_instructions(project, symbol):
+    cache_key = (project.loader.main_object.binary, symbol.rebased_addr)
+    if cache_key in _function_cache:
+        return _function_cache[cache_key]
+
+    start = symbol.rebased_addr
+    function = project.kb.functions.function(addr=start)
+    if function is None and symbol.size:
+        # Recover only this function instead of the whole binary
+        cfg = project.analyses.CFGFast(regions=[(start, start + symbol.size)], function_starts=[start],
+                                       normalize=True, symbols=False, function_prologues=False,
+                                       force_complete_scan=False)
+        function = cfg.kb.functions.function(addr=start)
+
+    if function is not None:
+        blocks = sorted(function.blocks, key=lambda block: block.addr)
+    else:
+        logging.warning(f"No CFG for {symbol.name}, falling back to its first basic block")
+        blocks = [project.factory.block(start)]
+
+    instructions = tuple(normalize_instruction(insn.mnemonic, insn.op_str)
+                         for block in blocks for insn in block.capstone.insns)
+    _function_cache[cache_key] = instructions
+    return instructions
+
+
+# Function to compare two functions instruction by instruction, tolerating insertions and deletions
+# Returns (identical, differing) where differing counts unmatched instructions on both sides
+def diff_functions(project1, symbol1, project2, symbol2):
+    instructions1 = hash_instructions(function_instructions(project1, symbol1))
+    instructions2 = hash_instructions(function_instructions(project2, symbol2))
+    identical = myers_lcs_length(instructions1, instructions2)
+    differing = len(instructions1) + len(instructions2) - 2 * identical
+    return identical, differing
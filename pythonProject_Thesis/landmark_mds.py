@@ -0,0 +1,111 @@
+import os
+import numpy as np
+
+# Points per distance block; a block holds chunk_size x configurations distances at a time
+default_chunk_size = int(os.environ.get('MDS_CHUNK_SIZE', 4096))
+
+
+# Distances between (group, configuration) points and the configurations used as landmarks
+# Only points of the same group (a binary, or a function of a binary) have measured distances, so
+# the landmarks are the configurations themselves: the distance between two configurations is their
+# mean distance over every group that compared them, and a point's distance to a configuration is the
+# measured distance to the same group's point of that configuration. Distances a group did not
+# measure fall back to the mean distance of the two configurations; configurations never compared
+# with each other get the maximal distance 1
+class GroupedDistances:
+    def __init__(self, group_distances):
+        self.configs = sorted({config for distances in group_distances.values()
+                               for pair in distances for config in pair})
+        index = {config: i for i, config in enumerate(self.configs)}
+        k = len(self.configs)
+        total, count = np.zeros((k, k)), np.zeros((k, k))
+        for distances in group_distances.values():
+            for (config1, config2), distance in distances.items():
+                i, j = index[config1], index[config2]
+                total[i, j] += distance
+                count[i, j] += 1
+                if i != j:
+                    total[j, i] += distance
+                    count[j, i] += 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.reference = np.where(count > 0, total / count, 1.0)
+        np.fill_diagonal(self.reference, 0.0)
+
+        self.points = []
+        rows = []
+        for group, distances in sorted(group_distances.items()):
+            configs = sorted({index[config] for pair in distances for config in pair})
+            matrix = self.reference[configs].copy()
+            position = {config: row for row, config in enumerate(configs)}
+            for (config1, config2), distance in distances.items():
+                i, j = index[config1], index[config2]
+                if i != j:
+                    matrix[position[i], j] = distance
+                    matrix[position[j], i] = distance
+            self.points.extend((group, self.configs[config]) for config in configs)
+            rows.append(matrix)
+        self.to_configs = np.concatenate(rows) if rows else np.zeros((0, k))
+
+    def __len__(self):
+        return len(self.points)
+
+    # Function to get the distances between the points in rows and every configuration
+    def block(self, rows):
+        return self.to_configs[np.asarray(rows, dtype=np.intp)]
+
+
+# Function to collect per-binary configuration distances (1 - similarity/100) from the sweep state
+# Returns {binary: {(config1, config2): distance}} for the given configuration labels
+def pair_result_distances(conn, labels=None):
+    totals = {}
+    for primary, secondary, binary, similarity in conn.execute(
+            "SELECT primary_label, secondary_label, binary, similarity FROM pair_results "
+            "WHERE similarity IS NOT NULL"):
+        if labels is not None and (primary not in labels or secondary not in labels):
+            continue
+        total = totals.setdefault(binary, {}).setdefault(tuple(sorted((primary, secondary))), [0.0, 0])
+        total[0] += similarity
+        total[1] += 1
+    return {binary: {pair: 1 - (total / count) / 100.0 for pair, (total, count) in pairs.items()}
+            for binary, pairs in totals.items()}
+
+
+# Function to collect per-function configuration distances (1 - similarity) from the function score store
+# Returns {(binary, function): {(config1, config2): distance}}; function similarities are 0..1
+def function_score_distances(conn):
+    totals = {}
+    for binary, function_name, primary, secondary, similarity in conn.execute(
+            "SELECT binary, function_name, primary_config, secondary_config, similarity FROM function_scores "
+            "WHERE similarity IS NOT NULL AND primary_config IS NOT NULL"):
+        total = totals.setdefault((binary, function_name), {}).setdefault(tuple(sorted((primary, secondary))),
+                                                                          [0.0, 0])
+        total[0] += similarity
+        total[1] += 1
+    return {key: {pair: 1 - total / count for pair, (total, count) in pairs.items()}
+            for key, pairs in totals.items()}
+
+
+# Function to embed all points with landmark MDS (de Silva & Tenenbaum), the configurations as landmarks
+# Classical MDS of the configuration distances, then every point is placed by distance-based triangulation
+# from its distances to the configurations, chunk by chunk; memory is O(configurations x chunk_size)
+def landmark_mds(distances, n_components=2, chunk_size=default_chunk_size):
+    n = len(distances)
+    if n == 0:
+        return np.zeros((0, n_components))
+
+    # Classical MDS of the landmarks on the double-centered squared distances
+    squared = distances.reference ** 2
+    k = len(squared)
+    centering = np.eye(k) - np.full((k, k), 1.0 / k)
+    eigenvalues, eigenvectors = np.linalg.eigh(-0.5 * centering @ squared @ centering)
+    order = np.argsort(eigenvalues)[::-1][:n_components]
+    keep = order[eigenvalues[order] > 1e-12]
+    projection = eigenvectors[:, keep] / np.sqrt(eigenvalues[keep])
+    mean_squared = squared.mean(axis=1)
+
+    coords = np.zeros((n, n_components))
+    for start in range(0, n, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, n))
+        to_landmarks = distances.block(rows) ** 2
+        coords[rows, :len(keep)] = -0.5 * (to_landmarks - mean_squared) @ projection
+    return coords
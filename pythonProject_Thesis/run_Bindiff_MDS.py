@@ -1,11 +1,14 @@
 import os
-import subprocess
-import pandas as pd
-import numpy as np
-from sklearn.manifold import MDS
-import matplotlib.pyplot as plt
-import seaborn as sns
 import re
+import sys
+import numpy as np
+from bindiff_metrics import open_metrics, record_job
+from bindiff_scheduler import run_bindiff
+from bindiversity_config import resolve_path
+from figure_rendering import figure_path, should_show, show_or_render
+from landmark_mds import GroupedDistances, function_score_distances, landmark_mds, pair_result_distances
+from sweep_state import (DONE, FAILED, load_matrix, mark_running, open_sweep_state, plan_missing_jobs,
+                         prune_removed_configurations, record_result)
 
 # Set the base path to the Desktop
 base_path = os.path.join(os.path.expanduser("~"), "Desktop")
@@ -20,15 +23,13 @@ directories = [
     'coreutils-gcc_9/bin'
 ]
 
-# Function to run BinDiff and capture output
-def run_bindiff(primary, secondary, output_dir):
-    output_file = os.path.join(output_dir, f'{os.path.basename(primary)}_vs_{os.path.basename(secondary)}.BinDiff')
-    cmd = f'bindiff --primary {primary} --secondary {secondary} --output_dir {output_dir}'
-    print(f"Running: {cmd}")  # Debug statement
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    if result.returncode != 0:
-        print(f"Error running BinDiff: {result.stderr}")
-    return output_file, result.stdout, result.stderr
+# Directory for BinDiff results (relative to the base path)
+bindiff_results_dir = 'bindiff_results'
+
+# What is embedded: 'folders' (one point per configuration), 'binaries' (one point per
+# (binary, configuration)) or 'functions' (one point per (binary, function, configuration))
+embedding = os.environ.get('MDS_EMBEDDING', 'folders')
+point_names = {'binaries': '(binary, configuration)', 'functions': '(binary, function, configuration)'}
 
 # Function to extract similarity scores from BinDiff log output
 def extract_similarity_score(output_content):
@@ -37,85 +38,109 @@ def extract_similarity_score(output_content):
         return float(match.group(1))
     return None
 
-# Create output directory for BinDiff results
-output_dir = os.path.join(base_path, 'bindiff_results')
-os.makedirs(output_dir, exist_ok=True)
-
-# Identify common .BinExport files
-common_files = None
-for directory in directories:
-    full_dir = os.path.join(base_path, directory)
-    if os.path.isdir(full_dir):
-        binexport_files = {f for f in os.listdir(full_dir) if f.endswith('.BinExport')}
-        if common_files is None:
-            common_files = binexport_files
-        else:
-            common_files &= binexport_files
-
-# Debug: Print common files
-print("Common .BinExport files across all directories:")
-print(common_files)
-
-# Aggregate similarity scores between folders
-folder_pairs = {}
-for i, dir1 in enumerate(directories):
-    for j, dir2 in enumerate(directories):
-        if i < j:
-            folder_pairs[(dir1, dir2)] = []
-
-for file in common_files:
-    binaries = {directory: os.path.join(base_path, directory, file) for directory in directories}
-    for (dir1, dir2), _ in folder_pairs.items():
-        primary = binaries[dir1]
-        secondary = binaries[dir2]
-        output_file, output_content, error_content = run_bindiff(primary, secondary, output_dir)
+# Function to get the folder name used in result file names (coreutils-7/bin -> coreutils-7)
+def folder_name(directory):
+    parts = [part for part in directory.split('/') if part]
+    return parts[-2] if len(parts) > 1 and parts[-1] == 'bin' else parts[-1]
+
+# Function to identify the .BinExport files present in every directory
+def find_common_files(base_path, directories):
+    common_files = None
+    for directory in directories:
+        full_dir = resolve_path(directory, base_path)
+        if os.path.isdir(full_dir):
+            binexport_files = {f for f in os.listdir(full_dir) if f.endswith('.BinExport')}
+            if common_files is None:
+                common_files = binexport_files
+            else:
+                common_files &= binexport_files
+
+    # Debug: Print common files
+    print("Common .BinExport files across all directories:")
+    print(common_files)
+    return common_files or set()
+
+# Function to diff every folder pair of every common binary, reusing stored results
+def build_similarity_matrix(base_path, directories, output_dir):
+    common_files = find_common_files(base_path, directories)
+
+    # Aggregate similarity scores between folders (running mean per folder pair)
+    folder_pairs = []
+    for i, dir1 in enumerate(directories):
+        for j, dir2 in enumerate(directories):
+            if i < j:
+                folder_pairs.append((dir1, dir2))
+
+    jobs = []
+    for file in sorted(common_files):
+        binaries = {directory: os.path.join(resolve_path(directory, base_path), file) for directory in directories}
+        for dir1, dir2 in folder_pairs:
+            # bindiff names every folder pair of a binary <binary>_vs_<binary>.BinDiff, so each
+            # pair gets its own <folder1>_<binary>_vs_<folder2>_<binary>.BinDiff in the flat output_dir
+            stem = file[:-len('.BinExport')]
+            output_file = os.path.join(output_dir, f"{folder_name(dir1)}_{stem}_vs_{folder_name(dir2)}_{stem}.BinDiff")
+            jobs.append({'primary': binaries[dir1], 'secondary': binaries[dir2],
+                         'primary_label': dir1, 'secondary_label': dir2, 'output_dir': output_dir,
+                         'output_file': output_file})
+
+    # Only diff folder pairs without a stored result for the current inputs (the job journal
+    # in mds_sweep_state.db lets an interrupted run resume with the unfinished pairs)
+    state = open_sweep_state(os.path.join(base_path, 'mds_sweep_state.db'))
+    prune_removed_configurations(state, directories)
+    jobs, done_jobs = plan_missing_jobs(state, jobs)
+    matrix = load_matrix(state, done_jobs, directories)
+    print(f"Reusing {len(done_jobs)} stored results, diffing {len(jobs)} pairs")
+
+    # Timing, peak RSS and sizes of every diffed pair go to bindiff_metrics.db (BINDIFF_METRICS=0 disables)
+    metrics = open_metrics(os.path.join(base_path, 'bindiff_metrics.db'))
+    for job in jobs:
+        primary = job['primary']
+        secondary = job['secondary']
+        mark_running(state, [job])
+        result = run_bindiff(job)
+        record_job(metrics, 'bindiff', job, result)
+        output_file = result['output_file']
         print(f"BinDiff output for {primary} vs {secondary}:")
-        print(output_content)
-        if error_content:
+        print(result['stdout'])
+        if result['stderr']:
             print(f"BinDiff error for {primary} vs {secondary}:")
-            print(error_content)
-        score = extract_similarity_score(output_content)
+            print(result['stderr'])
+        # Read the score from the .BinDiff database of this run, fall back to its stdout log
+        score = result['similarity']
+        if score is None and result['returncode'] == 0:
+            score = extract_similarity_score(result['stdout'])
         if score is not None:
-            folder_pairs[(dir1, dir2)].append(score)
-
-# Calculate average similarity scores for each folder pair
-average_similarity_scores = {pair: np.mean(scores) for pair, scores in folder_pairs.items() if scores}
-
-# Debug: Print average similarity scores
-print("Average similarity scores between folder pairs:")
-for pair, score in average_similarity_scores.items():
-    print(f"{pair}: {score}")
-
-# Create a list of folder names
-folder_names = [directory for directory in directories]
-
-# Initialize an empty similarity matrix
-n = len(folder_names)
-similarity_matrix = np.zeros((n, n))
-
-# Fill the similarity matrix with average scores
-for (dir1, dir2), score in average_similarity_scores.items():
-    i = directories.index(dir1)
-    j = directories.index(dir2)
-    similarity_matrix[i, j] = score
-    similarity_matrix[j, i] = score
-
-# Debug: Print the similarity matrix
-print("Similarity matrix:")
-print(similarity_matrix)
-
-# Transform similarity matrix to distance matrix
-distance_matrix = 1 - (similarity_matrix / 100.0)
+            matrix.add(job['primary_label'], job['secondary_label'], score)
+        # Only a successful run of this job finishes it; anything else stays failed and is retried
+        record_result(state, job, score, output_file,
+                      DONE if result['returncode'] == 0 and score is not None else FAILED)
+    if metrics is not None:
+        metrics.close()
+
+    # Debug: Print average similarity scores
+    print("Average similarity scores between folder pairs:")
+    mean_matrix = matrix.mean_matrix(directories)
+    for dir1, dir2 in folder_pairs:
+        score = mean_matrix[directories.index(dir1), directories.index(dir2)]
+        if not np.isnan(score):
+            print(f"{(dir1, dir2)}: {score}")
+
+    # Similarity matrix with the average scores on both sides of the diagonal
+    similarity_matrix = np.nan_to_num(mean_matrix)
+    similarity_matrix = np.maximum(similarity_matrix, similarity_matrix.T)
+
+    # Debug: Print the similarity matrix
+    print("Similarity matrix:")
+    print(similarity_matrix)
+    return matrix
+
+# Function to embed the folder distances in 2D and draw them (saved if output_file is given)
+def render_mds(distance_matrix, folder_names, output_file=None):
+    from sklearn.manifold import MDS
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
-# Ensure diagonal is zero
-np.fill_diagonal(distance_matrix, 0)
-
-# Debug: Print the distance matrix
-print("Distance matrix:")
-print(distance_matrix)
-
-# Perform MDS
-if len(distance_matrix) > 0 and np.any(distance_matrix):
     mds = MDS(n_components=2, dissimilarity="precomputed", random_state=42)
     mds_coords = mds.fit_transform(distance_matrix)
 
@@ -137,6 +162,93 @@ if len(distance_matrix) > 0 and np.any(distance_matrix):
     # Adjust legend to show on the right side
     plt.grid(True)
     plt.tight_layout()
-    plt.show()
-else:
-    print("Distance matrix is empty or invalid, MDS cannot be performed.")
\ No newline at end of file
+    if output_file:
+        plt.savefig(output_file)
+
+# Function to draw a landmark MDS embedding of many points, colored by configuration
+def render_point_embedding(coords, configs, title, output_file=None):
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(14, 10))
+    for config in sorted(set(configs)):
+        mask = np.array([c == config for c in configs])
+        plt.scatter(coords[mask, 0], coords[mask, 1], s=6, alpha=0.6, label=config)
+    plt.title(title, fontsize=15)
+    plt.xlabel('MDS Dimension 1', fontsize=12)
+    plt.ylabel('MDS Dimension 2', fontsize=12)
+    plt.legend(markerscale=3, fontsize=9, loc='center left', bbox_to_anchor=(1, 0.5))
+    plt.grid(True)
+    plt.tight_layout()
+    if output_file:
+        plt.savefig(output_file)
+
+# Function to embed (binary or function, configuration) points with landmark MDS
+# Distances only exist between the configurations of the same binary/function, so every point is
+# placed from its distances to the configurations (their mean distances over all binaries/functions)
+def embed_points(group_distances):
+    distances = GroupedDistances(group_distances)
+    print(f"Embedding {len(distances)} points with {len(distances.configs)} configurations as landmarks")
+    return landmark_mds(distances), distances.points
+
+# Function to describe the MDS figure as a (render function, arguments) job
+def mds_figure(distance_matrix, folder_names, output_file=None):
+    return render_mds, {'distance_matrix': distance_matrix, 'folder_names': list(folder_names),
+                        'output_file': output_file}
+
+# Function to plot the MDS embedding, shown interactively or written to a file when headless
+def plot_mds(distance_matrix, folder_names, show=True, output_file=None):
+    show_or_render([mds_figure(distance_matrix, folder_names, output_file)], show)
+
+# Main function: build the folder distance matrix and plot its MDS embedding
+# config keys: base_path, directories, results_dir, show, figure_dir, embedding, function_db
+def main(config=None):
+    config = config or {}
+    base = os.path.expanduser(config.get('base_path', base_path))
+    dirs = list(config.get('directories', directories))
+    mode = config.get('embedding', embedding)
+
+    # Create output directory for BinDiff results
+    output_dir = resolve_path(config.get('results_dir', bindiff_results_dir), base)
+    os.makedirs(output_dir, exist_ok=True)
+
+    matrix = build_similarity_matrix(base, dirs, output_dir)
+    show = should_show(config)
+
+    if mode in ('binaries', 'functions'):
+        if mode == 'binaries':
+            state = open_sweep_state(os.path.join(base, 'mds_sweep_state.db'))
+            group_distances = pair_result_distances(state, dirs)
+            state.close()
+        else:
+            import sqlite3
+            from function_score_store import ingest_function_scores
+            store = sqlite3.connect(resolve_path(config.get('function_db', 'function_scores.db'), output_dir))
+            ingest_function_scores(store, output_dir)
+            group_distances = function_score_distances(store)
+            store.close()
+        if not group_distances:
+            print(f"No {point_names[mode]} distances found, MDS cannot be performed.")
+            return 1
+        coords, points = embed_points(group_distances)
+        show_or_render([(render_point_embedding, {
+            'coords': coords, 'configs': [config_label for _, config_label in points],
+            'title': f'Landmark MDS of {len(points)} {point_names[mode]} points based on BinDiff similarities',
+            'output_file': None if show else figure_path(config, f'mds_{mode}.png')})], show)
+        return 0
+
+    # Transform similarity matrix to distance matrix (diagonal is zero)
+    distance_matrix = matrix.distance_matrix(dirs)
+
+    # Debug: Print the distance matrix
+    print("Distance matrix:")
+    print(distance_matrix)
+
+    # Perform MDS
+    if len(distance_matrix) > 0 and np.any(distance_matrix):
+        plot_mds(distance_matrix, dirs, show=show, output_file=None if show else figure_path(config, 'mds.png'))
+        return 0
+    print("Distance matrix is empty or invalid, MDS cannot be performed.")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,18 @@
 import os
-import pandas as pd
-import subprocess
 import re
-import matplotlib.pyplot as plt
-import seaborn as sns
+import sys
+import itertools
+from bindiff_scheduler import default_max_workers, make_job
+from bindiff_async_runner import run_bindiff_jobs_async, summarize_failures
+from bindiff_batch import run_bindiff_batches
+from binary_fingerprint import prefilter_enabled, prefilter_jobs, prefilter_report
+from bindiff_metrics import open_metrics, record_job, slowest_report, stage
+from bindiversity_config import resolve_directories, resolve_path
+from figure_rendering import should_show, show_or_render
+from similarity_matrix import SimilarityMatrix
+from sweep_sharding import parse_shard, shard_jobs, shard_suffix, sweep_shard
+from sweep_state import (load_matrix, mark_running, open_sweep_state, plan_missing_jobs,
+                         prune_removed_configurations, record_result)
 
 # Set the base path to the Desktop
 base_path = os.path.join(os.path.expanduser("~"), "Desktop")
@@ -18,25 +27,23 @@ directories = [
     'coreutils-gcc_9/bin'
 ]
 
-# Update directories to include the full paths
-directories = [os.path.join(base_path, directory) for directory in directories]
-
-# Directory for BinDiff results
-bindiff_results_dir = os.path.join(base_path, 'bindiff_results')
-os.makedirs(bindiff_results_dir, exist_ok=True)
-
-# Function to run BinDiff and capture output
-def run_bindiff(primary, secondary, output_dir):
-    output_file = os.path.join(output_dir, f'{os.path.basename(primary)}_vs_{os.path.basename(secondary)}.BinDiff')
-    log_file = os.path.join(output_dir, f'{os.path.basename(primary)}_vs_{os.path.basename(secondary)}.log')
-    cmd = f'bindiff --primary {primary} --secondary {secondary} --output_dir {output_dir}'
-    print(f"Running: {cmd}")
-    result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-    with open(log_file, 'w') as lf:
-        lf.write(result.stdout)
-    if result.returncode != 0:
-        print(f"Error running BinDiff: {result.stderr}")
-    return output_file, log_file, result.stdout, result.stderr
+# Directory for BinDiff results (relative to the base path)
+bindiff_results_dir = 'bindiff_results'
+
+# Number of BinDiff processes to run in parallel (defaults to the number of cores)
+max_workers = default_max_workers
+
+# 'pair' runs one bindiff process per binary pair, 'batch' runs one bindiff
+# batch per binary that diffs all of its configurations in a single process
+execution_mode = os.environ.get('BINDIFF_MODE', 'pair')
+
+# Similarities are read from the .BinDiff databases; stdout logs are only kept for inspection
+capture_logs = os.environ.get('BINDIFF_CAPTURE_LOGS', '1') != '0'
+
+# Keep per-(config pair, binary) results and a job journal in sweep_state.db and only diff
+# what is missing, so an interrupted sweep resumes where it stopped
+incremental = os.environ.get('BINDIFF_INCREMENTAL', '1') != '0'
+
 
 # Function to extract similarity score from the log file
 def extract_similarity_score_from_log(log_file):
@@ -49,109 +56,209 @@ def extract_similarity_score_from_log(log_file):
                 break
     return similarity
 
-# Identify common .BinExport files
-common_files = None
-all_files = {}
 
-for directory in directories:
-    if os.path.isdir(directory):
-        binexport_files = {f for f in os.listdir(directory) if f.endswith('.BinExport')}
-        all_files[directory] = binexport_files
-        if common_files is None:
-            common_files = binexport_files
-        else:
-            common_files &= binexport_files
+# Function to identify the .BinExport files present in every directory
+def find_common_files(directories):
+    common_files = None
+    all_files = {}
+
+    for directory in directories:
+        if os.path.isdir(directory):
+            binexport_files = {f for f in os.listdir(directory) if f.endswith('.BinExport')}
+            all_files[directory] = binexport_files
+            if common_files is None:
+                common_files = binexport_files
+            else:
+                common_files &= binexport_files
 
-# Debug: Print files in each directory
-for dir_path, files in all_files.items():
-    print(f"Files in {dir_path}: {files}")
+    # Debug: Print files in each directory
+    for dir_path, files in all_files.items():
+        print(f"Files in {dir_path}: {files}")
 
-# Debug: Print common files
-print("Common .BinExport files across all directories:")
-print(common_files)
+    # Debug: Print common files
+    print("Common .BinExport files across all directories:")
+    print(common_files)
+    return common_files
 
-# Check if common_files is None
-if not common_files:
-    print("No common .BinExport files found across all directories.")
-    exit(1)
 
 # Function to get label from directory path
 def get_label_from_directory(directory):
     return os.path.basename(os.path.dirname(directory))
 
-# Aggregate similarity scores
-data = []
-labels = [get_label_from_directory(dir_path) for dir_path in directories]
-
-for file in common_files:
-    binaries = {directory: os.path.join(directory, file) for directory in directories}
-    for i in range(len(directories)):
-        for j in range(i + 1, len(directories)):
-            primary = binaries[directories[i]]
-            secondary = binaries[directories[j]]
-            output_file, log_file, output_content, error_content = run_bindiff(primary, secondary, bindiff_results_dir)
+
+# Function to plan one BinDiff job per common binary and configuration pair
+def plan_jobs(common_files, directories, labels, results_dir, capture_logs=True):
+    jobs = []
+    for file in sorted(common_files):
+        binaries = {directory: os.path.join(directory, file) for directory in directories}
+        for i in range(len(directories)):
+            for j in range(i + 1, len(directories)):
+                primary = binaries[directories[i]]
+                secondary = binaries[directories[j]]
+                jobs.append(make_job(primary, secondary, results_dir, labels[i], labels[j], capture_log=capture_logs))
+    return jobs
+
+
+# Function to run the planned jobs and fold every similarity into the matrix as it arrives
+# prefiltered holds (job, result) pairs already decided by the fingerprint pre-filter
+def run_sweep(jobs, matrix, base_path, mode='pair', workers=None, state=None, metrics=None, prefiltered=(),
+              batch_dir='bindiff_batches'):
+    print(f"Scheduling {len(jobs)} BinDiff jobs on {workers} workers ({mode} mode)")
+
+    # Jobs are journaled as running when the runner actually starts them, so after a crash only
+    # those count as interrupted; the ones that never started are still pending
+    on_start = None
+    if state is not None:
+        def on_start(job):
+            mark_running(state, [job])
+
+    if mode == 'batch':
+        job_results = run_bindiff_batches(jobs, os.path.join(base_path, batch_dir), max_workers=workers,
+                                          on_start=on_start)
+    else:
+        # Per-job timeout, retries with backoff and memory cap come from BINDIFF_TIMEOUT,
+        # BINDIFF_RETRIES, BINDIFF_BACKOFF and BINDIFF_MEMORY_LIMIT_MB
+        job_results = run_bindiff_jobs_async(jobs, max_workers=workers, on_start=on_start)
+    job_results = itertools.chain(prefiltered, job_results)
+
+    finished_jobs = []
+    # Wall time of the whole sweep, from the first job started to the last result collected
+    with stage(metrics, 'sweep'):
+        for job, result in job_results:
+            finished_jobs.append((job, result))
+            record_job(metrics, 'bindiff', job, result)
+            primary = job['primary']
+            secondary = job['secondary']
             print(f"BinDiff output for {primary} vs {secondary}:")
-            print(output_content)
-            if error_content:
+            print(result['stdout'])
+            if result['stderr']:
                 print(f"BinDiff error for {primary} vs {secondary}:")
-                print(error_content)
-            # Extract similarity score from the log file
-            similarity = extract_similarity_score_from_log(log_file)
+                print(result['stderr'])
+            # Similarity score from the .BinDiff database, the log file is only a fallback
+            similarity = result.get('similarity')
+            if similarity is None and result['log_file'] and os.path.exists(result['log_file']):
+                similarity = extract_similarity_score_from_log(result['log_file'])
             if similarity is not None:
-                data.append({
-                    'primary': labels[i],
-                    'secondary': labels[j],
-                    'similarity': similarity
-                })
+                matrix.add(job['primary_label'], job['secondary_label'], similarity)
             else:
                 print(f"No similarity score found for {primary} vs {secondary}")
+            if state is not None:
+                record_result(state, job, similarity, result['output_file'])
+    return finished_jobs
+
+
+# Function to draw the heatmap of the mean similarity scores with stddev and save it
+def render_heatmap(mean_matrix, combined_table, labels, output_file):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.figure(figsize=(12, 10))
+    sns.heatmap(mean_matrix, annot=combined_table, fmt='', cmap="YlGnBu", xticklabels=labels, yticklabels=labels,
+                cbar_kws={'label': 'Mean Similarity (%)'})
+    plt.title('Mean Similarity Scores ± Standard Deviation between Different Binaries')
+    plt.xlabel('Secondary Binary')
+    plt.ylabel('Primary Binary')
+    plt.xticks(rotation=45, ha='right')
+    plt.yticks(rotation=0)
+    plt.tight_layout()
+
+    # Save the plot
+    plt.savefig(output_file)
+
+
+# Function to describe the heatmap figure as a (render function, arguments) job
+def heatmap_figure(matrix, labels, output_file):
+    # Mean ± stddev for each pair, with the matrix headers in the same order on both sides
+    return render_heatmap, {'mean_matrix': matrix.mean_matrix(labels), 'combined_table': matrix.combined_table(labels),
+                            'labels': list(labels), 'output_file': output_file}
+
+
+# Function to plot the heatmap, shown interactively or only written to its file when headless
+def plot_heatmap(matrix, labels, output_file, show=True):
+    show_or_render([heatmap_figure(matrix, labels, output_file)], show)
+
+
+# Main function: diff every configuration pair of every common binary and plot the matrix
+# With a shard ('i/N') only that part of the pairs is diffed and its state is saved for the merge
+# config keys: base_path, directories, results_dir, workers, mode, capture_logs, incremental, prefilter, shard, show
+def main(config=None):
+    config = config or {}
+    base = os.path.expanduser(config.get('base_path', base_path))
+    dirs = resolve_directories(config.get('directories', directories), base)
+    results_dir = resolve_path(config.get('results_dir', bindiff_results_dir), base)
+    workers = config.get('workers') or max_workers
+    mode = config.get('mode', execution_mode)
+    try:
+        shard = parse_shard(config.get('shard', sweep_shard))
+    except ValueError as e:
+        print(e)
+        return 1
+    # Every shard keeps its own state files, so hosts sharing the base path never write the same file
+    suffix = shard_suffix(shard)
+    os.makedirs(results_dir, exist_ok=True)
+
+    # Timing, peak RSS and sizes of every job go to bindiff_metrics.db (BINDIFF_METRICS=0 disables)
+    metrics = open_metrics(os.path.join(base, f'bindiff_metrics{suffix}.db'))
+
+    common_files = find_common_files(dirs)
+    if not common_files:
+        print("No common .BinExport files found across all directories.")
+        return 1
 
-# Check if data is collected correctly
-if not data:
-    print("No similarity scores were collected.")
-    exit(1)
+    # Aggregate similarity scores
+    labels = [get_label_from_directory(dir_path) for dir_path in dirs]
+    jobs = plan_jobs(common_files, dirs, labels, results_dir, config.get('capture_logs', capture_logs))
+    # Batch mode diffs all pairs of a binary in one process, so its shards split by binary
+    jobs = shard_jobs(jobs, shard, by_binary=mode == 'batch')
 
-# Convert the aggregated data into a DataFrame
-df = pd.DataFrame(data)
+    if config.get('incremental', incremental):
+        # Only pairs without a stored result for the current inputs are diffed; the matrix
+        # starts from the stored results of the configurations that are still in the sweep
+        state = open_sweep_state(os.path.join(base, f'sweep_state{suffix}.db'))
+        removed = prune_removed_configurations(state, labels)
+        jobs, done_jobs = plan_missing_jobs(state, jobs)
+        matrix = load_matrix(state, done_jobs, labels)
+        print(f"Incremental sweep: {len(done_jobs)} pairs reused, {len(jobs)} to diff, "
+              f"{removed} stale results dropped")
+    else:
+        state = None
+        # Running count/mean/M2 per (primary, secondary) cell, updated as results arrive
+        matrix = SimilarityMatrix(labels)
 
-# Calculate mean ± stddev for each pair
-df_summary = df.groupby(['primary', 'secondary']).agg({'similarity': ['mean', 'std']}).reset_index()
-df_summary.columns = ['primary', 'secondary', 'mean', 'stddev']
+    # With the pre-filter (opt-in) pairs with byte-identical executables or exports get similarity 1.0
+    # without running BinDiff
+    prefiltered = []
+    if config.get('prefilter', prefilter_enabled):
+        jobs, prefiltered, prefilter_stats = prefilter_jobs(jobs)
+        prefilter_report(prefilter_stats)
 
-# Create a pivot table with mean ± stddev
-pivot_table_mean = df_summary.pivot(index='primary', columns='secondary', values='mean')
-pivot_table_stddev = df_summary.pivot(index='primary', columns='secondary', values='stddev')
+    finished_jobs = run_sweep(jobs, matrix, base, mode, workers, state, metrics, prefiltered,
+                              f'bindiff_batches{suffix}')
 
-# Ensure the matrix headers are in the same order on both sides
-pivot_table_mean = pivot_table_mean.reindex(labels, axis=0).reindex(labels, axis=1)
-pivot_table_stddev = pivot_table_stddev.reindex(labels, axis=0).reindex(labels, axis=1)
+    # Report the pairs that failed, timed out or could not be started
+    summarize_failures(finished_jobs)
 
-# Combine mean and stddev into one table for display
-combined_table = pivot_table_mean.round(2).astype(str) + " ± " + pivot_table_stddev.round(2).astype(str)
+    # Report the pairs and binaries that dominated this sweep
+    slowest_report(metrics)
 
-# Replace NaN values with '-'
-combined_table = combined_table.replace("nan ± nan", "- ± -")
+    if shard is not None:
+        # A shard only holds part of the matrix; sweep_sharding merges the shards and render plots the result
+        matrix.save(os.path.join(base, f'similarity_matrix_state{suffix}.npz'))
+        print(f"Shard {shard[0]}/{shard[1]} finished; merge all shards with 'bindiversity.py merge'")
+        return 0
 
-# Fill diagonal with '0.00 ± 0.00'
-for label in labels:
-    if label in combined_table.index and label in combined_table.columns:
-        combined_table.loc[label, label] = '0.00 ± 0.00'
+    # Check if data is collected correctly
+    if not matrix.count.any():
+        print("No similarity scores were collected.")
+        return 1
 
-# Ensure combined_table has the same shape as pivot_table_mean
-combined_table = combined_table.reindex(index=labels, columns=labels)
+    # Keep the accumulator state so runs on other workers or hosts can be merged into it
+    matrix.save(os.path.join(base, 'similarity_matrix_state.npz'))
 
-# Plot the heatmap of the mean similarity scores with stddev
-plt.figure(figsize=(12, 10))
-sns.heatmap(pivot_table_mean, annot=combined_table, fmt='', cmap="YlGnBu", cbar_kws={'label': 'Mean Similarity (%)'})
-plt.title('Mean Similarity Scores ± Standard Deviation between Different Binaries')
-plt.xlabel('Secondary Binary')
-plt.ylabel('Primary Binary')
-plt.xticks(rotation=45, ha='right')
-plt.yticks(rotation=0)
-plt.tight_layout()
+    plot_heatmap(matrix, labels, os.path.join(base, 'similarity_heatmap_mean_stddev.png'),
+                 show=should_show(config))
+    return 0
 
-# Save the plot
-plt.savefig(os.path.join(base_path, 'similarity_heatmap_mean_stddev.png'))
 
-# Display the plot
-plt.show()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,13 @@
-import sqlite3
 import os
-import seaborn as sns
-import matplotlib.pyplot as plt
+import sys
+from bindiversity_config import resolve_path
+from figure_rendering import figure_path, should_show, show_or_render
+from score_histogram import ScoreHistogram, add_bindiff_files
 
 # Directory where the BinDiff results are stored
 bindiff_results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bindiff_results')
 
 
-# Function to extract function scores from a .BinDiff file
-def query_function_scores(sqlite_file):
-    conn = sqlite3.connect(sqlite_file)
-    cursor = conn.cursor()
-
-    # SQL query to get all the similarity scores
-    query = "SELECT similarity FROM main.function"
-    cursor.execute(query)
-    scores = cursor.fetchall()
-    conn.close()
-
-    return [score[0] for score in scores]  # Only return similarity scores
-
-
 # Group .BinDiff files by compiler configuration based on the filename header
 def group_files_by_compiler(directory):
     grouped_files = {}
@@ -36,36 +23,61 @@ def group_files_by_compiler(directory):
 
 
 # Aggregate scores for each compiler configuration
+# Each configuration keeps a fixed-bin histogram filled inside SQLite; raw scores never reach Python
 def aggregate_scores_by_compiler(grouped_files):
     grouped_scores = {}
     for header, files in grouped_files.items():
-        compiler_scores = []
-        for sqlite_file in files:
-            scores = query_function_scores(sqlite_file)
-            compiler_scores.extend(scores)
-        grouped_scores[header] = compiler_scores
+        grouped_scores[header] = add_bindiff_files(ScoreHistogram(), files)
     return grouped_scores
 
 
-# Plot KDE for each compiler configuration
-def plot_kde(grouped_scores):
+# Draw the KDE of each compiler configuration from precomputed (grid, density) curves
+def render_kde(curves, output_file=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     plt.figure(figsize=(12, 8))
     sns.set_palette("tab10")  # Use a 10-color palette for distinction
     sns.set_style("whitegrid")  # Use a grid style for clarity
 
-    for header, scores in grouped_scores.items():
-        sns.kdeplot(scores, label=header, linewidth=2.5)  # Increased linewidth for visibility
+    for header, (grid, density) in curves.items():
+        plt.plot(grid, density, label=header, linewidth=2.5)  # Increased linewidth for visibility
 
     plt.xlabel('BinDiff Similarity Score', fontsize=14)
     plt.ylabel('Density', fontsize=14)
     plt.title('KDE of BinDiff Similarity Scores Across Compiler Configurations', fontsize=16)
     plt.legend(title='Compiler Configurations', bbox_to_anchor=(1.05, 1), loc='upper left', fontsize=12)
     plt.tight_layout()
-    plt.show()
+    if output_file:
+        plt.savefig(output_file)
+
+
+# Describe the KDE figure as a (render function, arguments) job
+def kde_figure(grouped_scores, output_file=None):
+    # Binned FFT KDE computed from each histogram; only the curves go to the render process
+    curves = {header: histogram.kde() for header, histogram in grouped_scores.items()}
+    return render_kde, {'curves': curves, 'output_file': output_file}
+
+
+# Plot KDE for each compiler configuration
+def plot_kde(grouped_scores, show=True, output_file=None):
+    show_or_render([kde_figure(grouped_scores, output_file)], show)
+
+
+# Main function: plot one KDE of the function similarity scores per compiler configuration
+# config keys: base_path, results_dir, show, figure_dir
+def main(config=None):
+    config = config or {}
+    base = os.path.expanduser(config.get('base_path', os.getcwd()))
+    results_dir = resolve_path(config.get('results_dir', bindiff_results_dir), base)
+    grouped_files = group_files_by_compiler(results_dir)  # Group files by compiler configuration
+    grouped_scores = aggregate_scores_by_compiler(grouped_files)  # Aggregate scores for each group
+    show = should_show(config)
+    plot_kde(grouped_scores, show=show,  # Plot KDE for each compiler configuration
+             output_file=None if show else figure_path(config, 'kde_by_configuration.png'))
+    return 0
 
 
 # Main Execution
 if __name__ == "__main__":
-    grouped_files = group_files_by_compiler(bindiff_results_dir)  # Group files by compiler configuration
-    grouped_scores = aggregate_scores_by_compiler(grouped_files)  # Aggregate scores for each group
-    plot_kde(grouped_scores)  # Plot KDE for each compiler configuration
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -1,49 +1,32 @@
-import sqlite3
 import os
-import matplotlib.pyplot as plt
+import sys
 import numpy as np
-import seaborn as sns
+from bindiversity_config import resolve_path
+from figure_rendering import should_show, show_or_render
+from score_histogram import ScoreHistogram, add_bindiff_files
 
 # Directory where the BinDiff results are stored
 bindiff_results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bindiff_results')
 
 
-# Function to extract function scores from a .sqlite file
-def query_function_scores(sqlite_file):
-    conn = sqlite3.connect(sqlite_file)
-    cursor = conn.cursor()
-
-    # SQL query to get all the similarity scores
-    query = "SELECT similarity FROM main.function"
-    cursor.execute(query)
-    scores = cursor.fetchall()
-    conn.close()
-
-    return [score[0] for score in scores]
-
-
 # Aggregate all function similarity scores across all comparisons
+# Scores are bucketed inside SQLite over batches of attached files into a fixed-bin histogram
 def aggregate_all_scores(directory):
-    all_scores = []
-    for file in os.listdir(directory):
-        if file.endswith(".BinDiff"):
-            sqlite_file = os.path.join(directory, file)
-            scores = query_function_scores(sqlite_file)
-            all_scores.extend(scores)
-    return all_scores
+    files = [os.path.join(directory, file) for file in os.listdir(directory) if file.endswith(".BinDiff")]
+    return add_bindiff_files(ScoreHistogram(), files)
 
 
-# Plot the normal distribution of the similarity scores
-def plot_distribution(all_scores):
-    if not all_scores:
-        print("No data to plot!")
-        return
+# Draw the histogram with KDE from precomputed bar counts and curve, and save it
+def render_distribution(counts, edges, grid, density, n, output_file):
+    import matplotlib.pyplot as plt
 
     # Creating a professional plot
     plt.figure(figsize=(14, 8))
 
-    # Plotting the histogram with KDE
-    sns.histplot(all_scores, kde=True, color='darkblue', bins=30, line_kws={'linewidth': 2.5})
+    # Plotting the histogram with KDE (binned FFT KDE scaled to the bar counts)
+    color = 'darkblue'
+    plt.bar(edges[:-1], counts, width=np.diff(edges), align='edge', color=color, alpha=0.5, edgecolor='white')
+    plt.plot(grid, density * n * (edges[-1] - edges[0]) / len(counts), color=color, linewidth=2.5)
 
     # Labels and Title
     plt.xlabel('BinDiff Similarity Score', fontsize=18)
@@ -55,11 +38,36 @@ def plot_distribution(all_scores):
     plt.yticks(fontsize=14)
 
     # Saving the plot as a high-resolution PNG
-    plt.savefig('BinDiff_Similarity_Distribution.png', dpi=300, bbox_inches='tight')
-    plt.show()
+    plt.savefig(output_file, dpi=300, bbox_inches='tight')
+
+
+# Describe the distribution figure as a (render function, arguments) job
+def distribution_figure(histogram, output_file='BinDiff_Similarity_Distribution.png'):
+    counts, edges = histogram.rebin(30)
+    grid, density = histogram.kde()
+    return render_distribution, {'counts': counts, 'edges': edges, 'grid': grid, 'density': density,
+                                 'n': histogram.n, 'output_file': output_file}
+
+
+# Plot the normal distribution of the similarity scores
+def plot_distribution(histogram, output_file='BinDiff_Similarity_Distribution.png', show=True):
+    if not histogram.n:
+        print("No data to plot!")
+        return
+    show_or_render([distribution_figure(histogram, output_file)], show)
+
+
+# Main function: plot the distribution of all function similarity scores
+# config keys: base_path, results_dir, output, show
+def main(config=None):
+    config = config or {}
+    base = os.path.expanduser(config.get('base_path', os.getcwd()))
+    histogram = aggregate_all_scores(resolve_path(config.get('results_dir', bindiff_results_dir), base))
+    plot_distribution(histogram, resolve_path(config.get('output', 'BinDiff_Similarity_Distribution.png'), base),
+                      show=should_show(config))
+    return 0
 
 
 # Main Execution
 if __name__ == "__main__":
-    all_scores = aggregate_all_scores(bindiff_results_dir)
-    plot_distribution(all_scores)
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -1,7 +1,13 @@
 import os
-import subprocess
-import shutil
+import sys
 from itertools import combinations
+from bindiff_metrics import open_metrics, record_job
+from bindiff_results import export_stem
+from bindiff_scheduler import run_bindiff
+from binexport_staging import stage_binexport_files
+from bindiversity_config import resolve_directories, resolve_path
+from sweep_sharding import parse_shard, shard_jobs, shard_suffix, sweep_shard
+from sweep_state import DONE, FAILED, mark_running, open_sweep_state, plan_missing_jobs, record_result
 
 # Set the base path to the PyCharm project directory
 base_path = os.path.dirname(os.path.abspath(__file__))
@@ -16,77 +22,124 @@ directories = [
     'gcc-9/bin'
 ]
 
-# Update directories to include the full paths on the Desktop
-directories = [os.path.join(os.path.expanduser("~"), "Desktop", directory) for directory in directories]
+# The compiled results are looked up on the Desktop
+input_base_path = os.path.join(os.path.expanduser("~"), "Desktop")
 
 # Directory for renamed BinExport files
 renamed_binexport_dir = os.path.join(base_path, 'renamed_binexports')
-os.makedirs(renamed_binexport_dir, exist_ok=True)
 
 # Directory for BinDiff results and logs
 bindiff_results_dir = os.path.join(base_path, 'bindiff_results')
-logs_dir = os.path.join(bindiff_results_dir, 'logs')
-os.makedirs(logs_dir, exist_ok=True)
+
+# Journal every pair in <results_dir>/sweep_state.db and skip finished pairs, so an
+# interrupted sweep resumes where it stopped
+incremental = os.environ.get('BINDIFF_INCREMENTAL', '1') != '0'
 
 # Function to rename .BinExport files with directory prefixes
+# Files are staged as hard links/symlinks (copy only across filesystems); unchanged
+# files are skipped and byte-identical exports are deduplicated via the staging manifest
 def rename_binexport_files(directories, output_dir):
-    renamed_files = {}
-    for directory in directories:
-        dir_name = os.path.basename(os.path.dirname(directory))
-        for file in os.listdir(directory):
-            if file.endswith('.BinExport'):
-                original_file_path = os.path.join(directory, file)
-                new_file_name = f"{dir_name}_{file}"
-                new_file_path = os.path.join(output_dir, new_file_name)
-                shutil.copy2(original_file_path, new_file_path)
-                renamed_files[new_file_name] = new_file_path
-    return renamed_files
-
-# Rename all .BinExport files and save the new paths
-renamed_files = rename_binexport_files(directories, renamed_binexport_dir)
-
-# Group files by their base names (without the directory prefix)
-grouped_files = {}
-for renamed_name, path in renamed_files.items():
-    base_name = renamed_name.split("_", 1)[1]  # Base name after the first underscore
-    if base_name not in grouped_files:
-        grouped_files[base_name] = []
-    grouped_files[base_name].append(path)
-
-# Debug: Print grouped files
-print("Grouped files:")
-for base_name, files in grouped_files.items():
-    print(f"{base_name}:")
-    for file in files:
-        print(f"  - {file}")
-
-# Run BinDiff on all possible pairs of files within the same group
-for base_name, files in grouped_files.items():
-    if len(files) > 1:  # Ensure at least two files are present
-        for primary, secondary in combinations(files, 2):
-            # Extracting directory names from file paths for the output and log files
-            primary_dir_name = os.path.basename(os.path.dirname(primary)).replace('.BinExport', '')
-            secondary_dir_name = os.path.basename(os.path.dirname(secondary)).replace('.BinExport', '')
-
-            # Define output and log file names with proper directory headers
-            output_file = os.path.join(bindiff_results_dir,
-                                       f"{primary_dir_name}_{base_name}_vs_{secondary_dir_name}_{base_name}.BinDiff")
-            log_file = os.path.join(logs_dir,
-                                    f"{primary_dir_name}_{base_name}_vs_{secondary_dir_name}_{base_name}.log")
-
-            # Run BinDiff with the correctly named output directory
-            cmd = f'bindiff --primary {primary} --secondary {secondary} --output_dir {bindiff_results_dir}'
-            print(f"Running: {cmd}")
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-
-            # Save the log file
-            with open(log_file, 'w') as lf:
-                lf.write(result.stdout)
-            if result.returncode != 0:
-                print(f"Error running BinDiff: {result.stderr}")
-            else:
-                print(f"Processed BinDiff results for {primary} vs {secondary}, saved to {output_file}.")
-    else:
-        print(f"Skipping {base_name}: not enough files to compare.")
-
-print("All pairwise BinDiff operations completed.")
\ No newline at end of file
+    return stage_binexport_files(directories, output_dir)
+
+# Function to group the renamed files by their base names (without the directory prefix)
+def group_renamed_files(renamed_files):
+    grouped_files = {}
+    for renamed_name, path in renamed_files.items():
+        base_name = renamed_name.split("_", 1)[1]  # Base name after the first underscore
+        if base_name not in grouped_files:
+            grouped_files[base_name] = []
+        grouped_files[base_name].append(path)
+
+    # Debug: Print grouped files
+    print("Grouped files:")
+    for base_name, files in grouped_files.items():
+        print(f"{base_name}:")
+        for file in files:
+            print(f"  - {file}")
+    return grouped_files
+
+# Function to plan one job per pair of files within the same group, with its output and log file
+def plan_pairwise_jobs(grouped_files, bindiff_results_dir, logs_dir):
+    jobs = []
+    for base_name, files in grouped_files.items():
+        if len(files) > 1:  # Ensure at least two files are present
+            for primary, secondary in combinations(files, 2):
+                # The staged names are <configuration>_<base_name>
+                primary_label = os.path.basename(primary)[:-len(base_name) - 1]
+                secondary_label = os.path.basename(secondary)[:-len(base_name) - 1]
+
+                # Output and log files are named after the configurations: <config1>_<binary>_vs_<config2>_<binary>
+                stem = export_stem(base_name)
+                name = f"{primary_label}_{stem}_vs_{secondary_label}_{stem}"
+                jobs.append({'primary': primary, 'secondary': secondary,
+                             'primary_label': primary_label, 'secondary_label': secondary_label,
+                             'binary': base_name, 'output_dir': bindiff_results_dir,
+                             'output_file': os.path.join(bindiff_results_dir, f"{name}.BinDiff"),
+                             'log_file': os.path.join(logs_dir, f"{name}.log")})
+        else:
+            print(f"Skipping {base_name}: not enough files to compare.")
+    return jobs
+
+# Function to run BinDiff on all possible pairs of files within the same group, saving a log per pair
+# With a sweep state only the pairs not finished by an earlier (possibly interrupted) run are diffed,
+# with a shard ('i/N' as parsed by parse_shard) only the pairs of that shard; with a metrics
+# connection the timing and peak RSS of every pair is recorded
+def run_pairwise_bindiff(grouped_files, bindiff_results_dir, logs_dir, state=None, shard=None, metrics=None):
+    jobs = shard_jobs(plan_pairwise_jobs(grouped_files, bindiff_results_dir, logs_dir), shard)
+    if state is not None:
+        jobs, done_jobs = plan_missing_jobs(state, jobs)
+        print(f"Resuming sweep: {len(done_jobs)} pairs already finished, {len(jobs)} to diff")
+
+    for job in jobs:
+        if state is not None:
+            mark_running(state, [job])
+        # Pairs already diffed by any script are served from the BinDiff cache; the log file is saved either way.
+        # BinDiff names the result after the staged files, which run_bindiff renames to the job's output file
+        result = run_bindiff(job)
+        record_job(metrics, 'bindiff', job, result)
+        if result['returncode'] == 0:
+            print(f"Processed BinDiff results for {job['primary']} vs {job['secondary']}, "
+                  f"saved to {result['output_file']}.")
+        if state is not None:
+            record_result(state, job, result['similarity'], result['output_file'],
+                          DONE if result['returncode'] == 0 else FAILED)
+
+# Main function: stage the exports of every configuration and diff all pairs of each binary
+# config keys: base_path (where the directories are), directories, results_dir, staging_dir, incremental, shard
+def main(config=None):
+    config = config or {}
+    try:
+        shard = parse_shard(config.get('shard', sweep_shard))
+    except ValueError as e:
+        print(e)
+        return 1
+    base = os.path.expanduser(config.get('base_path', input_base_path))
+    dirs = resolve_directories(config.get('directories', directories), base)
+    staging_dir = resolve_path(config.get('staging_dir', renamed_binexport_dir), base)
+    results_dir = resolve_path(config.get('results_dir', bindiff_results_dir), base)
+    logs_dir = os.path.join(results_dir, 'logs')
+    os.makedirs(staging_dir, exist_ok=True)
+    os.makedirs(logs_dir, exist_ok=True)
+
+    # Rename all .BinExport files and save the new paths
+    renamed_files = rename_binexport_files(dirs, staging_dir)
+    grouped_files = group_renamed_files(renamed_files)
+    state = None
+    if config.get('incremental', incremental):
+        # One state file per shard, so hosts sharing the results directory never write the same file
+        state = open_sweep_state(os.path.join(results_dir, f'sweep_state{shard_suffix(shard)}.db'))
+    # Timing, peak RSS and sizes of every pair (BINDIFF_METRICS=0 disables), one file per shard like the state
+    metrics = open_metrics(os.path.join(results_dir, f'bindiff_metrics{shard_suffix(shard)}.db'))
+    try:
+        run_pairwise_bindiff(grouped_files, results_dir, logs_dir, state, shard, metrics)
+    finally:
+        if state is not None:
+            state.close()
+        if metrics is not None:
+            metrics.close()
+
+    print("All pairwise BinDiff operations completed.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
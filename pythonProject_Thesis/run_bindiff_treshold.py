@@ -1,104 +1,120 @@
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+import sys
 import sqlite3
+from bindiversity_config import resolve_path
+from figure_rendering import figure_path, max_bars, should_show, show_or_render, top_k_with_others
+from score_arrays import function_std_counts, open_score_arrays
+from similarity_ingest import ingest_bindiff_results
 
 # Set the base path to the current working directory
 base_path = os.path.abspath(os.getcwd())
 
-# Directory for BinDiff results
-bindiff_results_dir = os.path.join(base_path, 'bindiff_results')
-
-# SQLite database setup
-db_path = os.path.join(base_path, 'similarity_scores.db')
-conn = sqlite3.connect(db_path)
-c = conn.cursor()
-
-# Function to check if a column exists in a table
-def column_exists(cursor, table_name, column_name):
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = [info[1] for info in cursor.fetchall()]
-    return column_name in columns
-
-# Ensure the similarity_scores table has the correct schema
-c.execute('''CREATE TABLE IF NOT EXISTS similarity_scores
-             (filename TEXT, function_name TEXT, similarity REAL)''')
-conn.commit()
-
-# Add the 'filename' column if it doesn't exist
-if not column_exists(c, 'similarity_scores', 'filename'):
-    c.execute('ALTER TABLE similarity_scores ADD COLUMN filename TEXT')
-    conn.commit()
-
-# Function to read BinDiff SQLite result files and extract similarity scores
-def extract_similarity_scores_from_sqlite(result_file):
-    scores = []
-    try:
-        with sqlite3.connect(result_file) as db_conn:
-            query = "SELECT name1, similarity FROM function"
-            df = pd.read_sql_query(query, db_conn)
-            for index, row in df.iterrows():
-                scores.append((row['name1'], row['similarity']))
-    except sqlite3.Error as e:
-        print(f"SQLite error: {e}")
-    return scores
-
-# Process each result file in the bindiff_results directory
-for result_file in os.listdir(bindiff_results_dir):
-    if '.BinExport' not in result_file:
-        result_path = os.path.join(bindiff_results_dir, result_file)
-        scores = extract_similarity_scores_from_sqlite(result_path)
-        if scores:
-            for score in scores:
-                # Insert into the SQLite database
-                c.execute('INSERT INTO similarity_scores (filename, function_name, similarity) VALUES (?, ?, ?)',
-                          (result_file, score[0], score[1]))
-            conn.commit()
-        else:
-            print(f"No function similarity scores found in: {result_file}")
-
-# Query the database to retrieve the similarity scores
-query = "SELECT function_name, similarity FROM similarity_scores"
-df_db = pd.read_sql_query(query, conn)
-
-# Print the DataFrame with the similarity scores from the database
-print(df_db)
-
-# Close the database connection
-conn.close()
-
-# Calculate standard deviation of similarity scores for each function
-df_std = df_db.groupby('function_name').agg({'similarity': ['std', 'count']}).reset_index()
-df_std.columns = ['function_name', 'std_dev', 'count']
+# Directory for BinDiff results and the SQLite database (relative to the base path)
+bindiff_results_dir = 'bindiff_results'
+db_path = 'similarity_scores.db'
+
+# Dictionary-encoded copy of the scores (int32 ids, float32 scores, memory-mapped), rebuilt
+# whenever the database changes
+arrays_dir = 'similarity_scores_arrays'
 
 # Set a minimum number of data points required to include a function
 min_data_points = 3
 
-# Filter out functions with fewer data points than the threshold
-df_std_filtered = df_std[df_std['count'] >= min_data_points]
-
-# Print distribution of standard deviations
-print(df_std_filtered.describe())
-
-# Plot distribution of standard deviations
-plt.figure(figsize=(10, 6))
-sns.histplot(df_std_filtered['std_dev'], bins=50, kde=True)
-plt.title('Distribution of Standard Deviations of Function Similarity Scores')
-plt.xlabel('Standard Deviation')
-plt.ylabel('Frequency')
-plt.show()
-
 # Adjust the threshold for filtering
 threshold = 0.005  # Adjust this value based on the distribution
-df_std_filtered = df_std_filtered[df_std_filtered['std_dev'] > threshold]
-
-# Plotting the standard deviation of similarity scores
-plt.figure(figsize=(12, 8))
-sns.barplot(x='std_dev', y='function_name', data=df_std_filtered, palette='viridis')
-plt.title('Standard Deviation of Function Similarity Scores')
-plt.xlabel('Standard Deviation')
-plt.ylabel('Function Name')
-plt.xticks(rotation=90)
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+
+
+# Function to ingest the .BinDiff results and open the compact score arrays of the database
+def load_score_arrays(db_path, bindiff_results_dir, arrays_dir):
+    conn = sqlite3.connect(db_path)
+    try:
+        ingest_bindiff_results(conn, bindiff_results_dir)
+        arrays = open_score_arrays(conn, arrays_dir)
+    finally:
+        conn.close()
+    print(f"{len(arrays)} scores of {len(arrays.functions)} functions in {len(arrays.files)} files")
+    return arrays
+
+
+# Function to calculate the standard deviation and count per function from the compact arrays
+# Sample standard deviation like pandas' std, without loading every score row into pandas
+def compact_std_devs(arrays, min_data_points):
+    import pandas as pd
+
+    count, std = function_std_counts(arrays)
+    keep = count >= max(min_data_points, 1)
+    df_std_filtered = pd.DataFrame({'function_name': [name for name, kept in zip(arrays.functions, keep) if kept],
+                                    'std_dev': std[keep], 'count': count[keep]})
+
+    # Print distribution of standard deviations
+    print(df_std_filtered.describe())
+    return df_std_filtered
+
+
+# Function to draw the distribution of standard deviations (saved if output_file is given)
+def render_std_histogram(std_devs, output_file=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    # Plot distribution of standard deviations
+    plt.figure(figsize=(10, 6))
+    sns.histplot(std_devs, bins=50, kde=True)
+    plt.title('Distribution of Standard Deviations of Function Similarity Scores')
+    plt.xlabel('Standard Deviation')
+    plt.ylabel('Frequency')
+    if output_file:
+        plt.savefig(output_file)
+
+
+# Function to draw the standard deviation per function (saved if output_file is given)
+def render_std_barplot(function_names, std_devs, output_file=None):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    # Plotting the standard deviation of similarity scores
+    plt.figure(figsize=(12, 8))
+    sns.barplot(x=std_devs, y=function_names, palette='viridis')
+    plt.title('Standard Deviation of Function Similarity Scores')
+    plt.xlabel('Standard Deviation')
+    plt.ylabel('Function Name')
+    plt.xticks(rotation=90)
+    plt.tight_layout()
+    if output_file:
+        plt.savefig(output_file)
+
+
+# Function to describe both figures as (render function, arguments) jobs
+# Only the bar_limit functions with the largest std get their own bar, the rest share an "others" bar
+def std_dev_figures(df_std_filtered, threshold, histogram_file=None, barplot_file=None, bar_limit=None):
+    df_above = df_std_filtered[df_std_filtered['std_dev'] > threshold]
+    function_names, std_devs = top_k_with_others(df_above['function_name'].tolist(), df_above['std_dev'].tolist(),
+                                                 bar_limit)
+    return [(render_std_histogram, {'std_devs': df_std_filtered['std_dev'].tolist(), 'output_file': histogram_file}),
+            (render_std_barplot, {'function_names': function_names, 'std_devs': std_devs,
+                                  'output_file': barplot_file})]
+
+
+# Function to plot the distribution and the functions above the threshold
+def plot_std_devs(df_std_filtered, threshold, show=True, histogram_file=None, barplot_file=None, bar_limit=None):
+    show_or_render(std_dev_figures(df_std_filtered, threshold, histogram_file, barplot_file, bar_limit), show)
+
+
+# Main function: find the functions whose similarity varies most across configurations
+# config keys: base_path, results_dir, db_path, arrays_dir, min_data_points, threshold, max_bars, show, figure_dir
+def main(config=None):
+    config = config or {}
+    base = os.path.expanduser(config.get('base_path', base_path))
+    arrays = load_score_arrays(resolve_path(config.get('db_path', db_path), base),
+                               resolve_path(config.get('results_dir', bindiff_results_dir), base),
+                               resolve_path(config.get('arrays_dir', arrays_dir), base))
+    df_std_filtered = compact_std_devs(arrays, config.get('min_data_points', min_data_points))
+    show = should_show(config)
+    plot_std_devs(df_std_filtered, config.get('threshold', threshold), show=show,
+                  histogram_file=None if show else figure_path(config, 'std_dev_distribution.png'),
+                  barplot_file=None if show else figure_path(config, 'std_dev_by_function.png'),
+                  bar_limit=config.get('max_bars', max_bars))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import os
+import json
+import hashlib
+import numpy as np
+from function_score_store import parse_result_name
+
+# Rows read from SQLite per batch while the arrays are built
+batch_size = 65536
+
+# Files in an arrays directory: one row per score, names and metadata in names.json
+_array_files = ('function_ids', 'file_ids', 'similarity')
+
+
+# Dictionary-encoded similarity scores: function and file ids as int32, scores as float32,
+# each a memory-mapped .npy file; names.json maps the ids back to function, file, binary
+# and config pair names. Files know their binary and config pair, so rows never repeat strings
+class ScoreArrays:
+    def __init__(self, directory, names, function_ids, file_ids, similarity):
+        self.directory = directory
+        self.functions = names['functions']
+        self.files = names['files']
+        self.binaries = names['binaries']
+        self.pairs = names['pairs']
+        self.file_binary = np.asarray(names['file_binary'], dtype=np.int32)
+        self.file_pair = np.asarray(names['file_pair'], dtype=np.int32)
+        self.signature = names['signature']
+        self.function_ids = function_ids
+        self.file_ids = file_ids
+        self.similarity = similarity
+
+    def __len__(self):
+        return len(self.similarity)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, 'names.json')) as file:
+            names = json.load(file)
+        # Rows beyond names['rows'] were never filled (rows deleted while the arrays were built)
+        arrays = [np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')[:names['rows']]
+                  for name in _array_files]
+        return cls(directory, names, *arrays)
+
+
+# Function to get a signature of the ingested results (changes whenever a .BinDiff file is re-ingested)
+def database_signature(conn):
+    digest = hashlib.sha256()
+    for filename, sha256, rows in conn.execute("SELECT filename, sha256, rows FROM ingested_files ORDER BY filename"):
+        digest.update(f"{filename}\0{sha256}\0{rows}\n".encode())
+    return digest.hexdigest()
+
+
+# Function to build the arrays from the similarity_scores table, streaming rows in batches
+# Names are interned into ids as they are seen; the score arrays are filled in place on disk
+def build_score_arrays(conn, directory):
+    os.makedirs(directory, exist_ok=True)
+    signature = database_signature(conn)
+    total = conn.execute("SELECT COUNT(*) FROM similarity_scores").fetchone()[0]
+    paths = {name: os.path.join(directory, f'{name}.npy') for name in _array_files}
+    function_ids = np.lib.format.open_memmap(paths['function_ids'] + '.tmp', mode='w+', dtype=np.int32,
+                                             shape=(total,))
+    file_ids = np.lib.format.open_memmap(paths['file_ids'] + '.tmp', mode='w+', dtype=np.int32, shape=(total,))
+    similarity = np.lib.format.open_memmap(paths['similarity'] + '.tmp', mode='w+', dtype=np.float32,
+                                           shape=(total,))
+
+    function_index, file_index, binary_index, pair_index = {}, {}, {}, {}
+    file_binary, file_pair = [], []
+    position = 0
+    cursor = conn.execute("SELECT filename, function_name, similarity FROM similarity_scores")
+    while position < total:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        rows = rows[:total - position]
+        filenames, function_names, scores = zip(*rows)
+        # Only names not seen before need an id; dict.fromkeys keeps first-seen order
+        for filename in dict.fromkeys(filenames):
+            if filename not in file_index:
+                file_index[filename] = len(file_index)
+                binary, config1, config2 = parse_result_name(filename or '')
+                file_binary.append(binary_index.setdefault(binary, len(binary_index)))
+                file_pair.append(pair_index.setdefault(f"{config1}_vs_{config2}", len(pair_index)))
+        for function_name in dict.fromkeys(function_names):
+            if function_name not in function_index:
+                function_index[function_name] = len(function_index)
+        end = position + len(rows)
+        function_ids[position:end] = [function_index[name] for name in function_names]
+        file_ids[position:end] = [file_index[name] for name in filenames]
+        similarity[position:end] = np.array(scores, dtype=np.float64)
+        position = end
+
+    for array in (function_ids, file_ids, similarity):
+        array.flush()
+    del function_ids, file_ids, similarity
+    for path in paths.values():
+        os.replace(path + '.tmp', path)
+    names = {'signature': signature, 'rows': position,
+             'functions': list(function_index), 'files': list(file_index),
+             'binaries': list(binary_index), 'pairs': list(pair_index),
+             'file_binary': file_binary, 'file_pair': file_pair}
+    with open(os.path.join(directory, 'names.json.tmp'), 'w') as file:
+        json.dump(names, file)
+    os.replace(os.path.join(directory, 'names.json.tmp'), os.path.join(directory, 'names.json'))
+    return ScoreArrays.load(directory)
+
+
+# Function to open the arrays of a similarity scores database, rebuilding them if the database changed
+def open_score_arrays(conn, directory):
+    try:
+        arrays = ScoreArrays.load(directory)
+    except (OSError, ValueError, KeyError):
+        arrays = None
+    if arrays is not None and arrays.signature == database_signature(conn):
+        return arrays
+    print(f"Building compact score arrays in {directory}")
+    return build_score_arrays(conn, directory)
+
+
+# Function to compute the count and sample standard deviation (ddof=1) of the scores of every function
+# Segmented reductions over the function ids (np.bincount), two-pass for accuracy; std is NaN below 2 scores
+def function_std_counts(arrays):
+    valid = ~np.isnan(arrays.similarity)
+    ids = np.asarray(arrays.function_ids)[valid]
+    scores = np.asarray(arrays.similarity, dtype=np.float64)[valid]
+    size = len(arrays.functions)
+    count = np.bincount(ids, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(ids, weights=scores, minlength=size) / count
+        m2 = np.bincount(ids, weights=(scores - mean[ids]) ** 2, minlength=size)
+        std = np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+    return count, std
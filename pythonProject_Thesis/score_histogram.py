@@ -0,0 +1,136 @@
+import sqlite3
+import numpy as np
+from bindiff_aggregate import merge_moments, similarity_histogram
+
+# Fine bins over the BinDiff similarity range; the coarse histograms of the plots are
+# sums of these, so their edges are exact to 1/3840
+default_bins = 3840
+score_range = (0.0, 1.0)
+
+
+# Fixed-bin histogram of similarity scores that is filled file by file
+# Only the bin counts and running moments (count, mean, M2 merged like SimilarityMatrix) are kept,
+# never the raw scores
+class ScoreHistogram:
+    def __init__(self, bins=default_bins, value_range=score_range):
+        self.edges = np.linspace(value_range[0], value_range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.n = 0
+        self.mean_value = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    # Function to fold a batch of scores into the histogram
+    def add(self, scores):
+        scores = np.asarray(scores, dtype=np.float64)
+        scores = scores[np.isfinite(scores)]
+        if scores.size == 0:
+            return
+        # Scores outside the range land in the first/last bin instead of being dropped
+        clipped = np.clip(scores, self.edges[0], self.edges[-1])
+        self.counts += np.histogram(clipped, bins=self.edges)[0]
+        mean = float(scores.mean())
+        self.n, self.mean_value, self.m2 = merge_moments(self.n, self.mean_value, self.m2, scores.size, mean,
+                                                         float(np.square(scores - mean).sum()))
+        self.min = min(self.min, float(scores.min()))
+        self.max = max(self.max, float(scores.max()))
+
+    # Function to fold aggregates computed elsewhere (see bindiff_aggregate.similarity_histogram)
+    def add_aggregates(self, aggregates):
+        if not aggregates['n']:
+            return
+        for bucket, count in aggregates['buckets'].items():
+            self.counts[bucket] += count
+        self.n, self.mean_value, self.m2 = merge_moments(self.n, self.mean_value, self.m2, aggregates['n'],
+                                                         aggregates['mean'], aggregates['m2'])
+        self.min = min(self.min, aggregates['min'])
+        self.max = max(self.max, aggregates['max'])
+
+    # Function to combine another histogram with the same bins into this one
+    def merge(self, other):
+        self.counts += other.counts
+        self.n, self.mean_value, self.m2 = merge_moments(self.n, self.mean_value, self.m2, other.n,
+                                                         other.mean_value, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.mean_value if self.n else float('nan')
+
+    def std(self):
+        if self.n < 2:
+            return 0.0
+        return float(np.sqrt(self.m2 / (self.n - 1)))
+
+    # Function to sum fine bins into a coarser histogram over the data range, returns (counts, edges)
+    # Like plt.hist(scores, bins), the coarse bins span min..max of the scores; their edges are
+    # rounded to the fine bin edges, so bin widths differ by at most one fine bin
+    def rebin(self, bins):
+        if not self.n:
+            return np.zeros(bins, dtype=np.int64), np.linspace(self.edges[0], self.edges[-1], bins + 1)
+        fine = len(self.counts)
+        first, last = (int(np.clip(np.searchsorted(self.edges, value, side='right') - 1, 0, fine - 1))
+                       for value in (self.min, self.max))
+        # Fewer occupied fine bins than coarse bins: every fine bin becomes a coarse bin
+        boundaries = np.unique(np.round(np.linspace(first, last + 1, min(bins, last + 1 - first) + 1)).astype(int))
+        return np.add.reduceat(self.counts[:boundaries[-1]], boundaries[:-1]), self.edges[boundaries]
+
+    # Function to compute a Gaussian KDE by FFT convolution of the binned counts
+    # Uses Scott's rule like seaborn/scipy and extends the grid by 3 bandwidths on each side
+    def kde(self, bw_adjust=1.0, cut=3):
+        width = self.edges[1] - self.edges[0]
+        if self.n < 2:
+            return self.edges[:-1] + width / 2, np.zeros(len(self.counts))
+        bandwidth = bw_adjust * self.std() * self.n ** (-1 / 5)
+        # Identical scores: use one bin width so the kernel is still defined
+        bandwidth = max(bandwidth, width)
+
+        pad = int(np.ceil(cut * bandwidth / width))
+        counts = np.concatenate([np.zeros(pad), self.counts, np.zeros(pad)])
+        grid = self.edges[0] + (np.arange(len(counts)) - pad + 0.5) * width
+
+        offsets = np.arange(-pad, pad + 1) * width
+        kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+        kernel /= kernel.sum() * width
+
+        # Linear (not circular) convolution through zero-padded real FFTs
+        size = len(counts) + len(kernel) - 1
+        fft_size = 1 << (size - 1).bit_length()
+        density = np.fft.irfft(np.fft.rfft(counts, fft_size) * np.fft.rfft(kernel, fft_size), fft_size)
+        density = density[pad:pad + len(counts)] / self.n
+        density = np.maximum(density, 0.0)
+
+        # Keep the part of the grid within cut bandwidths of the observed data
+        keep = (grid >= self.min - cut * bandwidth) & (grid <= self.max + cut * bandwidth)
+        return grid[keep], density[keep]
+
+
+# Function to stream the similarity scores of a .BinDiff file in NumPy batches
+def iter_score_batches(sqlite_file, batch_size=65536):
+    conn = sqlite3.connect(f'file:{sqlite_file}?mode=ro', uri=True)
+    try:
+        cursor = conn.execute("SELECT similarity FROM main.function")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield np.array([row[0] for row in rows], dtype=np.float64)
+    finally:
+        conn.close()
+
+
+# Function to fold all scores of one .BinDiff file into a histogram
+def add_bindiff_file(histogram, sqlite_file):
+    for batch in iter_score_batches(sqlite_file):
+        histogram.add(batch)
+    return histogram
+
+
+# Function to fold the scores of many .BinDiff files into a histogram
+# The files are attached in batches and bucketed inside SQLite, no score rows reach Python
+def add_bindiff_files(histogram, sqlite_files):
+    bins = len(histogram.counts)
+    histogram.add_aggregates(similarity_histogram(sqlite_files, bins, (histogram.edges[0], histogram.edges[-1])))
+    return histogram
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+from bindiff_cache import file_sha256
+
+
+# Function to create the similarity_scores schema, its indexes and the ingestion ledger
+def ensure_schema(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS similarity_scores
+                 (filename TEXT, function_name TEXT, similarity REAL)''')
+    # Older databases may predate the filename column
+    columns = [info[1] for info in c.execute("PRAGMA table_info(similarity_scores)").fetchall()]
+    if 'filename' not in columns:
+        c.execute('ALTER TABLE similarity_scores ADD COLUMN filename TEXT')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_similarity_scores_filename
+                 ON similarity_scores (filename)''')
+    # Covers the per-function std/count query without touching the table
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_similarity_scores_function
+                 ON similarity_scores (function_name, similarity)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS ingested_files
+                 (filename TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT, rows INTEGER)''')
+    conn.commit()
+
+
+# Function to read BinDiff SQLite result files and extract similarity scores
+def extract_similarity_scores_from_sqlite(result_file):
+    scores = []
+    try:
+        db_conn = sqlite3.connect(f'file:{result_file}?mode=ro', uri=True)
+        try:
+            scores = db_conn.execute("SELECT name1, similarity FROM function").fetchall()
+        finally:
+            db_conn.close()
+    except sqlite3.Error as e:
+        print(f"SQLite error: {e}")
+    return scores
+
+
+# Function to list the .BinDiff files below the results directory, keyed by relative path
+def find_result_files(results_dir):
+    result_files = {}
+    for root, dirs, files in os.walk(results_dir):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith('.BinDiff'):
+                path = os.path.join(root, file)
+                result_files[os.path.relpath(path, results_dir)] = path
+    return result_files
+
+
+# Function to ingest new or changed .BinDiff files into the similarity_scores table
+# Unchanged files (same size and mtime, or same content hash) are skipped, so re-runs
+# never duplicate rows; everything is written in a single transaction
+def ingest_bindiff_results(conn, results_dir):
+    ensure_schema(conn)
+    ledger = {row[0]: row[1:] for row in
+              conn.execute("SELECT filename, size, mtime_ns, sha256 FROM ingested_files").fetchall()}
+    result_files = find_result_files(results_dir)
+    stats = {'ingested': 0, 'unchanged': 0, 'removed': 0, 'rows': 0}
+
+    with conn:
+        for filename, path in result_files.items():
+            st = os.stat(path)
+            previous = ledger.get(filename)
+            if previous is not None and previous[0] == st.st_size and previous[1] == st.st_mtime_ns:
+                stats['unchanged'] += 1
+                continue
+            digest = file_sha256(path)
+            if previous is not None and previous[2] == digest:
+                # Touched but not changed, only refresh the ledger
+                conn.execute("UPDATE ingested_files SET size = ?, mtime_ns = ? WHERE filename = ?",
+                             (st.st_size, st.st_mtime_ns, filename))
+                stats['unchanged'] += 1
+                continue
+
+            scores = extract_similarity_scores_from_sqlite(path)
+            if not scores:
+                print(f"No function similarity scores found in: {filename}")
+            conn.execute("DELETE FROM similarity_scores WHERE filename = ?", (filename,))
+            conn.executemany('INSERT INTO similarity_scores (filename, function_name, similarity) VALUES (?, ?, ?)',
+                             ((filename, name, similarity) for name, similarity in scores))
+            conn.execute("INSERT OR REPLACE INTO ingested_files (filename, size, mtime_ns, sha256, rows) "
+                         "VALUES (?, ?, ?, ?, ?)", (filename, st.st_size, st.st_mtime_ns, digest, len(scores)))
+            stats['ingested'] += 1
+            stats['rows'] += len(scores)
+
+        # The first ledgered run drops rows left over from the old append-only ingestion
+        if not ledger:
+            conn.execute("DELETE FROM similarity_scores WHERE filename IS NULL "
+                         "OR filename NOT IN (SELECT filename FROM ingested_files)")
+
+        # Forget results that were deleted from the results directory
+        for filename in set(ledger) - set(result_files):
+            conn.execute("DELETE FROM similarity_scores WHERE filename = ?", (filename,))
+            conn.execute("DELETE FROM ingested_files WHERE filename = ?", (filename,))
+            stats['removed'] += 1
+
+    print(f"Ingested {stats['ingested']} files ({stats['rows']} rows), "
+          f"skipped {stats['unchanged']} unchanged, removed {stats['removed']}")
+    return stats
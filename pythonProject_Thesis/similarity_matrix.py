@@ -0,0 +1,127 @@
+import os
+import numpy as np
+
+
+# Dense (primary, secondary) similarity matrix updated one result at a time
+# Keeps count, mean and M2 per cell (Welford), so mean ± std is available at any
+# moment and partial matrices from other workers or hosts can be merged exactly
+class SimilarityMatrix:
+    def __init__(self, labels=()):
+        self.labels = []
+        self.index = {}
+        self.count = np.zeros((0, 0), dtype=np.int64)
+        self.mean = np.zeros((0, 0), dtype=np.float64)
+        self.m2 = np.zeros((0, 0), dtype=np.float64)
+        self.add_labels(labels)
+
+    # Function to grow the matrix with labels it does not know yet
+    def add_labels(self, labels):
+        new_labels = [label for label in dict.fromkeys(labels) if label not in self.index]
+        if not new_labels:
+            return
+        for label in new_labels:
+            self.index[label] = len(self.labels)
+            self.labels.append(label)
+        size = len(self.labels)
+        old = self.count.shape[0]
+        for name in ('count', 'mean', 'm2'):
+            grown = np.zeros((size, size), dtype=getattr(self, name).dtype)
+            grown[:old, :old] = getattr(self, name)
+            setattr(self, name, grown)
+
+    # Function to fold one similarity result into its cell (Welford update)
+    def add(self, primary, secondary, similarity):
+        self.add_labels((primary, secondary))
+        i, j = self.index[primary], self.index[secondary]
+        self.count[i, j] += 1
+        delta = similarity - self.mean[i, j]
+        self.mean[i, j] += delta / self.count[i, j]
+        self.m2[i, j] += delta * (similarity - self.mean[i, j])
+
+    # Function to merge another matrix into this one (Chan et al. pairwise combination)
+    def merge(self, other):
+        self.add_labels(other.labels)
+        idx = np.array([self.index[label] for label in other.labels], dtype=np.intp)
+        if idx.size == 0:
+            return self
+        cells = np.ix_(idx, idx)
+        n_a = self.count[cells].astype(np.float64)
+        n_b = other.count.astype(np.float64)
+        n = n_a + n_b
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = other.mean - self.mean[cells]
+            mean = np.where(n > 0, self.mean[cells] + delta * n_b / n, 0.0)
+            m2 = np.where(n > 0, self.m2[cells] + other.m2 + delta ** 2 * n_a * n_b / n, 0.0)
+        self.count[cells] = n.astype(np.int64)
+        self.mean[cells] = mean
+        self.m2[cells] = m2
+        return self
+
+    # Function to get the mean matrix (NaN where no result was seen), in the given label order
+    def mean_matrix(self, labels=None):
+        self.add_labels(labels or ())
+        return self._reindex(np.where(self.count > 0, self.mean, np.nan), labels)
+
+    # Function to get the sample standard deviation matrix (ddof=1, like pandas)
+    def std_matrix(self, labels=None):
+        self.add_labels(labels or ())
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+        return self._reindex(std, labels)
+
+    def _reindex(self, matrix, labels):
+        if labels is None:
+            return matrix
+        idx = np.array([self.index[label] for label in labels], dtype=np.intp)
+        return matrix[np.ix_(idx, idx)] if idx.size else np.zeros((0, 0))
+
+    # Function to build the "mean ± std" annotation table shown on the heatmap
+    def combined_table(self, labels=None):
+        labels = list(self.labels if labels is None else labels)
+        mean = self.mean_matrix(labels)
+        std = self.std_matrix(labels)
+        table = np.empty(mean.shape, dtype=object)
+        for i in range(len(labels)):
+            for j in range(len(labels)):
+                if i == j:
+                    table[i, j] = '0.00 ± 0.00'
+                elif np.isnan(mean[i, j]):
+                    table[i, j] = '- ± -'
+                elif np.isnan(std[i, j]):
+                    table[i, j] = f'{mean[i, j]:.2f} ± -'
+                else:
+                    table[i, j] = f'{mean[i, j]:.2f} ± {std[i, j]:.2f}'
+        return table
+
+    # Function to get the symmetric distance matrix (1 - similarity/100) used as MDS input
+    def distance_matrix(self, labels=None):
+        labels = list(self.labels if labels is None else labels)
+        self.add_labels(labels)
+        count = self._reindex(self.count, labels).astype(np.float64)
+        total = self._reindex(self.mean * self.count, labels)
+        # Combine both directions of a pair, e.g. results diffed as (a, b) and as (b, a)
+        pair_count = count + count.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            similarity = np.where(pair_count > 0, (total + total.T) / pair_count, 0.0)
+        distance = 1 - (similarity / 100.0)
+        np.fill_diagonal(distance, 0)
+        return distance
+
+    # Function to save the accumulator state so another process or host can merge it
+    def save(self, path):
+        # Written next to the target and renamed in, so a crash never leaves a truncated state file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, labels=np.array(self.labels, dtype=str), count=self.count, mean=self.mean, m2=self.m2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as state:
+            matrix = cls()
+            matrix.labels = [str(label) for label in state['labels']]
+            matrix.index = {label: i for i, label in enumerate(matrix.labels)}
+            matrix.count = state['count'].astype(np.int64)
+            matrix.mean = state['mean'].astype(np.float64)
+            matrix.m2 = state['m2'].astype(np.float64)
+        return matrix
@@ -0,0 +1,192 @@
+import os
+import re
+import sys
+import shutil
+import hashlib
+from bindiversity_config import resolve_path
+from similarity_matrix import SimilarityMatrix
+from sweep_state import open_sweep_state
+
+# Part of the pairwise workload this host runs, 'i/N' with 0 <= i < N (unset runs every pair)
+sweep_shard = os.environ.get('BINDIFF_SHARD')
+
+# Set the base path to the Desktop (where the matrix sweep keeps its state)
+base_path = os.path.join(os.path.expanduser("~"), "Desktop")
+
+# Directory for BinDiff results (relative to the base path)
+bindiff_results_dir = 'bindiff_results'
+
+# Files written per shard: <name>.shard-<i>-of-<N><extension>
+_shard_file = re.compile(r'^(?P<name>.+)\.shard-(?P<index>\d+)-of-(?P<count>\d+)(?P<extension>\.[A-Za-z0-9]+)$')
+
+# Result files collected by the merge
+_result_extensions = ('.BinDiff', '.log')
+
+
+# Function to parse a shard given as 'i/N'; returns (i, N), or None for no sharding
+def parse_shard(shard):
+    if shard is None or shard == '':
+        return None
+    if isinstance(shard, (tuple, list)):
+        index, count = shard
+    else:
+        match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', str(shard))
+        if not match:
+            raise ValueError(f"Shard must look like i/N (e.g. 0/4), got {shard!r}")
+        index, count = int(match.group(1)), int(match.group(2))
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index must be in 0..{count - 1}, got {index}/{count}")
+    return index, count
+
+
+# Function to get the file name suffix of a shard's state files ('' without sharding)
+def shard_suffix(shard):
+    return '' if shard is None else f'.shard-{shard[0]}-of-{shard[1]}'
+
+
+# Function to get the shard a job belongs to
+# Hashes the configuration labels and binary name only, so every host computes the same split
+# no matter where its inputs are mounted. by_binary keeps all pairs of a binary in one shard
+# (batch mode diffs them in one process and one batch directory)
+def job_shard(job, count, by_binary=False):
+    binary = job.get('binary') or os.path.basename(job['primary'])
+    key = binary if by_binary else f"{job['primary_label']}\0{job['secondary_label']}\0{binary}"
+    return int(hashlib.sha256(key.encode()).hexdigest()[:16], 16) % count
+
+
+# Function to keep the jobs of one shard (all jobs without sharding)
+def shard_jobs(jobs, shard, by_binary=False):
+    if shard is None:
+        return list(jobs)
+    index, count = shard
+    selected = [job for job in jobs if job_shard(job, count, by_binary) == index]
+    print(f"Shard {index}/{count}: {len(selected)} of {len(jobs)} jobs")
+    return selected
+
+
+# Function to find the per-shard files of one kind in a directory, as {(i, N): path}
+def find_shard_files(directory, name, extension):
+    found = {}
+    if os.path.isdir(directory):
+        for file in sorted(os.listdir(directory)):
+            match = _shard_file.match(file)
+            if match and match.group('name') == name and match.group('extension') == extension:
+                found[(int(match.group('index')), int(match.group('count')))] = os.path.join(directory, file)
+    return found
+
+
+# Function to report shards that are missing from a set of shard files
+def missing_shards(shards):
+    return [f"{index}/{count}" for count in sorted({count for _, count in shards})
+            for index in range(count) if (index, count) not in shards]
+
+
+# Function to combine the per-shard matrix states into one matrix
+def merge_matrices(paths):
+    matrix = SimilarityMatrix()
+    for path in paths:
+        matrix.merge(SimilarityMatrix.load(path))
+    return matrix
+
+
+# Function to copy the stored results and journal of shard sweep states into one sweep state
+def merge_sweep_states(conn, paths):
+    merged = 0
+    for path in paths:
+        conn.execute("ATTACH DATABASE ? AS shard", (path,))
+        try:
+            with conn:
+                merged += conn.execute(
+                    "INSERT OR REPLACE INTO pair_results SELECT * FROM shard.pair_results").rowcount
+                conn.execute("INSERT OR REPLACE INTO jobs SELECT * FROM shard.jobs")
+        finally:
+            conn.execute("DETACH DATABASE shard")
+    return merged
+
+
+# Function to copy the .BinDiff and .log files of other results directories into one
+# Files keep their path relative to the results directory; unchanged copies are skipped
+def merge_result_dirs(sources, destination):
+    copied = 0
+    for source in sources:
+        if os.path.abspath(source) == os.path.abspath(destination) or not os.path.isdir(source):
+            continue
+        for root, dirs, files in os.walk(source):
+            target_root = os.path.join(destination, os.path.relpath(root, source))
+            for file in files:
+                if not file.endswith(_result_extensions):
+                    continue
+                src = os.path.join(root, file)
+                dst = os.path.join(target_root, file)
+                st = os.stat(src)
+                try:
+                    current = os.stat(dst)
+                    if current.st_size == st.st_size and current.st_mtime_ns >= st.st_mtime_ns:
+                        continue
+                except FileNotFoundError:
+                    pass
+                os.makedirs(target_root, exist_ok=True)
+                shutil.copy2(src, dst)
+                copied += 1
+    return copied
+
+
+# Main function: merge the outputs of sharded sweeps into the base path
+# Every input directory is the base path of one host (all shards share the base path on a shared
+# filesystem); its shard matrix states, shard sweep states and results directory are merged
+# config keys: base_path, results_dir, inputs
+def main(config=None):
+    config = config or {}
+    base = os.path.expanduser(config.get('base_path', base_path))
+    results_name = config.get('results_dir', bindiff_results_dir)
+    results_dir = resolve_path(results_name, base)
+    inputs = [os.path.expanduser(path) for path in config.get('inputs') or [base]]
+    os.makedirs(results_dir, exist_ok=True)
+
+    matrix_files, state_files, result_state_files = {}, {}, {}
+    for directory in inputs:
+        matrix_files.update(find_shard_files(directory, 'similarity_matrix_state', '.npz'))
+        state_files.update(find_shard_files(directory, 'sweep_state', '.db'))
+        # The save-log sweep keeps its state in the results directory
+        result_state_files.update(find_shard_files(resolve_path(results_name, directory), 'sweep_state', '.db'))
+    if not matrix_files and not result_state_files:
+        print(f"No shard outputs found in {', '.join(inputs)}")
+        return 1
+    # Shards of different splits overlap, merging them would count pairs twice
+    for kind, shards in (('matrix', matrix_files), ('sweep', result_state_files)):
+        counts = sorted({count for _, count in shards})
+        if len(counts) > 1:
+            print(f"Found {kind} shards of {len(counts)} different splits (of {', '.join(map(str, counts))}); "
+                  f"remove the outputs of the old split before merging")
+            return 1
+
+    copied = merge_result_dirs([resolve_path(results_name, directory) for directory in inputs], results_dir)
+    print(f"Copied {copied} result files into {results_dir}")
+
+    for target, shards in ((os.path.join(base, 'sweep_state.db'), state_files),
+                           (os.path.join(results_dir, 'sweep_state.db'), result_state_files)):
+        if shards:
+            conn = open_sweep_state(target)
+            try:
+                merged = merge_sweep_states(conn, list(shards.values()))
+            finally:
+                conn.close()
+            print(f"Merged {merged} pair results from {len(shards)} shard states into {target}")
+
+    status = 0
+    for kind, shards in (('matrix', matrix_files), ('sweep', result_state_files)):
+        missing = missing_shards(shards)
+        if missing:
+            print(f"Missing {kind} shards {', '.join(missing)}: the merged results are incomplete")
+            status = 1
+
+    if matrix_files:
+        matrix = merge_matrices(list(matrix_files.values()))
+        matrix.save(os.path.join(base, 'similarity_matrix_state.npz'))
+        print(f"Merged {len(matrix_files)} shard matrices ({int(matrix.count.sum())} results) into "
+              f"{os.path.join(base, 'similarity_matrix_state.npz')}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+import os
+import time
+import sqlite3
+import threading
+from bindiff_cache import file_sha256
+from bindiff_results import bindiff_output_name
+from similarity_matrix import SimilarityMatrix
+
+# States of a job in the journal: planned, handed to BinDiff, finished with a result, finished without one
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+# Runners mark jobs as running from their own threads; writes are serialized so the two
+# statements of a result are never split by another thread's commit
+_lock = threading.Lock()
+
+
+# Function to open (and create) the persistent sweep state next to the results
+def open_sweep_state(db_path):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute('''CREATE TABLE IF NOT EXISTS pair_results
+                    (primary_label TEXT, secondary_label TEXT, binary TEXT,
+                     primary_sha256 TEXT, secondary_sha256 TEXT,
+                     similarity REAL, output_file TEXT,
+                     PRIMARY KEY (primary_label, secondary_label, binary))''')
+    # Journal of every planned job; a job still 'running' when a sweep starts was interrupted
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs
+                    (primary_label TEXT, secondary_label TEXT, binary TEXT,
+                     primary_path TEXT, secondary_path TEXT,
+                     primary_sha256 TEXT, secondary_sha256 TEXT, output_file TEXT,
+                     state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, updated REAL,
+                     PRIMARY KEY (primary_label, secondary_label, binary))''')
+    conn.commit()
+    return conn
+
+
+# Function to attach the binary name and input hashes a result depends on to a job
+def fingerprint_job(job):
+    job.setdefault('binary', os.path.basename(job['primary']))
+    job['primary_sha256'] = file_sha256(job['primary'])
+    job['secondary_sha256'] = file_sha256(job['secondary'])
+    return job
+
+
+# Function to get the key of a job in the journal and the result table
+def job_key(job):
+    return job['primary_label'], job['secondary_label'], job['binary']
+
+
+# Function to get the .BinDiff file a job writes (runners use BinDiff's own <primary>_vs_<secondary> name)
+def expected_output(job):
+    if job.get('output_file'):
+        return job['output_file']
+    if job.get('output_dir'):
+        return os.path.join(job['output_dir'], bindiff_output_name(job['primary'], job['secondary']))
+    return None
+
+
+# Function to split planned jobs into those that still need a diff and those already stored
+# A stored result only counts if both inputs still have the hashes it was computed from,
+# so a rebuilt configuration is re-diffed automatically. Every planned job is written to the
+# journal; jobs left 'running' by an interrupted sweep lose their possibly half written output
+def plan_missing_jobs(conn, jobs):
+    stored = set(conn.execute(
+        "SELECT primary_label, secondary_label, binary, primary_sha256, secondary_sha256 "
+        "FROM pair_results WHERE similarity IS NOT NULL "
+        "UNION SELECT primary_label, secondary_label, binary, primary_sha256, secondary_sha256 "
+        "FROM jobs WHERE state = ?", (DONE,)))
+    running = {row[:3]: row[3] for row in conn.execute(
+        "SELECT primary_label, secondary_label, binary, output_file FROM jobs WHERE state = ?", (RUNNING,))}
+    missing = []
+    done = []
+    interrupted = 0
+    for job in jobs:
+        fingerprint_job(job)
+        key = job_key(job)
+        if key + (job['primary_sha256'], job['secondary_sha256']) in stored:
+            done.append(job)
+            continue
+        missing.append(job)
+        if key in running:
+            interrupted += 1
+            if running[key] and os.path.isfile(running[key]):
+                os.remove(running[key])
+
+    now = time.time()
+    with _lock, conn:
+        # Attempts are kept across runs until an input changes
+        conn.executemany(
+            "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?) "
+            "ON CONFLICT (primary_label, secondary_label, binary) DO UPDATE SET "
+            "attempts = CASE WHEN jobs.primary_sha256 = excluded.primary_sha256 "
+            "AND jobs.secondary_sha256 = excluded.secondary_sha256 THEN jobs.attempts ELSE 0 END, "
+            "primary_path = excluded.primary_path, secondary_path = excluded.secondary_path, "
+            "primary_sha256 = excluded.primary_sha256, secondary_sha256 = excluded.secondary_sha256, "
+            "output_file = COALESCE(jobs.output_file, excluded.output_file), "
+            "state = excluded.state, updated = excluded.updated",
+            [job_key(job) + (job['primary'], job['secondary'], job['primary_sha256'], job['secondary_sha256'],
+                             expected_output(job), state, now)
+             for state, planned in ((PENDING, missing), (DONE, done)) for job in planned])
+    if interrupted:
+        print(f"Resuming: {interrupted} jobs were interrupted while running, their partial output was removed")
+    return missing, done
+
+
+# Function to mark jobs as started; runners call it when a job actually starts (see on_start)
+def mark_running(conn, jobs):
+    now = time.time()
+    with _lock, conn:
+        conn.executemany("UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? "
+                         "WHERE primary_label = ? AND secondary_label = ? AND binary = ?",
+                         [(RUNNING, now) + job_key(job) for job in jobs])
+
+
+# Function to store the result of one job (None similarity marks a failed pair)
+# The result and the journal state are written in one transaction, so a crash never leaves a job
+# 'done' without its result. state can mark a job with a similarity as failed (e.g. a failed run),
+# but a job without a similarity is never done: it would be skipped by every later run.
+# Only an output file that exists is journaled
+def record_result(conn, job, similarity, output_file=None, state=None):
+    if 'primary_sha256' not in job:
+        fingerprint_job(job)
+    if state is None or similarity is None:
+        state = DONE if similarity is not None else FAILED
+    if output_file is not None and not os.path.isfile(output_file):
+        output_file = None
+    with _lock, conn:
+        conn.execute("INSERT OR REPLACE INTO pair_results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     job_key(job) + (job['primary_sha256'], job['secondary_sha256'], similarity, output_file))
+        conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?) "
+                     "ON CONFLICT (primary_label, secondary_label, binary) DO UPDATE SET "
+                     "output_file = COALESCE(excluded.output_file, jobs.output_file), "
+                     "state = excluded.state, updated = excluded.updated",
+                     job_key(job) + (job['primary'], job['secondary'], job['primary_sha256'],
+                                     job['secondary_sha256'], output_file, state, time.time()))
+
+
+# Function to rebuild the similarity matrix from the stored results of the given jobs
+def load_matrix(conn, jobs, labels):
+    matrix = SimilarityMatrix(labels)
+    wanted = {job_key(job): (job['primary_sha256'], job['secondary_sha256']) for job in jobs}
+    for row in conn.execute("SELECT primary_label, secondary_label, binary, primary_sha256, secondary_sha256, "
+                            "similarity FROM pair_results WHERE similarity IS NOT NULL"):
+        if wanted.get(row[:3]) == row[3:5]:
+            matrix.add(row[0], row[1], row[5])
+    return matrix
+
+
+# Function to forget results of configurations that are no longer part of the sweep
+def prune_removed_configurations(conn, labels):
+    placeholders = ', '.join('?' for _ in labels)
+    removed = conn.execute(f"DELETE FROM pair_results WHERE primary_label NOT IN ({placeholders}) "
+                           f"OR secondary_label NOT IN ({placeholders})", list(labels) * 2).rowcount
+    conn.execute(f"DELETE FROM jobs WHERE primary_label NOT IN ({placeholders}) "
+                 f"OR secondary_label NOT IN ({placeholders})", list(labels) * 2)
+    conn.commit()
+    return removed